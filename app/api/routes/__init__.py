@@ -1,3 +1,3 @@
-from . import annotations, health, layers, tiles
+from . import annotations, cache_admin, health, layers, tiles
 
-__all__ = ["annotations", "health", "layers", "tiles"]
+__all__ = ["annotations", "cache_admin", "health", "layers", "tiles"]
@@ -0,0 +1,235 @@
+from __future__ import annotations
+
+from datetime import date as DateType
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import FileResponse
+
+from app.broadcast.nasa import get_nasa_broadcast
+from app.cache_index import KeyFilter
+from app.core.config import settings
+from app.dependencies import limit_db_requests, require_cache_admin_secret
+from app.export import ExportSpec, TileExporter, export_path, prune_exports
+from app.jobs import Job, job_registry
+from app.layers_catalog import TEMPORAL_NONE, get_layer, layer_temporal
+from app.schemas import ExportRequest, WarmupRequest
+from app.tiling import BBox
+from app.warmup import TileWarmer, WarmupSpec
+
+MBTILES_MEDIA_TYPE = "application/x-sqlite3"
+
+router = APIRouter(
+    prefix="/v1/admin/cache",
+    tags=["Cache"],
+    dependencies=[Depends(require_cache_admin_secret), Depends(limit_db_requests)],
+)
+
+
+def _key_filter(
+    layer_key: str = Query(..., alias="layerKey", description="Identificador de la capa"),
+    date: Optional[DateType] = Query(None, description="Fecha de los tiles"),
+    min_zoom: Optional[int] = Query(None, ge=0, alias="minZoom", description="Zoom minimo"),
+    max_zoom: Optional[int] = Query(None, ge=0, alias="maxZoom", description="Zoom maximo"),
+) -> KeyFilter:
+    return KeyFilter(
+        layer=layer_key,
+        date=date.isoformat() if date else None,
+        min_zoom=min_zoom,
+        max_zoom=max_zoom,
+    )
+
+
+@router.get("/stats", summary="Estadisticas del cache de tiles por capa")
+async def cache_stats() -> dict:
+    broadcast = get_nasa_broadcast()
+    return {
+        "layers": await broadcast.cache.alayer_stats(),
+        "dedup": await broadcast.cache.adedup_stats(),
+        "tiles": broadcast.stats(),
+    }
+
+
+@router.get("/entries", summary="Listar entradas del cache por capa, fecha y zoom")
+async def list_cache_entries(
+    key_filter: KeyFilter = Depends(_key_filter),
+    limit: int = Query(100, ge=1, le=1000, description="Maximo de entradas devueltas"),
+) -> dict:
+    entries = await get_nasa_broadcast().cache.aentries(key_filter, limit)
+    return {
+        "items": [
+            {"key": entry.key, "size": entry.size, "expiresAt": entry.expires_at}
+            for entry in entries
+        ]
+    }
+
+
+@router.delete("/entries", summary="Purgar entradas del cache por capa, fecha y zoom")
+async def purge_cache_entries(key_filter: KeyFilter = Depends(_key_filter)) -> dict:
+    entries, size = await get_nasa_broadcast().cache.apurge(key_filter)
+    return {"status": "purged", "entries": entries, "bytes": size}
+
+
+@router.post(
+    "/warmup",
+    status_code=status.HTTP_202_ACCEPTED,
+    summary="Precargar el cache para capas, fechas, bbox y rango de zoom",
+)
+async def start_warmup(payload: WarmupRequest) -> dict:
+    for layer_key in payload.layer_keys:
+        if get_layer(layer_key) is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail={
+                    "status": "not_found",
+                    "code": "layer_not_found",
+                    "message": f"La capa '{layer_key}' no esta registrada.",
+                },
+            )
+    extent = payload.bbox
+    spec = WarmupSpec(
+        layer_keys=tuple(payload.layer_keys),
+        bbox=BBox(
+            min_lon=extent.min_lon,
+            min_lat=extent.min_lat,
+            max_lon=extent.max_lon,
+            max_lat=extent.max_lat,
+        ),
+        min_zoom=payload.min_zoom,
+        max_zoom=payload.max_zoom,
+        dates=tuple(payload.dates) or (None,),
+    )
+    concurrency = payload.concurrency or settings.tile_warmup_concurrency
+
+    async def run(job: Job) -> dict:
+        def report(progress) -> None:
+            job.progress = progress.to_dict()
+
+        warmer = TileWarmer(get_nasa_broadcast(), spec, concurrency=concurrency, on_progress=report)
+        return (await warmer.run()).to_dict()
+
+    return job_registry.start("warmup", run).to_dict()
+
+
+@router.post(
+    "/exports",
+    status_code=status.HTTP_202_ACCEPTED,
+    summary="Exportar una region de una capa a un paquete MBTiles offline",
+)
+async def start_export(payload: ExportRequest) -> dict:
+    layer = get_layer(payload.layer_key)
+    if layer is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail={
+                "status": "not_found",
+                "code": "layer_not_found",
+                "message": f"La capa '{payload.layer_key}' no esta registrada.",
+            },
+        )
+    temporal = layer_temporal(layer) != TEMPORAL_NONE
+    if layer.kind == "gibs" and temporal and not (payload.date or layer.default_date):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail={
+                "status": "invalid",
+                "code": "missing_date",
+                "message": "Las capas GIBS requieren fecha ('date': YYYY-MM-DD).",
+            },
+        )
+    extent = payload.bbox
+    spec = ExportSpec(
+        layer=layer,
+        bbox=BBox(
+            min_lon=extent.min_lon,
+            min_lat=extent.min_lat,
+            max_lon=extent.max_lon,
+            max_lat=extent.max_lat,
+        ),
+        min_zoom=payload.min_zoom,
+        max_zoom=payload.max_zoom,
+        date=(payload.date or layer.default_date) if temporal else None,
+    )
+    if spec.count() > settings.tile_export_max_tiles:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail={
+                "status": "invalid",
+                "code": "too_many_tiles",
+                "message": f"La exportacion supera el maximo de {settings.tile_export_max_tiles} tiles.",
+            },
+        )
+    concurrency = payload.concurrency or settings.tile_export_concurrency
+    prune_exports(settings.tile_export_retention_seconds)
+
+    async def run(job: Job) -> dict:
+        def report(progress) -> None:
+            job.progress = progress.to_dict()
+
+        path = export_path(job.id)
+        exporter = TileExporter(
+            get_nasa_broadcast(),
+            spec,
+            path,
+            concurrency=concurrency,
+            batch_size=settings.tile_export_batch_size,
+            on_progress=report,
+        )
+        progress = await exporter.run()
+        return {
+            **progress.to_dict(),
+            "fileBytes": path.stat().st_size,
+            "download": f"{router.prefix}/exports/{job.id}",
+        }
+
+    return job_registry.start("export", run).to_dict()
+
+
+@router.get("/exports/{job_id}", summary="Descargar el paquete MBTiles de una exportacion")
+async def download_export(job_id: str) -> FileResponse:
+    job = _get_job(job_id)
+    path = export_path(job.id)
+    if job.kind != "export" or (job.status == "completed" and not path.exists()):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail={
+                "status": "not_found",
+                "code": "export_not_found",
+                "message": "La exportacion no existe o su paquete ya fue eliminado.",
+            },
+        )
+    if job.status != "completed":
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail={
+                "status": "conflict",
+                "code": "export_not_ready",
+                "message": f"La exportacion aun no esta lista (estado: {job.status}).",
+            },
+        )
+    return FileResponse(path, media_type=MBTILES_MEDIA_TYPE, filename=f"export-{job.id}.mbtiles")
+
+
+def _get_job(job_id: str) -> Job:
+    job = job_registry.get(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail={
+                "status": "not_found",
+                "code": "job_not_found",
+                "message": "El trabajo solicitado no existe.",
+            },
+        )
+    return job
+
+
+@router.get("/jobs/{job_id}", summary="Estado y progreso de un trabajo del cache")
+async def get_job(job_id: str) -> dict:
+    return _get_job(job_id).to_dict()
+
+
+@router.delete("/jobs/{job_id}", summary="Cancelar un trabajo del cache")
+async def cancel_job(job_id: str) -> dict:
+    job = job_registry.cancel(_get_job(job_id).id)
+    return job.to_dict()
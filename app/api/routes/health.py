@@ -1,5 +1,7 @@
 from fastapi import APIRouter
 
+from app.broadcast.nasa import get_nasa_broadcast
+
 router = APIRouter(prefix="/health", tags=["Health"])
 
 
@@ -7,3 +9,9 @@ router = APIRouter(prefix="/health", tags=["Health"])
 async def healthcheck() -> dict[str, str]:
     """Return a canned response so App Runner can probe the service."""
     return {"status": "ok"}
+
+
+@router.get("/metrics", summary="Contadores internos del proxy de tiles")
+async def metrics() -> dict:
+    """Expose in-process counters for the NASA tile proxy."""
+    return {"tiles": get_nasa_broadcast().stats()}
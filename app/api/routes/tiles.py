@@ -1,15 +1,21 @@
 from __future__ import annotations
 
 from datetime import date as DateType
-from typing import Optional
+from typing import Literal, Optional
 
-from fastapi import APIRouter, Path, Query, Response
+from fastapi import APIRouter, Header, HTTPException, Path, Query, Response, status
+from fastapi.responses import StreamingResponse
 
 from app.broadcast.nasa import get_nasa_broadcast
-from app.services.tiles import TileService
+from app.responses import CachedFileResponse
+from app.schemas import TileBatchRequest
+from app.services.tiles import BUNDLE_MEDIA_TYPE, TileService, is_not_modified
+from app.tiling import BBox
 
 router = APIRouter(prefix="/v1/layers", tags=["Tiles"])
 
+FORWARDED_HEADERS = ("Cache-Control", "ETag", "Last-Modified")
+
 
 @router.get("/{layer_key}/tiles/{z}/{x}/{y}", summary="Proxy sencillo hacia NASA")
 async def proxy_tile(
@@ -18,11 +24,107 @@ async def proxy_tile(
     x: int = Path(..., ge=0, description="Tile column"),
     y: int = Path(..., ge=0, description="Tile row"),
     date_param: Optional[DateType] = Query(None, alias="date", description="Fecha YYYY-MM-DD"),
+    if_none_match: Optional[str] = Header(None, description="ETag conocido por el cliente"),
+    if_modified_since: Optional[str] = Header(None, description="Fecha Last-Modified conocida por el cliente"),
 ):
     service = TileService(get_nasa_broadcast())
-    body, headers = await service.fetch_tile(layer_key, z, x, y, date_param)
-    response = Response(content=body, media_type=headers.get("Content-Type", "image/png"))
-    for header in ("Cache-Control", "ETag", "Last-Modified"):
+    result = await service.fetch_tile(
+        layer_key,
+        z,
+        x,
+        y,
+        date_param,
+        if_none_match=if_none_match,
+        if_modified_since=if_modified_since,
+    )
+    media_type = result.headers.get("Content-Type", "image/png")
+    if result.not_modified:
+        response: Response = Response(status_code=status.HTTP_304_NOT_MODIFIED)
+    elif result.file is not None:
+        response = CachedFileResponse(result.file, media_type=media_type)
+    elif result.stream is not None:
+        response = StreamingResponse(result.stream, media_type=media_type)
+    else:
+        response = Response(content=result.body, media_type=media_type)
+    for header in FORWARDED_HEADERS:
+        if header in result.headers:
+            response.headers[header] = result.headers[header]
+    return response
+
+
+@router.get(
+    "/{layer_key}/tiles/{z}/{x}/{y}/series",
+    summary="El mismo tile en un rango de fechas",
+    response_class=StreamingResponse,
+)
+async def tile_series(
+    layer_key: str,
+    z: int = Path(..., ge=0, description="Zoom"),
+    x: int = Path(..., ge=0, description="Tile column"),
+    y: int = Path(..., ge=0, description="Tile row"),
+    start: DateType = Query(..., description="Primera fecha YYYY-MM-DD"),
+    end: DateType = Query(..., description="Ultima fecha YYYY-MM-DD (inclusive)"),
+    step: int = Query(1, ge=1, le=366, description="Dias entre fechas"),
+) -> StreamingResponse:
+    """Bundle con un frame por fecha, transmitido en orden cronologico."""
+    service = TileService(get_nasa_broadcast())
+    layer, dates = service.resolve_series(layer_key, start, end, step)
+    return StreamingResponse(
+        service.stream_series(layer, z, x, y, dates),
+        media_type=BUNDLE_MEDIA_TYPE,
+        headers={"X-Tile-Count": str(len(dates))},
+    )
+
+
+@router.post(
+    "/{layer_key}/tiles",
+    summary="Varios tiles en una sola respuesta",
+    response_class=StreamingResponse,
+)
+async def batch_tiles(layer_key: str, payload: TileBatchRequest) -> StreamingResponse:
+    """Bundle con un frame por tile, transmitido en el orden en que se resuelven."""
+    service = TileService(get_nasa_broadcast())
+    layer, coords = service.resolve_batch(layer_key, payload)
+    return StreamingResponse(
+        service.stream_batch(layer, coords, payload.date),
+        media_type=BUNDLE_MEDIA_TYPE,
+        headers={"X-Tile-Count": str(len(coords))},
+    )
+
+
+@router.get("/{layer_key}/static", summary="Mapa estatico de un bbox en una sola imagen")
+async def static_map(
+    layer_key: str,
+    bbox: str = Query(..., description="minLon,minLat,maxLon,maxLat"),
+    zoom: int = Query(..., ge=0, description="Zoom de los tiles a unir"),
+    image_format: Literal["png", "jpeg", "webp"] = Query("png", alias="format", description="Formato de salida"),
+    date_param: Optional[DateType] = Query(None, alias="date", description="Fecha YYYY-MM-DD"),
+    if_none_match: Optional[str] = Header(None, description="ETag conocido por el cliente"),
+) -> Response:
+    service = TileService(get_nasa_broadcast())
+    body, headers = await service.render_static(layer_key, _parse_bbox(bbox), zoom, image_format, date_param)
+    if is_not_modified(headers, if_none_match, None):
+        response = Response(status_code=status.HTTP_304_NOT_MODIFIED)
+    else:
+        response = Response(content=body, media_type=headers["Content-Type"])
+    for header in FORWARDED_HEADERS:
         if header in headers:
             response.headers[header] = headers[header]
-    return response
\ No newline at end of file
+    return response
+
+
+def _parse_bbox(raw: str) -> BBox:
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(part) for part in raw.split(","))
+    except ValueError:
+        min_lon = min_lat = max_lon = max_lat = float("nan")
+    if not (-180 <= min_lon < max_lon <= 180 and -90 <= min_lat < max_lat <= 90):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail={
+                "status": "invalid",
+                "code": "invalid_bbox",
+                "message": "bbox debe ser minLon,minLat,maxLon,maxLat con minimos menores que maximos.",
+            },
+        )
+    return BBox(min_lon=min_lon, min_lat=min_lat, max_lon=max_lon, max_lat=max_lat)
@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import asyncio
+from typing import AsyncIterator, Dict, List, Optional
+
+
+class TileDownload:
+    """Descarga de un tile en curso que se reenvia a los clientes a medida que llega.
+
+    Los fragmentos se conservan hasta el final, de modo que un cliente que se une
+    tarde recibe el cuerpo completo desde el inicio. Si la descarga falla a mitad
+    de camino, los lectores reciben la excepcion (el cliente ve una respuesta cortada).
+    """
+
+    def __init__(self) -> None:
+        self.headers: Optional[Dict[str, str]] = None
+        self._chunks: List[bytes] = []
+        self._done = False
+        self._error: Optional[BaseException] = None
+        self._changed = asyncio.Event()
+
+    def start(self, headers: Dict[str, str]) -> None:
+        self.headers = dict(headers)
+        self._notify()
+
+    def push(self, chunk: bytes) -> None:
+        if chunk:
+            self._chunks.append(chunk)
+            self._notify()
+
+    def finish(self) -> None:
+        self._done = True
+        self._notify()
+
+    def fail(self, error: BaseException) -> None:
+        self._error = error
+        self._notify()
+
+    def body(self) -> bytes:
+        return b"".join(self._chunks)
+
+    async def wait_started(self) -> Dict[str, str]:
+        while self.headers is None:
+            if self._error is not None:
+                raise self._error
+            await self._wait()
+        return self.headers
+
+    async def iter_body(self) -> AsyncIterator[bytes]:
+        index = 0
+        while True:
+            while index < len(self._chunks):
+                yield self._chunks[index]
+                index += 1
+            if self._done:
+                return
+            if self._error is not None:
+                raise self._error
+            await self._wait()
+
+    async def _wait(self) -> None:
+        await self._changed.wait()
+
+    def _notify(self) -> None:
+        # Un evento nuevo por cambio: quien ya desperto no vuelve a ver el evento viejo en set.
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
@@ -1,13 +1,39 @@
 from __future__ import annotations
 
+import asyncio
+import struct
+import time
+import zlib
+from collections import Counter
+from contextlib import contextmanager
+from functools import lru_cache
 from datetime import date as DateType
-from typing import Dict, Optional, Protocol
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from hashlib import sha256
+from typing import Awaitable, Dict, Iterator, List, Mapping, Optional, Protocol, Sequence
 
 import httpx
 from fastapi import HTTPException, status
 
-from app.cache import FileCache
+from app.broadcast.download import TileDownload
+from app.broadcast.prefetch import TilePrefetcher
+from app.broadcast.singleflight import SingleFlight
+from app.broadcast.upstreams import CircuitOpenError, Upstream
+from app.cache import CachedFile, CachedPayload, EntryWriter, FileCache, MemoryCache, TileStore
+from app.cache_index import INDEX_FILENAME, CacheKeyIndex, split_cache_key
+from app.cache_mbtiles import MBTilesCache
 from app.core.config import settings
+from app.layers_catalog import TEMPORAL_NONE, get_layer, layer_temporal, period_end, period_start
+
+
+CONTENT_ETAG_PREFIX = "sha256-"
+# Marca de las entradas negativas: guarda el estado con el que NASA respondio.
+NEGATIVE_HEADER = "X-Nasa-Status"
+NEGATIVE_STATUSES = frozenset({400, 404})
+PLACEHOLDER_SIZE = 256
+# Segmento de fecha en la clave de las capas sin dimension temporal.
+STATIC_DATE_KEY = "static"
 
 
 class LayerDefinition(Protocol):
@@ -29,16 +55,71 @@ class NasaBroadcast:
 
     def __init__(
         self,
-        cache: Optional[FileCache] = None,
+        cache: Optional[TileStore] = None,
         client: Optional[httpx.AsyncClient] = None,
     ) -> None:
-        self.cache = cache or FileCache(settings.tile_cache_dir, settings.tile_cache_ttl_seconds)
-        self._client = client or httpx.AsyncClient(timeout=settings.http_timeout_seconds)
-        self._owns_client = client is None
+        self.cache = cache or _default_cache()
+        self._owns_cache = cache is None
+        # Un pool, circuito y limite por host: una caida de GIBS no arrastra a las capas de Treks.
+        self.upstreams: Dict[str, Upstream] = {
+            "gibs": Upstream(
+                "gibs",
+                settings.http_timeout_seconds,
+                max_connections=settings.nasa_gibs_max_connections,
+                max_keepalive_connections=settings.nasa_gibs_max_keepalive_connections,
+                keepalive_expiry=settings.nasa_gibs_keepalive_expiry_seconds,
+                http2=settings.nasa_gibs_http2,
+                base_urls=_base_urls(settings.nasa_gibs_base_url, settings.nasa_gibs_mirror_urls),
+                failure_threshold=settings.nasa_circuit_failure_threshold,
+                reset_seconds=settings.nasa_circuit_reset_seconds,
+                latency_target=settings.nasa_latency_target_seconds,
+                min_concurrency=settings.nasa_min_concurrency,
+                **_resilience_options(),
+                client=client,
+            ),
+            "trek": Upstream(
+                "trek",
+                settings.http_timeout_seconds,
+                max_connections=settings.nasa_treks_max_connections,
+                max_keepalive_connections=settings.nasa_treks_max_keepalive_connections,
+                keepalive_expiry=settings.nasa_treks_keepalive_expiry_seconds,
+                http2=settings.nasa_treks_http2,
+                base_urls=_base_urls(settings.nasa_treks_base_url, settings.nasa_treks_mirror_urls),
+                failure_threshold=settings.nasa_circuit_failure_threshold,
+                reset_seconds=settings.nasa_circuit_reset_seconds,
+                latency_target=settings.nasa_latency_target_seconds,
+                min_concurrency=settings.nasa_min_concurrency,
+                **_resilience_options(),
+                client=client,
+            ),
+        }
+        self._singleflight: SingleFlight[tuple[bytes, Dict[str, str]]] = SingleFlight()
+        self._downloads: Dict[str, TileDownload] = {}
+        self._counters: Counter[str] = Counter()
+        self.stale_while_revalidate_seconds = settings.tile_stale_while_revalidate_seconds
+        self.stale_if_error_seconds = settings.tile_stale_if_error_seconds
+        self.negative_ttl_seconds = settings.tile_negative_cache_ttl_seconds
+        self.serve_placeholder = settings.tile_negative_placeholder
+        self.immutable_ttl_seconds = settings.tile_immutable_ttl_seconds
+        # Descargas pedidas en primer plano; el prefetch espera a que lleguen a cero.
+        self._foreground_fetches = 0
+        self._upstream_idle: Optional[asyncio.Event] = None
+        self.prefetcher: Optional[TilePrefetcher] = None
+        if settings.tile_prefetch_enabled:
+            self.prefetcher = TilePrefetcher(
+                self,
+                ring=settings.tile_prefetch_ring,
+                max_queue=settings.tile_prefetch_queue_size,
+                workers=settings.tile_prefetch_workers,
+            )
 
     async def close(self) -> None:
-        if self._owns_client:
-            await self._client.aclose()
+        if self.prefetcher is not None:
+            await self.prefetcher.close()
+        for upstream in self.upstreams.values():
+            await upstream.aclose()
+        if self._owns_cache:
+            self.cache.close()
 
     async def get_tile(
         self,
@@ -47,15 +128,329 @@ class NasaBroadcast:
         x: int,
         y: int,
         date_override: Optional[DateType] = None,
+        background: bool = False,
     ) -> tuple[bytes, Dict[str, str]]:
         cache_key = self._cache_key(layer, z, x, y, date_override)
-        cached = self.cache.get(cache_key)
-        if cached:
-            return cached.body, dict(cached.headers)
+        cached = await self.cache.aget(cache_key, allow_stale=True)
+        if cached and _is_negative(cached.headers):
+            if not cached.is_expired:
+                self._counters["negativeHits"] += 1
+                url = self._build_url(layer, z, x, y, date_override)
+                return self._missing_tile(int(cached.headers[NEGATIVE_HEADER]), url)
+            # Una entrada negativa vencida no sirve como copia stale ni para revalidar.
+            cached = None
+        if cached and not cached.is_expired:
+            return cached.body, _with_etag(cached.body, cached.headers)
+
+        def fetch() -> Awaitable[tuple[bytes, Dict[str, str]]]:
+            return self._fetch_and_store(layer, z, x, y, date_override, cache_key, cached, background)
+
+        stale_for = time.time() - cached.expires_at if cached else 0.0
+        if cached and stale_for <= self.stale_while_revalidate_seconds:
+            self._singleflight.spawn(cache_key, fetch)
+            self._counters["staleWhileRevalidate"] += 1
+            return cached.body, _with_etag(cached.body, _stale_headers(cached))
+
+        if not background:
+            self._begin_foreground()
+        try:
+            body, headers = await self._singleflight.do(cache_key, fetch)
+        except HTTPException as exc:
+            if cached and exc.status_code >= 500 and stale_for <= self.stale_if_error_seconds:
+                self._counters["staleIfError"] += 1
+                return cached.body, _with_etag(cached.body, _stale_headers(cached))
+            raise
+        finally:
+            if not background:
+                self._end_foreground()
+        return body, dict(headers)
+
+    async def wait_for_idle_upstream(self) -> None:
+        """Espera a que no haya descargas en primer plano hacia NASA."""
+
+        await self._idle_event().wait()
+
+    def _idle_event(self) -> asyncio.Event:
+        if self._upstream_idle is None:
+            self._upstream_idle = asyncio.Event()
+            self._upstream_idle.set()
+        return self._upstream_idle
+
+    def _begin_foreground(self) -> None:
+        self._foreground_fetches += 1
+        self._idle_event().clear()
+
+    def _end_foreground(self) -> None:
+        self._foreground_fetches -= 1
+        if self._foreground_fetches == 0:
+            self._idle_event().set()
+
+    def get_hot_tile(
+        self,
+        layer: LayerDefinition,
+        z: int,
+        x: int,
+        y: int,
+        date_override: Optional[DateType] = None,
+    ) -> Optional[tuple[bytes, Dict[str, str]]]:
+        """Tile vigente del nivel en memoria, resuelto sin salir del event loop."""
+
+        cached = self.cache.hot(self._cache_key(layer, z, x, y, date_override))
+        if cached is None or cached.is_expired or _is_negative(cached.headers):
+            return None
+        return cached.body, _with_etag(cached.body, cached.headers)
+
+    async def get_cached_tile(
+        self,
+        layer: LayerDefinition,
+        z: int,
+        x: int,
+        y: int,
+        date_override: Optional[DateType] = None,
+    ) -> Optional[tuple[bytes, Dict[str, str]]]:
+        """Tile vigente en cache, sin contactar a NASA."""
+
+        cached = await self.cache.aget(self._cache_key(layer, z, x, y, date_override))
+        if cached is None or _is_negative(cached.headers):
+            return None
+        return cached.body, _with_etag(cached.body, cached.headers)
+
+    async def open_cached_tile(
+        self,
+        layer: LayerDefinition,
+        z: int,
+        x: int,
+        y: int,
+        date_override: Optional[DateType] = None,
+    ) -> Optional[CachedFile]:
+        """Tile vigente en disco listo para enviarse desde el archivo (sin pasar por ``bytes``)."""
+
+        cached = await self.cache.aopen(self._cache_key(layer, z, x, y, date_override))
+        if cached is not None and _is_negative(cached.headers):
+            cached.close()
+            return None
+        return cached
+
+    async def get_tile_headers(
+        self,
+        layer: LayerDefinition,
+        z: int,
+        x: int,
+        y: int,
+        date_override: Optional[DateType] = None,
+    ) -> Optional[Dict[str, str]]:
+        """Encabezados de un tile vigente en cache, sin leer su contenido."""
+
+        head = await self.cache.ahead(self._cache_key(layer, z, x, y, date_override))
+        if head is None or _is_negative(head.headers):
+            return None
+        return dict(head.headers)
+
+    async def is_known_missing(
+        self,
+        layer: LayerDefinition,
+        z: int,
+        x: int,
+        y: int,
+        date_override: Optional[DateType] = None,
+    ) -> bool:
+        """``True`` si hay una entrada negativa vigente: NASA no tiene ese tile y no se le vuelve a pedir."""
+
+        head = await self.cache.ahead(self._cache_key(layer, z, x, y, date_override))
+        if head is None or head.is_expired or not _is_negative(head.headers):
+            return False
+        self._counters["negativeHits"] += 1
+        return True
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "singleflight": self._singleflight.stats(),
+            "upstream": dict(self._counters),
+            "upstreams": {name: upstream.stats() for name, upstream in self.upstreams.items()},
+            "prefetch": self.prefetcher.stats() if self.prefetcher is not None else None,
+            "cache": self.cache.stats(),
+        }
+
+    async def _fetch_and_store(
+        self,
+        layer: LayerDefinition,
+        z: int,
+        x: int,
+        y: int,
+        date_override: Optional[DateType],
+        cache_key: str,
+        stale: Optional[CachedPayload] = None,
+        background: bool = False,
+    ) -> tuple[bytes, Dict[str, str]]:
+        url = self._build_url(layer, z, x, y, date_override)
+        request_headers = _validators(stale) if stale else {}
+        self._counters["requests"] += 1
+        if request_headers:
+            self._counters["conditionalRequests"] += 1
+        with self._upstream_errors():
+            response = await self.upstreams[layer.kind].get(url, headers=request_headers, background=background)
+
+        if response.status_code == status.HTTP_304_NOT_MODIFIED and stale is not None:
+            immutable_ttl = self._immutable_ttl(layer, date_override)
+            ttl = immutable_ttl if immutable_ttl is not None else _freshness_ttl(response.headers)
+            headers = _revalidated_headers(stale.headers, response, immutable_ttl)
+            if headers == dict(stale.headers):
+                await self.cache.arefresh(cache_key, stale, ttl)
+            else:
+                # El 304 trae validadores o vigencia nuevos: se reescribe la entrada con el mismo cuerpo.
+                await self.cache.aset(cache_key, stale.body, headers, ttl_seconds=ttl)
+            self._counters["notModified"] += 1
+            return stale.body, _with_etag(stale.body, headers)
+
+        if response.status_code in NEGATIVE_STATUSES or (response.status_code < 300 and not response.content):
+            await self._store_negative(cache_key, response.status_code)
+            return self._missing_tile(response.status_code, str(response.request.url))
+
+        if response.status_code >= 400:
+            raise _bad_response(response.status_code, str(response.request.url))
+
+        body = response.content
+        ttl = self._immutable_ttl(layer, date_override)
+        headers = _with_etag(body, _tile_headers(response, ttl))
+        await self.cache.aset(cache_key, body, headers, ttl_seconds=ttl)
+        return body, headers
+
+    async def stream_tile(
+        self,
+        layer: LayerDefinition,
+        z: int,
+        x: int,
+        y: int,
+        date_override: Optional[DateType] = None,
+    ) -> Optional[TileDownload]:
+        """Descarga un tile ausente del cache reenviando el cuerpo a medida que llega.
+
+        Solo aplica a fallos en frio: si hay cualquier copia en cache (vigente,
+        vencida o negativa) o una descarga normal en curso devuelve ``None`` y el
+        llamador debe usar ``get_tile``. Pedidos simultaneos del mismo tile
+        comparten la misma descarga.
+        """
+
+        cache_key = self._cache_key(layer, z, x, y, date_override)
+        download = self._downloads.get(cache_key)
+        if download is None:
+            if self._singleflight.in_flight(cache_key):
+                return None
+            if await self.cache.aget(cache_key, allow_stale=True) is not None:
+                return None
+            # Otro pedido pudo iniciar la descarga mientras se consultaba el cache.
+            download = self._downloads.get(cache_key)
+        if download is None:
+            if self._singleflight.in_flight(cache_key):
+                return None
+            download = TileDownload()
+            self._downloads[cache_key] = download
 
+            def fetch() -> Awaitable[tuple[bytes, Dict[str, str]]]:
+                return self._stream_and_store(layer, z, x, y, date_override, cache_key, download)
+
+            self._singleflight.spawn(cache_key, fetch)
+        self._begin_foreground()
+        try:
+            await download.wait_started()
+        finally:
+            self._end_foreground()
+        return download
+
+    async def _stream_and_store(
+        self,
+        layer: LayerDefinition,
+        z: int,
+        x: int,
+        y: int,
+        date_override: Optional[DateType],
+        cache_key: str,
+        download: TileDownload,
+    ) -> tuple[bytes, Dict[str, str]]:
         url = self._build_url(layer, z, x, y, date_override)
+        self._counters["requests"] += 1
+        self._counters["streamed"] += 1
+        writer: Optional[EntryWriter] = None
         try:
-            response = await self._client.get(url)
+            with self._upstream_errors():
+                async with self.upstreams[layer.kind].stream(url) as response:
+                    upstream_url = str(response.request.url)
+                    empty = response.headers.get("Content-Length") == "0"
+                    if response.status_code in NEGATIVE_STATUSES or (response.status_code < 300 and empty):
+                        await self._store_negative(cache_key, response.status_code)
+                        body, headers = self._missing_tile(response.status_code, upstream_url)
+                        download.start(headers)
+                        download.push(body)
+                        download.finish()
+                        return body, headers
+                    if response.status_code >= 400:
+                        raise _bad_response(response.status_code, upstream_url)
+
+                    ttl = self._immutable_ttl(layer, date_override)
+                    headers = _tile_headers(response, ttl)
+                    writer = await self.cache.aopen_writer(cache_key, headers)
+                    async for chunk in response.aiter_bytes():
+                        if not chunk:
+                            continue
+                        # Los encabezados salen con el primer bloque: un cuerpo vacio aun puede ser 502.
+                        if download.headers is None:
+                            download.start(headers)
+                        # Primero al cliente; la escritura a disco corre en el pool de I/O.
+                        download.push(chunk)
+                        await self.cache.awrite(writer, chunk)
+            body = download.body()
+            if not body:
+                # Sin Content-Length no se sabia de antemano que el tile venia vacio.
+                await self.cache.aabort(writer)
+                writer = None
+                await self._store_negative(cache_key, response.status_code)
+                body, headers = self._missing_tile(response.status_code, upstream_url)
+                download.start(headers)
+                download.push(body)
+                download.finish()
+                return body, headers
+            headers = _with_etag(body, headers)
+            await self.cache.acommit(writer, headers, body, ttl_seconds=ttl)
+            writer = None
+            download.finish()
+            return body, headers
+        except BaseException as exc:
+            # Descarga incompleta o fallida: el temporal se descarta y nada llega al cache.
+            if writer is not None:
+                await self.cache.aabort(writer)
+            download.fail(exc)
+            raise
+        finally:
+            self._downloads.pop(cache_key, None)
+
+    async def _store_negative(self, cache_key: str, status_code: int) -> None:
+        if self.negative_ttl_seconds > 0:
+            # NASA no tiene imagen para este tile/fecha: se recuerda un rato para no volver a pedirlo.
+            await self.cache.aset(
+                cache_key,
+                b"",
+                {NEGATIVE_HEADER: str(status_code)},
+                ttl_seconds=self.negative_ttl_seconds,
+            )
+            self._counters["negativeStored"] += 1
+
+    @contextmanager
+    def _upstream_errors(self) -> Iterator[None]:
+        """Traduce los errores de red hacia NASA a las respuestas HTTP del proxy."""
+
+        try:
+            yield
+        except CircuitOpenError as exc:
+            self._counters["circuitRejected"] += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail={
+                    "status": "unavailable",
+                    "code": "nasa_unavailable",
+                    "message": "NASA no esta respondiendo; se reintentara en breve",
+                },
+                headers={"Retry-After": str(max(1, int(exc.retry_after)))},
+            ) from exc
         except httpx.TimeoutException as exc:
             raise HTTPException(
                 status_code=status.HTTP_504_GATEWAY_TIMEOUT,
@@ -77,32 +472,16 @@ class NasaBroadcast:
                 },
             ) from exc
 
-        if response.status_code >= 400:
-            raise HTTPException(
-                status_code=status.HTTP_502_BAD_GATEWAY,
-                detail={
-                    "status": "error",
-                    "code": "nasa_bad_response",
-                    "message": "NASA devolvio un error",
-                    "details": {
-                        "status_code": response.status_code,
-                        "url": str(response.request.url),
-                    },
-                },
-            )
-
+    def _missing_tile(self, status_code: int, url: str) -> tuple[bytes, Dict[str, str]]:
+        if not self.serve_placeholder:
+            raise _bad_response(status_code, url)
+        self._counters["placeholders"] += 1
+        body = transparent_png(PLACEHOLDER_SIZE)
         headers = {
-            "Content-Type": response.headers.get("Content-Type", "image/png"),
-            "Cache-Control": response.headers.get("Cache-Control", "public, max-age=3600"),
+            "Content-Type": "image/png",
+            "Cache-Control": f"public, max-age={int(self.negative_ttl_seconds)}",
         }
-        if etag := response.headers.get("ETag"):
-            headers["ETag"] = etag
-        if last_modified := response.headers.get("Last-Modified"):
-            headers["Last-Modified"] = last_modified
-
-        body = response.content
-        self.cache.set(cache_key, body, headers)
-        return body, headers
+        return body, _with_etag(body, headers)
 
     def _cache_key(
         self,
@@ -112,8 +491,56 @@ class NasaBroadcast:
         y: int,
         date_override: Optional[DateType] = None,
     ) -> str:
-        target_date = (date_override or layer.default_date or DateType.today()).isoformat()
-        return f"{layer.layer_key}:{target_date}:{z}:{x}:{y}"
+        return f"{layer.layer_key}:{self.cache_date(layer, date_override)}:{z}:{x}:{y}"
+
+    def cache_date(self, layer: LayerDefinition, date_override: Optional[DateType] = None) -> str:
+        """Parte de fecha de la clave: inicio del periodo, o ``static`` si la capa no depende de la fecha."""
+
+        if layer_temporal(layer) == TEMPORAL_NONE:
+            # La imagen no depende de la fecha: una sola entrada sirve para cualquier ?date=.
+            return STATIC_DATE_KEY
+        return self._target_date(layer, date_override).isoformat()
+
+    def normalize_cache_key(self, key: str) -> Optional[str]:
+        """Clave vigente para una clave guardada con el esquema anterior; ``None`` si no cambia.
+
+        Las capas sin dimension temporal pasaban la fecha del dia (o la pedida) a la
+        clave, y las mensuales o anuales la fecha exacta en lugar del inicio del periodo.
+        """
+
+        try:
+            layer_key, day, z, x, y = split_cache_key(key)
+            date_override = DateType.fromisoformat(day)
+        except ValueError:
+            return None
+        layer = get_layer(layer_key)
+        if layer is None:
+            return None
+        normalized = self._cache_key(layer, z, x, y, date_override)
+        return normalized if normalized != key else None
+
+    def _target_date(self, layer: LayerDefinition, date_override: Optional[DateType]) -> DateType:
+        target = date_override or layer.default_date or DateType.today()
+        temporal = layer_temporal(layer)
+        if temporal == TEMPORAL_NONE:
+            return layer.default_date or target
+        return period_start(temporal, target)
+
+    def _immutable_ttl(self, layer: LayerDefinition, date_override: Optional[DateType]) -> Optional[float]:
+        """TTL largo para tiles que ya no cambian; ``None`` (TTL normal) para periodos aun abiertos.
+
+        NASA sigue reprocesando la imagen unos dias despues de cerrar el periodo,
+        por eso se espera ``tile_historical_after_days`` antes de tratarla como final.
+        """
+
+        if self.immutable_ttl_seconds <= 0:
+            return None
+        temporal = layer_temporal(layer)
+        if temporal != TEMPORAL_NONE:
+            final_on = period_end(temporal, self._target_date(layer, date_override))
+            if final_on + timedelta(days=settings.tile_historical_after_days) >= DateType.today():
+                return None
+        return float(self.immutable_ttl_seconds)
 
     def _build_url(
         self,
@@ -148,7 +575,7 @@ class NasaBroadcast:
         layer_id = layer.layer_key.split(":", 1)[1] if ":" in layer.layer_key else layer.layer_key
         matrix_set = layer.matrix_set or "GoogleMapsCompatible_Level9"
         image_format = layer.image_format or "jpg"
-        target_date = (date_override or layer.default_date or DateType.today()).isoformat()
+        target_date = self._target_date(layer, date_override).isoformat()
         template = layer.source_template or "{layerId}/default/{date}/{matrixSet}/{z}/{y}/{x}.{format}"
         full_template = template if template.startswith("http") else f"{base_url}/{template.lstrip('/')}"
         return full_template.format(
@@ -190,6 +617,190 @@ class NasaBroadcast:
         )
 
 
+def _tile_headers(response: httpx.Response, immutable_ttl: Optional[float] = None) -> Dict[str, str]:
+    cache_control = response.headers.get("Cache-Control", "public, max-age=3600")
+    if immutable_ttl is not None:
+        cache_control = f"public, max-age={int(immutable_ttl)}, immutable"
+    headers = {
+        "Content-Type": response.headers.get("Content-Type", "image/png"),
+        "Cache-Control": cache_control,
+    }
+    if etag := response.headers.get("ETag"):
+        headers["ETag"] = etag
+    if last_modified := response.headers.get("Last-Modified"):
+        headers["Last-Modified"] = last_modified
+    return headers
+
+
+def _revalidated_headers(
+    stored: Mapping[str, str],
+    response: httpx.Response,
+    immutable_ttl: Optional[float] = None,
+) -> Dict[str, str]:
+    """Encabezados guardados actualizados con los que trae un 304 (RFC 9111, seccion 4.3.4)."""
+
+    headers = dict(stored)
+    for name in ("ETag", "Last-Modified", "Cache-Control"):
+        if value := response.headers.get(name):
+            headers[name] = value
+    if immutable_ttl is not None:
+        headers["Cache-Control"] = f"public, max-age={int(immutable_ttl)}, immutable"
+    return headers
+
+
+def _freshness_ttl(headers: Mapping[str, str]) -> Optional[float]:
+    """Vigencia que indica una respuesta (``s-maxage``, ``max-age`` o ``Expires``); ``None`` si no la indica."""
+
+    directives = {}
+    for directive in headers.get("Cache-Control", "").split(","):
+        name, _, value = directive.strip().partition("=")
+        directives[name.lower()] = value.strip('"')
+    for name in ("s-maxage", "max-age"):
+        if name in directives:
+            try:
+                return max(0.0, float(int(directives[name])))
+            except ValueError:
+                return None
+    expires = headers.get("Expires")
+    if not expires:
+        return None
+    try:
+        expires_at = parsedate_to_datetime(expires)
+        sent_at = parsedate_to_datetime(headers["Date"]) if "Date" in headers else datetime.now(timezone.utc)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (expires_at - sent_at).total_seconds())
+
+
+def _bad_response(status_code: int, url: str) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_502_BAD_GATEWAY,
+        detail={
+            "status": "error",
+            "code": "nasa_bad_response",
+            "message": "NASA devolvio un error",
+            "details": {
+                "status_code": status_code,
+                "url": url,
+            },
+        },
+    )
+
+
+def is_missing_tile(exc: HTTPException) -> bool:
+    """``True`` si el error corresponde a un tile que NASA no tiene, no a una falla del upstream."""
+
+    detail = exc.detail if isinstance(exc.detail, dict) else {}
+    if detail.get("code") != "nasa_bad_response":
+        return False
+    upstream_status = detail.get("details", {}).get("status_code", 0)
+    # Un 2xx sin cuerpo tambien se trata como tile inexistente.
+    return upstream_status in NEGATIVE_STATUSES or 200 <= upstream_status < 300
+
+
+def is_placeholder(body: bytes) -> bool:
+    """``True`` si el cuerpo es el PNG transparente que reemplaza a los tiles inexistentes."""
+
+    placeholder = transparent_png(PLACEHOLDER_SIZE)
+    return len(body) == len(placeholder) and body == placeholder
+
+
+def _is_negative(headers: Mapping[str, str]) -> bool:
+    return NEGATIVE_HEADER in headers
+
+
+@lru_cache(maxsize=4)
+def transparent_png(size: int) -> bytes:
+    """PNG RGBA totalmente transparente, compartido por todos los tiles sin imagen."""
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    header = struct.pack(">IIBBBBB", size, size, 8, 6, 0, 0, 0)
+    # Cada fila: byte de filtro 0 seguido de size pixeles RGBA en cero.
+    pixels = zlib.compress(b"\x00" * ((size * 4 + 1) * size), 9)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", pixels) + chunk(b"IEND", b"")
+
+
+def _stale_headers(cached: CachedPayload) -> Dict[str, str]:
+    # Una copia vencida no debe quedar guardada en el navegador por el max-age original.
+    headers = dict(cached.headers)
+    headers["Cache-Control"] = "no-cache"
+    return headers
+
+
+def content_etag(body: bytes) -> str:
+    return f'"{CONTENT_ETAG_PREFIX}{sha256(body).hexdigest()[:32]}"'
+
+
+def _with_etag(body: bytes, headers: Mapping[str, str]) -> Dict[str, str]:
+    """Agrega un ETag fuerte derivado del contenido cuando NASA no envio uno."""
+
+    result = dict(headers)
+    if "ETag" not in result:
+        result["ETag"] = content_etag(body)
+    return result
+
+
+def _validators(cached: CachedPayload) -> Dict[str, str]:
+    headers = {}
+    etag = cached.headers.get("ETag")
+    # Los ETag derivados del contenido son propios; NASA no los reconoceria.
+    if etag and not etag.startswith(f'"{CONTENT_ETAG_PREFIX}'):
+        headers["If-None-Match"] = etag
+    if last_modified := cached.headers.get("Last-Modified"):
+        headers["If-Modified-Since"] = last_modified
+    return headers
+
+
+def _resilience_options() -> Dict[str, float]:
+    return {
+        "hedge_percentile": settings.nasa_hedge_percentile,
+        "hedge_min_delay": settings.nasa_hedge_min_delay_seconds,
+        "max_retries": settings.nasa_max_retries,
+        "retry_backoff": settings.nasa_retry_backoff_seconds,
+        "retry_budget_ratio": settings.nasa_retry_budget_ratio,
+        "eject_after": settings.nasa_endpoint_eject_after_failures,
+        "ejection_seconds": settings.nasa_endpoint_ejection_seconds,
+    }
+
+
+def _base_urls(primary: object, mirrors: Sequence[object]) -> List[str]:
+    """URL base con la que se arman las plantillas seguida de sus mirrors."""
+
+    return [str(url).rstrip("/") for url in (primary, *mirrors)]
+
+
+def _default_cache() -> TileStore:
+    memory = None
+    if settings.tile_memory_cache_max_bytes > 0:
+        memory = MemoryCache(settings.tile_memory_cache_max_bytes)
+    if settings.tile_cache_backend == "mbtiles":
+        return MBTilesCache(
+            settings.tile_cache_dir,
+            settings.tile_cache_ttl_seconds,
+            memory=memory,
+            io_workers=settings.tile_cache_io_workers,
+            max_bytes=settings.tile_cache_max_bytes,
+            stale_retention_seconds=settings.tile_cache_stale_retention_seconds,
+            batch_size=settings.tile_mbtiles_batch_size,
+            flush_interval_seconds=settings.tile_mbtiles_flush_interval_seconds,
+            readers=settings.tile_mbtiles_readers,
+        )
+    return FileCache(
+        settings.tile_cache_dir,
+        settings.tile_cache_ttl_seconds,
+        memory=memory,
+        io_workers=settings.tile_cache_io_workers,
+        max_bytes=settings.tile_cache_max_bytes,
+        max_entries=settings.tile_cache_max_entries,
+        stale_retention_seconds=settings.tile_cache_stale_retention_seconds,
+        key_index=CacheKeyIndex(settings.tile_cache_dir / INDEX_FILENAME),
+        dedup=settings.tile_cache_dedup,
+        shared_blobs=settings.tile_cache_shared_blobs,
+    )
+
+
 def get_nasa_broadcast() -> NasaBroadcast:
     return nasa_broadcast
 
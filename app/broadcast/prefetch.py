@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections import Counter, OrderedDict
+from datetime import date as DateType
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+from app.tiling import matrix_size
+
+if TYPE_CHECKING:
+    from app.broadcast.nasa import LayerDefinition, NasaBroadcast
+
+LOGGER = logging.getLogger("app.prefetch")
+
+PrefetchItem = Tuple["LayerDefinition", int, int, int, Optional[DateType]]
+COUNTERS = ("enqueued", "deduplicated", "dropped", "fetched", "skipped", "missing", "failed", "hits")
+
+
+class TilePrefetcher:
+    """Precarga en segundo plano los vecinos y los hijos de los tiles servidos.
+
+    La cola es acotada y sin duplicados: si se llena se descartan los pedidos mas
+    antiguos, y se atienden primero los mas recientes (el usuario ya se movio). Los
+    workers solo salen hacia NASA cuando no hay descargas en primer plano en curso,
+    y ya en vuelo usan la fila de fondo del limitador, que cede ante los pedidos de
+    usuarios que lleguen mientras tanto.
+    """
+
+    def __init__(
+        self,
+        broadcast: "NasaBroadcast",
+        ring: int = 1,
+        max_queue: int = 256,
+        workers: int = 2,
+        remember: int = 4096,
+    ) -> None:
+        self.broadcast = broadcast
+        self.ring = ring
+        self.max_queue = max_queue
+        self.workers = workers
+        self.remember = remember
+        self._queue: "OrderedDict[str, PrefetchItem]" = OrderedDict()
+        # Tiles traidos por el prefetcher que aun no pidio nadie.
+        self._prefetched: "OrderedDict[str, None]" = OrderedDict()
+        self._counters: Counter[str] = Counter()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def observe(self, layer: "LayerDefinition", z: int, x: int, y: int, date_override: Optional[DateType]) -> None:
+        """Registra un pedido en primer plano para medir aciertos del prefetch."""
+
+        key = self.broadcast._cache_key(layer, z, x, y, date_override)
+        if key in self._prefetched:
+            del self._prefetched[key]
+            self._counters["hits"] += 1
+        # Si estaba en cola lo resuelve el pedido en curso.
+        self._queue.pop(key, None)
+
+    def schedule(self, layer: "LayerDefinition", z: int, x: int, y: int, date_override: Optional[DateType]) -> None:
+        for nz, nx, ny in self.candidates(layer, z, x, y):
+            key = self.broadcast._cache_key(layer, nz, nx, ny, date_override)
+            if key in self._queue:
+                self._queue.move_to_end(key)
+                self._counters["deduplicated"] += 1
+                continue
+            if key in self._prefetched:
+                continue
+            self._queue[key] = (layer, nz, nx, ny, date_override)
+            self._counters["enqueued"] += 1
+            if len(self._queue) > self.max_queue:
+                self._queue.popitem(last=False)
+                self._counters["dropped"] += 1
+        if self._queue:
+            self._ensure_workers()
+            self._wakeup.set()
+
+    def candidates(self, layer: "LayerDefinition", z: int, x: int, y: int) -> Iterator[Tuple[int, int, int]]:
+        """Vecinos dentro de ``ring`` tiles y los cuatro hijos, si el zoom de la capa lo permite."""
+
+        columns, rows = matrix_size(layer.projection, z)
+        for dy in range(-self.ring, self.ring + 1):
+            for dx in range(-self.ring, self.ring + 1):
+                nx, ny = x + dx, y + dy
+                if (dx or dy) and 0 <= nx < columns and 0 <= ny < rows:
+                    yield z, nx, ny
+        if layer.max_zoom is None or z < layer.max_zoom:
+            for dy in (0, 1):
+                for dx in (0, 1):
+                    yield z + 1, 2 * x + dx, 2 * y + dy
+
+    def stats(self) -> Dict[str, object]:
+        fetched = self._counters["fetched"]
+        return {
+            **{name: self._counters[name] for name in COUNTERS},
+            "queued": len(self._queue),
+            "hitRate": round(self._counters["hits"] / fetched, 4) if fetched else 0.0,
+        }
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue.clear()
+
+    def _ensure_workers(self) -> None:
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def _worker(self) -> None:
+        # Import diferido: nasa importa este modulo.
+        from app.broadcast.nasa import is_missing_tile, is_placeholder
+
+        while True:
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            await self.broadcast.wait_for_idle_upstream()
+            if not self._queue:
+                continue
+            key, (layer, z, x, y, date_override) = self._queue.popitem(last=True)
+            try:
+                if await self.broadcast.get_tile_headers(layer, z, x, y, date_override) is not None:
+                    self._counters["skipped"] += 1
+                    continue
+                body, _ = await self.broadcast.get_tile(layer, z, x, y, date_override, background=True)
+            except HTTPException as exc:
+                self._counters["missing" if is_missing_tile(exc) else "failed"] += 1
+                continue
+            except Exception:  # noqa: BLE001 - un fallo inesperado no debe detener al worker
+                LOGGER.exception("Prefetch of %s failed", key)
+                self._counters["failed"] += 1
+                continue
+            if is_placeholder(body):
+                self._counters["missing"] += 1
+                continue
+            self._counters["fetched"] += 1
+            self._prefetched[key] = None
+            if len(self._prefetched) > self.remember:
+                self._prefetched.popitem(last=False)
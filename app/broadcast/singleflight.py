@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+import asyncio
+from typing import Awaitable, Callable, Dict, Generic, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight(Generic[T]):
+    """Agrupa llamadas concurrentes por clave para que una sola llegue a NASA.
+
+    La primera llamada (lider) lanza la tarea compartida; las siguientes esperan
+    el mismo resultado. La tarea corre desacoplada de quien la inicio, por lo que
+    cancelar al lider no cancela la descarga para el resto de los que esperan.
+    """
+
+    def __init__(self) -> None:
+        self._inflight: Dict[str, asyncio.Task[T]] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def in_flight(self, key: str) -> bool:
+        return key in self._inflight
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    async def do(self, key: str, factory: Callable[[], Awaitable[T]]) -> T:
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._start(key, factory)
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def spawn(self, key: str, factory: Callable[[], Awaitable[T]]) -> bool:
+        """Lanza la tarea en segundo plano si no hay otra en curso para la clave."""
+
+        if key in self._inflight:
+            return False
+        self._start(key, factory)
+        self.leaders += 1
+        return True
+
+    def _start(self, key: str, factory: Callable[[], Awaitable[T]]) -> asyncio.Task[T]:
+        task = asyncio.ensure_future(factory())
+        self._inflight[key] = task
+
+        def _done(finished: asyncio.Task[T]) -> None:
+            if self._inflight.get(key) is finished:
+                del self._inflight[key]
+            if not finished.cancelled():
+                # Marca la excepcion como consumida aunque todos los que esperaban se hayan ido.
+                finished.exception()
+
+        task.add_done_callback(_done)
+        return task
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "inFlight": len(self._inflight),
+        }
@@ -0,0 +1,559 @@
+from __future__ import annotations
+
+import asyncio
+import importlib.util
+import logging
+import random
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, List, Mapping, Optional, Sequence
+
+import httpx
+
+LOGGER = logging.getLogger("app.upstreams")
+
+# Con HTTP/2 cada conexion multiplexa streams; se toma el maximo habitual que anuncian los servidores.
+H2_STREAMS_PER_CONNECTION = 100
+RETRYABLE_STATUSES = frozenset({502, 503, 504})
+LATENCY_WINDOW = 256
+# Muestras minimas antes de confiar en el percentil para decidir el hedge.
+HEDGE_MIN_SAMPLES = 20
+EWMA_ALPHA = 0.3
+# Fraccion de pedidos que va a un mirror que no es el mas rapido, para volver a medirlo.
+MIRROR_PROBE_RATE = 0.05
+# Fraccion del limite que puede ocupar el trafico de fondo (prefetch, warm-up, exportaciones).
+BACKGROUND_SHARE = 0.5
+
+
+def http2_available() -> bool:
+    return importlib.util.find_spec("h2") is not None
+
+
+class CircuitOpenError(Exception):
+    """El host esta marcado como caido; se rechaza la peticion sin salir a la red."""
+
+    def __init__(self, name: str, retry_after: float) -> None:
+        super().__init__(f"Circuito abierto hacia {name}")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Corta las peticiones a un host tras ``failure_threshold`` fallas seguidas.
+
+    Abierto, rechaza todo durante ``reset_seconds``; luego deja pasar una sola
+    peticion de prueba (half-open) que lo cierra si sale bien o lo reabre si falla.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_seconds: float = 30.0) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.trips = 0
+        self.rejected = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+    def allow(self) -> bool:
+        if self.state == "open":
+            if time.monotonic() - self._opened_at < self.reset_seconds:
+                self.rejected += 1
+                return False
+            self.state = "half_open"
+            self._probing = False
+        if self.state == "half_open":
+            if self._probing:
+                self.rejected += 1
+                return False
+            self._probing = True
+        return True
+
+    def retry_after(self) -> float:
+        return max(0.0, self.reset_seconds - (time.monotonic() - self._opened_at))
+
+    def record_success(self) -> None:
+        self.state = "closed"
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self.trips += 1
+                LOGGER.warning("Circuit to %s opened after %s consecutive failures", self.name, self.failures)
+            self.state = "open"
+            self._opened_at = time.monotonic()
+            self._probing = False
+
+    def release(self) -> None:
+        """La peticion termino sin veredicto (cancelada, sin conexion local): se libera la prueba."""
+
+        self._probing = False
+
+    def stats(self) -> Dict[str, object]:
+        return {"state": self.state, "failures": self.failures, "trips": self.trips, "rejected": self.rejected}
+
+
+class AdaptiveLimiter:
+    """Limite de concurrencia AIMD por host.
+
+    Cada respuesta rapida suma ``1/limite`` (un slot por "ronda"); una respuesta
+    por encima de ``latency_target`` o una falla multiplica el limite por
+    ``decrease``, a lo sumo una vez por latencia observada para que una tanda de
+    respuestas lentas cuente como una sola senal. Con ``latency_target`` en 0 el
+    limite solo baja ante fallas.
+
+    Los pedidos de fondo tienen fila propia: usan a lo sumo ``BACKGROUND_SHARE``
+    del limite y solo toman un slot si no hay pedidos en primer plano esperando.
+    """
+
+    def __init__(
+        self,
+        max_limit: int,
+        min_limit: int = 1,
+        latency_target: float = 0.0,
+        decrease: float = 0.5,
+    ) -> None:
+        self.max_limit = max_limit
+        self.min_limit = min(min_limit, max_limit)
+        self.latency_target = latency_target
+        self.decrease = decrease
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self.background_in_flight = 0
+        self.decreases = 0
+        self._last_decrease = 0.0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._background_waiters: Deque[asyncio.Future] = deque()
+
+    async def acquire(self, background: bool = False) -> None:
+        waiters = self._background_waiters if background else self._waiters
+        while not self._has_room(background):
+            waiter = asyncio.get_running_loop().create_future()
+            waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # Se le habia cedido un slot: pasa al siguiente en la fila.
+                    self._wake()
+                raise
+            finally:
+                if waiter in waiters:
+                    waiters.remove(waiter)
+        self.in_flight += 1
+        if background:
+            self.background_in_flight += 1
+
+    def _has_room(self, background: bool) -> bool:
+        if self.in_flight >= int(self.limit):
+            return False
+        return not background or (not self._waiters and self.background_in_flight < self._background_limit())
+
+    def _background_limit(self) -> int:
+        return max(1, int(self.limit * BACKGROUND_SHARE))
+
+    def release(self, latency: float, ok: Optional[bool], background: bool = False) -> None:
+        """Devuelve el slot; ``ok`` en None (peticion cancelada) no ajusta el limite."""
+
+        self.in_flight -= 1
+        if background:
+            self.background_in_flight -= 1
+        if ok is False or (ok and self.latency_target and latency > self.latency_target):
+            now = time.monotonic()
+            if now - self._last_decrease >= latency:
+                self.limit = max(float(self.min_limit), self.limit * self.decrease)
+                self.decreases += 1
+                self._last_decrease = now
+        elif ok and self.latency_target:
+            self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+        self._wake()
+
+    def _wake(self) -> None:
+        free = int(self.limit) - self.in_flight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+        if self._waiters:
+            return
+        free = min(free, self._background_limit() - self.background_in_flight)
+        while free > 0 and self._background_waiters:
+            waiter = self._background_waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "limit": int(self.limit),
+            "maxLimit": self.max_limit,
+            "decreases": self.decreases,
+            "backgroundInFlight": self.background_in_flight,
+        }
+
+
+class RetryBudget:
+    """Presupuesto de reintentos y hedges: cada peticion original aporta ``ratio`` fichas.
+
+    Un reintento o un hedge consume una ficha; sin fichas no se duplica trafico,
+    de modo que durante una caida la carga extra queda acotada a ``ratio``.
+    """
+
+    def __init__(self, ratio: float = 0.1, max_tokens: float = 10.0) -> None:
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.exhausted = 0
+
+    def deposit(self) -> None:
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        self.exhausted += 1
+        return False
+
+
+class Endpoint:
+    """Una URL base equivalente (mirror) de un host, con su latencia EWMA y estado de expulsion."""
+
+    def __init__(self, base_url: str) -> None:
+        self.base_url = base_url.rstrip("/")
+        self.ewma: Optional[float] = None
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+
+    def is_ejected(self, now: float) -> bool:
+        return now < self.ejected_until
+
+    def record(self, latency: float, ok: bool, eject_after: int, ejection_seconds: float) -> None:
+        self.requests += 1
+        self.ewma = latency if self.ewma is None else EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * self.ewma
+        if ok:
+            self.consecutive_failures = 0
+            return
+        self.failures += 1
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= eject_after:
+            self.ejected_until = time.monotonic() + ejection_seconds
+            self.consecutive_failures = 0
+            LOGGER.warning("Ejecting upstream endpoint %s for %ss", self.base_url, ejection_seconds)
+
+    def stats(self, now: float) -> Dict[str, object]:
+        return {
+            "baseUrl": self.base_url,
+            "ewmaMs": round(self.ewma * 1000, 1) if self.ewma is not None else None,
+            "requests": self.requests,
+            "failures": self.failures,
+            "ejected": self.is_ejected(now),
+        }
+
+
+class Upstream:
+    """Pool de conexiones, circuit breaker y limite adaptativo de un host de NASA.
+
+    Las peticiones esperan turno en el limitador (nunca mas que el pool) antes de
+    llegar a httpx, de modo que la espera por una conexion libre queda medida aqui
+    en lugar de ocurrir, invisible, dentro del pool de httpx.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        timeout: float,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 5.0,
+        http2: bool = False,
+        failure_threshold: int = 5,
+        reset_seconds: float = 30.0,
+        latency_target: float = 0.0,
+        min_concurrency: int = 1,
+        hedge_percentile: float = 0.0,
+        hedge_min_delay: float = 0.05,
+        max_retries: int = 0,
+        retry_backoff: float = 0.1,
+        retry_budget_ratio: float = 0.1,
+        base_urls: Sequence[str] = (),
+        eject_after: int = 3,
+        ejection_seconds: float = 30.0,
+        client: Optional[httpx.AsyncClient] = None,
+    ) -> None:
+        if http2 and not http2_available():
+            LOGGER.warning("HTTP/2 requested for %s but the 'h2' package is not installed; using HTTP/1.1", name)
+            http2 = False
+        self.name = name
+        self.timeout = timeout
+        self.http2 = http2
+        self.max_connections = max_connections
+        self.capacity = max_connections * (H2_STREAMS_PER_CONNECTION if http2 else 1)
+        self._client = client or httpx.AsyncClient(
+            timeout=timeout,
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=keepalive_expiry,
+            ),
+        )
+        self._owns_client = client is None
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_seconds)
+        self.limiter = AdaptiveLimiter(self.capacity, min_concurrency, latency_target)
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.budget = RetryBudget(retry_budget_ratio)
+        self._latencies: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self._hedge_delay: Optional[float] = None
+        self._samples = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.retries = 0
+        # La primera URL es la que usan las plantillas; las demas son mirrors intercambiables.
+        self.endpoints = [Endpoint(base_url) for base_url in base_urls]
+        self.eject_after = eject_after
+        self.ejection_seconds = ejection_seconds
+        self.requests = 0
+        self.failures = 0
+        self.waiting = 0
+        self.pool_timeouts = 0
+        self.pool_wait_seconds = 0.0
+        self.pool_wait_max_seconds = 0.0
+
+    @property
+    def in_flight(self) -> int:
+        return self.limiter.in_flight
+
+    async def get(
+        self,
+        url: str,
+        headers: Optional[Mapping[str, str]] = None,
+        background: bool = False,
+    ) -> httpx.Response:
+        """GET idempotente con hedge y reintentos acotados por el presupuesto.
+
+        Con ``background`` la peticion espera en la fila de baja prioridad del limitador.
+        """
+
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            try:
+                response = await self._hedged(url, headers, background)
+            except httpx.PoolTimeout:
+                # Congestion local, no del host: reintentar solo sumaria carga.
+                raise
+            except (httpx.TimeoutException, httpx.NetworkError):
+                if not self._may_retry(attempt):
+                    raise
+            else:
+                if response.status_code not in RETRYABLE_STATUSES or not self._may_retry(attempt):
+                    return response
+            attempt += 1
+            self.retries += 1
+            # Backoff exponencial con jitter completo para no sincronizar reintentos.
+            await asyncio.sleep(random.uniform(0, self.retry_backoff * 2**attempt))
+
+    def _may_retry(self, attempt: int) -> bool:
+        return attempt < self.max_retries and self.breaker.state == "closed" and self.budget.withdraw()
+
+    async def _hedged(self, url: str, headers: Optional[Mapping[str, str]], background: bool) -> httpx.Response:
+        delay = self._hedge_delay if self.hedge_percentile else None
+        first = self._pick_endpoint()
+        if delay is None:
+            return await self._send(url, headers, first, background)
+
+        tasks: List[asyncio.Task] = [asyncio.create_task(self._send(url, headers, first, background))]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done and self.budget.withdraw():
+                self.hedges += 1
+                # El duplicado prefiere otro mirror que el de la peticion lenta.
+                second = self._pick_endpoint(avoid=first)
+                tasks.append(asyncio.create_task(self._send(url, headers, second, background)))
+            pending = set(tasks)
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    # Una falla solo se devuelve si ya no queda otra copia en vuelo.
+                    if task.exception() is None or not pending:
+                        if task is not tasks[0]:
+                            self.hedge_wins += 1
+                        return task.result()
+        finally:
+            losers = [task for task in tasks if not task.done()]
+            for task in losers:
+                task.cancel()
+            # Se espera la cancelacion para que el slot del limitador quede libre al volver.
+            await asyncio.gather(*losers, return_exceptions=True)
+
+    def _pick_endpoint(self, avoid: Optional[Endpoint] = None) -> Optional[Endpoint]:
+        """Mirror con mejor latencia EWMA entre los no expulsados (los aun sin medir van primero).
+
+        Con probabilidad ``MIRROR_PROBE_RATE`` se elige otro al azar: sin esa
+        exploracion el EWMA de un mirror lento que se recupero nunca se actualiza.
+        """
+
+        if len(self.endpoints) < 2:
+            return None
+        now = time.monotonic()
+        candidates = [endpoint for endpoint in self.endpoints if not endpoint.is_ejected(now)]
+        if not candidates:
+            # Todos expulsados: se prueba el que vuelve antes en lugar de fallar sin intentar.
+            return min(self.endpoints, key=lambda endpoint: endpoint.ejected_until)
+        if avoid is not None and len(candidates) > 1 and avoid in candidates:
+            candidates.remove(avoid)
+        best = min(candidates, key=lambda endpoint: endpoint.ewma if endpoint.ewma is not None else 0.0)
+        others = [endpoint for endpoint in candidates if endpoint is not best]
+        if others and random.random() < MIRROR_PROBE_RATE:
+            return random.choice(others)
+        return best
+
+    def _rewrite(self, url: str, endpoint: Optional[Endpoint]) -> str:
+        primary = self.endpoints[0].base_url if self.endpoints else ""
+        if endpoint is None or endpoint.base_url == primary or not url.startswith(f"{primary}/"):
+            return url
+        return endpoint.base_url + url[len(primary) :]
+
+    @asynccontextmanager
+    async def stream(self, url: str, headers: Optional[Mapping[str, str]] = None) -> AsyncIterator[httpx.Response]:
+        """Como ``get`` pero entrega la respuesta sin leer el cuerpo.
+
+        No hay hedge ni reintentos: una vez que el cuerpo empieza a llegar al
+        cliente la descarga ya no se puede repetir sin que se note.
+        """
+
+        self.budget.deposit()
+        endpoint = self._pick_endpoint()
+        sent = await self._admit()
+        outcome: Optional[bool] = None
+        try:
+            async with self._client.stream("GET", self._rewrite(url, endpoint), headers=headers) as response:
+                outcome = response.status_code < 500
+                if outcome:
+                    self._observe(time.perf_counter() - sent)
+                yield response
+        except httpx.HTTPError:
+            outcome = False
+            raise
+        finally:
+            self._finish(endpoint, outcome, time.perf_counter() - sent)
+
+    async def _send(
+        self,
+        url: str,
+        headers: Optional[Mapping[str, str]],
+        endpoint: Optional[Endpoint] = None,
+        background: bool = False,
+    ) -> httpx.Response:
+        sent = await self._admit(background)
+        outcome: Optional[bool] = None
+        try:
+            response = await self._client.get(self._rewrite(url, endpoint), headers=headers)
+            outcome = response.status_code < 500
+            if outcome:
+                self._observe(time.perf_counter() - sent)
+            return response
+        except httpx.HTTPError:
+            outcome = False
+            raise
+        finally:
+            self._finish(endpoint, outcome, time.perf_counter() - sent, background)
+
+    async def _admit(self, background: bool = False) -> float:
+        """Pasa el circuito y espera un slot del limitador; devuelve el instante de salida."""
+
+        if not self.breaker.allow():
+            raise CircuitOpenError(self.name, self.breaker.retry_after())
+        started = time.perf_counter()
+        self.waiting += 1
+        try:
+            # Mismo limite que el pool de httpx: si no hay conexion a tiempo se reporta como timeout.
+            await asyncio.wait_for(self.limiter.acquire(background), timeout=self.timeout)
+        except asyncio.TimeoutError as exc:
+            self.pool_timeouts += 1
+            self.breaker.release()
+            raise httpx.PoolTimeout(f"Sin conexiones libres hacia {self.name}") from exc
+        except BaseException:
+            self.breaker.release()
+            raise
+        finally:
+            self.waiting -= 1
+        sent = time.perf_counter()
+        waited = sent - started
+        self.pool_wait_seconds += waited
+        self.pool_wait_max_seconds = max(self.pool_wait_max_seconds, waited)
+        self.requests += 1
+        return sent
+
+    def _finish(
+        self,
+        endpoint: Optional[Endpoint],
+        outcome: Optional[bool],
+        latency: float,
+        background: bool = False,
+    ) -> None:
+        if endpoint is not None and outcome is not None:
+            # Una falla rapida (conexion rechazada) no debe hacer parecer rapido al mirror.
+            sample = latency if outcome else max(latency, self.timeout)
+            endpoint.record(sample, outcome, self.eject_after, self.ejection_seconds)
+        self._settle(outcome, latency, background)
+
+    def _observe(self, latency: float) -> None:
+        if not self.hedge_percentile:
+            return
+        self._latencies.append(latency)
+        self._samples += 1
+        # El percentil se recalcula cada tanto; ordenar la ventana en cada peticion no hace falta.
+        if len(self._latencies) >= HEDGE_MIN_SAMPLES and self._samples % 16 == 0:
+            ordered = sorted(self._latencies)
+            index = min(len(ordered) - 1, int(len(ordered) * self.hedge_percentile))
+            self._hedge_delay = max(self.hedge_min_delay, ordered[index])
+
+    def _settle(self, outcome: Optional[bool], latency: float, background: bool = False) -> None:
+        # outcome None: cancelada, no dice nada sobre la salud del host.
+        self.limiter.release(latency, outcome, background)
+        if outcome is None:
+            self.breaker.release()
+        elif outcome:
+            self.breaker.record_success()
+        else:
+            self.failures += 1
+            self.breaker.record_failure()
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "http2": self.http2,
+            "maxConnections": self.max_connections,
+            "requests": self.requests,
+            "failures": self.failures,
+            "inFlight": self.in_flight,
+            "waiting": self.waiting,
+            "poolTimeouts": self.pool_timeouts,
+            "poolWaitSeconds": round(self.pool_wait_seconds, 6),
+            "poolWaitMaxSeconds": round(self.pool_wait_max_seconds, 6),
+            "poolWaitAvgMs": round(self.pool_wait_seconds / self.requests * 1000, 3) if self.requests else 0.0,
+            "circuit": self.breaker.stats(),
+            "concurrency": self.limiter.stats(),
+            "hedges": self.hedges,
+            "hedgeWins": self.hedge_wins,
+            "hedgeDelayMs": round(self._hedge_delay * 1000, 1) if self._hedge_delay is not None else None,
+            "retries": self.retries,
+            "retryBudget": {"tokens": round(self.budget.tokens, 2), "exhausted": self.budget.exhausted},
+            "endpoints": [endpoint.stats(time.monotonic()) for endpoint in self.endpoints],
+        }
+
+    async def aclose(self) -> None:
+        if self._owns_client:
+            await self._client.aclose()
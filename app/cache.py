@@ -1,11 +1,44 @@
 from __future__ import annotations
 
+import asyncio
 import json
+import logging
+import os
+import re
+import shutil
+import struct
+import tempfile
 import time
+from collections import Counter, OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from hashlib import sha256
 from pathlib import Path
-from typing import Mapping, MutableMapping, Optional
+from threading import Lock
+from typing import Any, BinaryIO, Callable, Dict, List, Mapping, Optional, Protocol, Tuple, TypeVar
+
+from app.cache_blobs import BLOB_DIRNAME, BlobStore
+from app.cache_index import INDEX_FILENAME, CacheKeyIndex, IndexedEntry, KeyFilter
+
+T = TypeVar("T")
+
+LOGGER = logging.getLogger("app.cache")
+
+# Formato de entrada empaquetada: magic, expiresAt (float64), largo de metadata y
+# largo del cuerpo, seguido de la metadata JSON y el cuerpo. ``expiresAt`` queda en
+# un offset fijo para poder actualizarlo sin reescribir el archivo.
+ENTRY_MAGIC = b"NTC1"
+ENTRY_HEADER = struct.Struct("<4sdII")
+ENTRY_EXPIRES_OFFSET = 4
+ENTRY_SUFFIX = ".tile"
+TEMP_SUFFIX = ".tmp"
+# Un temporal mas viejo que esto quedo de un proceso que murio a mitad de escritura.
+TEMP_GRACE_SECONDS = 15 * 60
+# Nombres del formato plano anterior: sha256 de la clave mas ``.json``/``.bin``.
+LEGACY_NAME = re.compile(r"[0-9a-f]{64}\.(json|bin)")
+# Espacio libre reservado en la metadata de una entrada escrita por partes, para
+# agregar encabezados que solo se conocen al terminar (el ETag derivado del cuerpo).
+STREAM_META_RESERVE = 128
 
 
 @dataclass
@@ -18,56 +51,1008 @@ class CachedPayload:
     def is_expired(self) -> bool:
         return time.time() > self.expires_at
 
+    @property
+    def size(self) -> int:
+        return len(self.body)
+
+
+@dataclass
+class CachedHead:
+    """Metadata de una entrada sin su cuerpo."""
+
+    headers: Mapping[str, str]
+    expires_at: float
+    size: int
+
+    @property
+    def is_expired(self) -> bool:
+        return time.time() > self.expires_at
+
+
+@dataclass
+class CachedFile:
+    """Entrada vigente en disco abierta para servir su cuerpo sin cargarlo en memoria.
+
+    El descriptor queda abierto aunque el archivo se reemplace o se elimine, asi
+    que el rango ``offset``/``length`` siempre corresponde a la misma entrada.
+    """
+
+    handle: BinaryIO
+    offset: int
+    length: int
+    headers: Mapping[str, str]
+    expires_at: float
+
+    def fileno(self) -> int:
+        return self.handle.fileno()
+
+    def close(self) -> None:
+        self.handle.close()
+
+
+class CacheEntryWriter:
+    """Entrada escrita por partes en un temporal que solo aparece en el cache al ``commit``.
+
+    El encabezado se completa al final con el largo real del cuerpo; una descarga
+    incompleta se descarta con ``abort`` sin dejar rastro en el cache.
+    """
+
+    def __init__(self, cache: "FileCache", key: str, headers: Mapping[str, str]) -> None:
+        self.cache = cache
+        self.key = key
+        self.digest = cache._hash_key(key)
+        self.path = cache._path_for_digest(self.digest)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, self._tmp_name = tempfile.mkstemp(dir=self.path.parent, prefix=".", suffix=TEMP_SUFFIX)
+        self._handle = os.fdopen(fd, "w+b")
+        self._meta_len = len(_entry_meta(key, headers)) + STREAM_META_RESERVE
+        self._handle.seek(ENTRY_HEADER.size + self._meta_len)
+        self.body_len = 0
+
+    def write(self, chunk: bytes) -> None:
+        self._handle.write(chunk)
+        self.body_len += len(chunk)
+
+    def commit(self, headers: Mapping[str, str], ttl_seconds: Optional[float] = None) -> float:
+        raw_meta = _entry_meta(self.key, headers)
+        if len(raw_meta) > self._meta_len:
+            self.abort()
+            raise ValueError("Los encabezados finales no entran en la metadata reservada")
+        expires_at = time.time() + (self.cache.ttl_seconds if ttl_seconds is None else ttl_seconds)
+        try:
+            self._handle.seek(0)
+            self._handle.write(ENTRY_HEADER.pack(ENTRY_MAGIC, expires_at, self._meta_len, self.body_len))
+            # JSON admite espacios al final: el relleno completa el largo reservado.
+            self._handle.write(raw_meta.ljust(self._meta_len))
+            self._handle.close()
+            os.replace(self._tmp_name, self.path)
+        except BaseException:
+            self.abort()
+            raise
+        size = ENTRY_HEADER.size + self._meta_len + self.body_len
+        # La entrada anterior pudo apuntar a un blob compartido.
+        self.cache._release_blob(self.digest)
+        self.cache._account(self.digest, size, expires_at)
+        if self.cache.key_index is not None:
+            self.cache.key_index.put(self.key, self.digest, size, expires_at)
+        return expires_at
+
+    def abort(self) -> None:
+        self._handle.close()
+        try:
+            os.unlink(self._tmp_name)
+        except OSError:
+            pass
+
+
+class MemoryCache:
+    """Nivel LRU en memoria del proceso, acotado por un presupuesto de bytes."""
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, CachedPayload] = OrderedDict()
+        self._size = 0
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[CachedPayload]:
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is None:
+                self.misses += 1
+                return None
+            if cached.is_expired:
+                self._pop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return cached
+
+    def set(self, key: str, payload: CachedPayload) -> None:
+        # Un solo tile enorme no debe vaciar el nivel completo.
+        if payload.size > self.max_bytes // 4:
+            self.delete(key)
+            return
+        with self._lock:
+            self._pop(key)
+            self._entries[key] = payload
+            self._size += payload.size
+            while self._size > self.max_bytes and self._entries:
+                oldest = next(iter(self._entries))
+                self._pop(oldest)
+                self.evictions += 1
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._pop(key)
+
+    def __contains__(self, key: str) -> bool:
+        cached = self._entries.get(key)
+        return cached is not None and not cached.is_expired
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _pop(self, key: str) -> None:
+        cached = self._entries.pop(key, None)
+        if cached is not None:
+            self._size -= cached.size
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._size,
+            "maxBytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class EntryWriter(Protocol):
+    """Entrada que se escribe por partes mientras llega el cuerpo desde NASA."""
+
+    key: str
+
+    def write(self, chunk: bytes) -> None: ...
+
+    def abort(self) -> None: ...
+
+
+class TileStore(Protocol):
+    """Interfaz comun de los backends del cache de tiles.
+
+    ``FileCache`` guarda un archivo por tile y ``MBTilesCache`` (``app.cache_mbtiles``)
+    una base SQLite con esquema MBTiles por capa y fecha. ``NasaBroadcast``, el
+    janitor y las rutas de administracion solo usan estos metodos.
+    """
+
+    def hot(self, key: str) -> Optional[CachedPayload]: ...
+
+    async def aget(self, key: str, allow_stale: bool = False) -> Optional[CachedPayload]: ...
+
+    async def aset(
+        self,
+        key: str,
+        body: bytes,
+        headers: Mapping[str, str],
+        ttl_seconds: Optional[float] = None,
+    ) -> None: ...
+
+    async def ahead(self, key: str) -> Optional[CachedHead]: ...
+
+    async def aopen(self, key: str) -> Optional[CachedFile]: ...
+
+    async def arefresh(
+        self,
+        key: str,
+        cached: Optional[CachedPayload] = None,
+        ttl_seconds: Optional[float] = None,
+    ) -> bool: ...
+
+    async def adelete(self, key: str) -> None: ...
+
+    async def aopen_writer(self, key: str, headers: Mapping[str, str]) -> EntryWriter: ...
+
+    async def awrite(self, writer: Any, chunk: bytes) -> None: ...
+
+    async def acommit(
+        self,
+        writer: Any,
+        headers: Mapping[str, str],
+        body: Optional[bytes] = None,
+        ttl_seconds: Optional[float] = None,
+    ) -> None: ...
+
+    async def aabort(self, writer: Any) -> None: ...
+
+    async def aentries(self, key_filter: KeyFilter, limit: Optional[int] = None) -> List[IndexedEntry]: ...
+
+    async def apurge(self, key_filter: KeyFilter) -> Tuple[int, int]: ...
+
+    async def alayer_stats(self) -> Dict[str, Dict[str, int]]: ...
+
+    async def adedup_stats(self) -> Optional[Dict[str, object]]: ...
+
+    async def amigrate_legacy_layout(self) -> int: ...
+
+    async def arebuild_index(self) -> int: ...
+
+    async def arekey(self, rename: Callable[[str], Optional[str]]) -> int: ...
+
+    async def aevict(self) -> int: ...
+
+    def stats(self) -> Dict[str, Dict[str, int]]: ...
+
+    def close(self) -> None: ...
+
 
 class FileCache:
-    """Cache minimo basado en archivos para respuestas binarias."""
+    """Cache minimo basado en archivos para respuestas binarias.
+
+    Cada entrada es un unico archivo ``<sha>.tile`` (encabezado binario + cuerpo)
+    repartido en subdirectorios ``ab/cd/`` segun el prefijo del hash y escrito via
+    archivo temporal + ``os.replace`` para que otros workers nunca lean entradas a
+    medio escribir.
 
-    def __init__(self, base_dir: Path, ttl_seconds: int) -> None:
+    Si recibe un ``MemoryCache`` lo consulta antes de tocar el disco, de modo que
+    los tiles mas pedidos se sirven sin I/O. Los metodos ``aget``/``aset``/``adelete``
+    ejecutan el acceso a disco en un pool de hilos acotado para no bloquear el
+    event loop.
+    """
+
+    def __init__(
+        self,
+        base_dir: Path,
+        ttl_seconds: int,
+        memory: Optional[MemoryCache] = None,
+        io_workers: int = 4,
+        max_bytes: int = 0,
+        max_entries: int = 0,
+        stale_retention_seconds: float = 0,
+        key_index: Optional[CacheKeyIndex] = None,
+        dedup: bool = False,
+        shared_blobs: int = 64,
+    ) -> None:
         self.base_dir = base_dir
         self.ttl_seconds = ttl_seconds
+        self.memory = memory
+        self.io_workers = io_workers
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.stale_retention_seconds = stale_retention_seconds
+        self._executor: Optional[ThreadPoolExecutor] = None
+        # Indice en memoria digest -> (bytes, expiresAt) ordenado por uso reciente;
+        # mantiene el total de bytes sin recorrer el arbol en cada ciclo del janitor.
+        self._index: OrderedDict[str, Tuple[int, float]] = OrderedDict()
+        self._total_bytes = 0
+        self._index_lock = Lock()
+        self.evictions = 0
+        self._temp_swept_at = 0.0
+        self.key_index = key_index
+        self._layer_counters: Dict[str, Counter[str]] = defaultdict(Counter)
         self.base_dir.mkdir(parents=True, exist_ok=True)
+        # Modo deduplicado: las entradas solo guardan metadata y apuntan a un blob por contenido.
+        self.blobs: Optional[BlobStore] = (
+            BlobStore(self.base_dir / BLOB_DIRNAME, self._write_atomic, shared_blobs) if dedup else None
+        )
 
     def _hash_key(self, key: str) -> str:
         return sha256(key.encode("utf-8")).hexdigest()
 
-    def _payload_path(self, key: str) -> Path:
-        return self.base_dir / f"{self._hash_key(key)}.bin"
+    def _path_for_digest(self, digest: str) -> Path:
+        return self.base_dir / digest[:2] / digest[2:4] / f"{digest}{ENTRY_SUFFIX}"
 
-    def _metadata_path(self, key: str) -> Path:
-        return self.base_dir / f"{self._hash_key(key)}.json"
+    def hot(self, key: str) -> Optional[CachedPayload]:
+        """Entrada del nivel en memoria, sin tocar el disco ni el pool de hilos."""
 
-    def get(self, key: str) -> Optional[CachedPayload]:
-        payload_path = self._payload_path(key)
-        metadata_path = self._metadata_path(key)
-        if not payload_path.exists() or not metadata_path.exists():
+        if self.memory is None or key not in self.memory:
+            return None
+        hot = self.memory.get(key)
+        if hot is None:
+            return None
+        self._touch(self._hash_key(key))
+        return self._record(key, hot)
+
+    def get(self, key: str, allow_stale: bool = False) -> Optional[CachedPayload]:
+        hot = self.hot(key)
+        if hot is not None:
+            return hot
+        return self._record(key, self._load(key, allow_stale))
+
+    def set(self, key: str, body: bytes, headers: Mapping[str, str], ttl_seconds: Optional[float] = None) -> None:
+        self._store(key, self._remember(key, body, headers, ttl_seconds))
+
+    def delete(self, key: str) -> None:
+        if self.memory is not None:
+            self.memory.delete(key)
+        self._remove(key)
+
+    async def aget(self, key: str, allow_stale: bool = False) -> Optional[CachedPayload]:
+        hot = self.hot(key)
+        if hot is not None:
+            return hot
+        return self._record(key, await self._run_io(self._load, key, allow_stale))
+
+    def _record(self, key: str, cached: Optional[CachedPayload]) -> Optional[CachedPayload]:
+        if cached is not None and not cached.is_expired:
+            self._record_hit(key, cached.size)
+        else:
+            self._layer_counters[_layer_of(key)]["misses"] += 1
+        return cached
+
+    def _record_hit(self, key: str, size: int) -> None:
+        counters = self._layer_counters[_layer_of(key)]
+        counters["hits"] += 1
+        counters["hitBytes"] += size
+
+    def head(self, key: str) -> Optional[CachedHead]:
+        """Devuelve encabezados y vigencia de una entrada vigente sin leer el cuerpo."""
+
+        hot = self._hot_head(key)
+        return hot if hot is not None else self._load_head(key)
+
+    async def ahead(self, key: str) -> Optional[CachedHead]:
+        hot = self._hot_head(key)
+        return hot if hot is not None else await self._run_io(self._load_head, key)
+
+    def _hot_head(self, key: str) -> Optional[CachedHead]:
+        if self.memory is None:
+            return None
+        hot = self.memory.get(key)
+        if hot is None:
+            return None
+        return CachedHead(headers=hot.headers, expires_at=hot.expires_at, size=hot.size)
+
+    def _load_head(self, key: str) -> Optional[CachedHead]:
+        try:
+            with self._path_for_digest(self._hash_key(key)).open("rb") as handle:
+                header = handle.read(ENTRY_HEADER.size)
+                if len(header) < ENTRY_HEADER.size:
+                    return None
+                magic, expires_at, meta_len, body_len = ENTRY_HEADER.unpack(header)
+                if magic != ENTRY_MAGIC or time.time() > expires_at:
+                    return None
+                meta = json.loads(handle.read(meta_len))
+        except (OSError, ValueError):
+            return None
+        return CachedHead(headers=meta.get("headers", {}), expires_at=expires_at, size=meta.get("size", body_len))
+
+    def open(self, key: str) -> Optional[CachedFile]:
+        """Abre una entrada vigente del disco; ``None`` si falta, vencio o ya esta en memoria.
+
+        Los tiles calientes se sirven desde el nivel en memoria, por lo que no se
+        abren archivos para ellos.
+        """
+
+        if self.memory is not None and key in self.memory:
+            return None
+        digest = self._hash_key(key)
+        try:
+            handle = self._path_for_digest(digest).open("rb")
+        except OSError:
             return None
+        try:
+            header = handle.read(ENTRY_HEADER.size)
+            if len(header) < ENTRY_HEADER.size:
+                raise ValueError("truncated header")
+            magic, expires_at, meta_len, body_len = ENTRY_HEADER.unpack(header)
+            offset = ENTRY_HEADER.size + meta_len
+            if magic != ENTRY_MAGIC or os.fstat(handle.fileno()).st_size != offset + body_len:
+                raise ValueError("invalid entry")
+            if time.time() > expires_at:
+                handle.close()
+                return None
+            meta = json.loads(handle.read(meta_len))
+            if "blob" in meta:
+                handle.close()
+                handle, offset, body_len = self._open_blob(meta["blob"], meta.get("size", 0))
+        except (OSError, ValueError):
+            handle.close()
+            return None
+        self._touch(digest)
+        self._record_hit(key, body_len)
+        return CachedFile(
+            handle=handle,
+            offset=offset,
+            length=body_len,
+            headers=meta.get("headers", {}),
+            expires_at=expires_at,
+        )
+
+    def _open_blob(self, blob: str, size: int) -> Tuple[BinaryIO, int, int]:
+        # Los blobs compartidos se sirven desde memoria (``get``) en lugar de abrir el archivo.
+        if self.blobs is None or self.blobs.is_shared(blob):
+            raise ValueError("blob served from memory")
+        handle = self.blobs.open(blob)
+        if handle is None:
+            raise ValueError("missing blob")
+        if os.fstat(handle.fileno()).st_size != size:
+            handle.close()
+            raise ValueError("invalid blob")
+        return handle, 0, size
+
+    async def aopen(self, key: str) -> Optional[CachedFile]:
+        return await self._run_io(self.open, key)
+
+    def refresh(self, key: str, cached: Optional[CachedPayload] = None, ttl_seconds: Optional[float] = None) -> bool:
+        """Extiende la vigencia de una entrada existente sin leer ni reescribir su cuerpo.
+
+        Solo se actualiza ``expiresAt`` en su offset fijo del encabezado; lo usa la
+        revalidacion condicional cuando NASA responde 304. Si se pasa el contenido
+        ya leido, vuelve al nivel en memoria con la nueva vigencia.
+        """
+
+        digest = self._hash_key(key)
+        expires_at = time.time() + (self.ttl_seconds if ttl_seconds is None else ttl_seconds)
+        try:
+            with self._path_for_digest(digest).open("r+b") as handle:
+                header = handle.read(ENTRY_HEADER.size)
+                if len(header) < ENTRY_HEADER.size:
+                    return False
+                magic, _, meta_len, body_len = ENTRY_HEADER.unpack(header)
+                if magic != ENTRY_MAGIC:
+                    return False
+                handle.seek(ENTRY_EXPIRES_OFFSET)
+                handle.write(struct.pack("<d", expires_at))
+        except OSError:
+            return False
+        self._account(digest, ENTRY_HEADER.size + meta_len + body_len, expires_at)
+        if self.key_index is not None:
+            self.key_index.touch(digest, expires_at)
+        if self.memory is not None and cached is not None:
+            self.memory.set(key, CachedPayload(body=cached.body, headers=cached.headers, expires_at=expires_at))
+        return True
+
+    async def arefresh(
+        self,
+        key: str,
+        cached: Optional[CachedPayload] = None,
+        ttl_seconds: Optional[float] = None,
+    ) -> bool:
+        return await self._run_io(self.refresh, key, cached, ttl_seconds)
+
+    async def aset(
+        self,
+        key: str,
+        body: bytes,
+        headers: Mapping[str, str],
+        ttl_seconds: Optional[float] = None,
+    ) -> None:
+        await self._run_io(self._store, key, self._remember(key, body, headers, ttl_seconds))
 
-        raw_meta = json.loads(metadata_path.read_text(encoding="utf-8"))
-        cached = CachedPayload(
-            body=payload_path.read_bytes(),
-            headers=raw_meta.get("headers", {}),
-            expires_at=raw_meta.get("expiresAt", 0),
+    def open_writer(self, key: str, headers: Mapping[str, str]) -> CacheEntryWriter:
+        return CacheEntryWriter(self, key, headers)
+
+    async def aopen_writer(self, key: str, headers: Mapping[str, str]) -> CacheEntryWriter:
+        return await self._run_io(self.open_writer, key, headers)
+
+    async def awrite(self, writer: CacheEntryWriter, chunk: bytes) -> None:
+        await self._run_io(writer.write, chunk)
+
+    async def acommit(
+        self,
+        writer: CacheEntryWriter,
+        headers: Mapping[str, str],
+        body: Optional[bytes] = None,
+        ttl_seconds: Optional[float] = None,
+    ) -> None:
+        """Publica la entrada escrita por partes; con ``body`` tambien la sube al nivel en memoria."""
+
+        if self.blobs is not None and body:
+            # En modo deduplicado el cuerpo va al blob por contenido; el temporal sobra.
+            await self._run_io(writer.abort)
+            await self.aset(writer.key, body, headers, ttl_seconds)
+            return
+        expires_at = await self._run_io(writer.commit, headers, ttl_seconds)
+        if self.memory is not None and body is not None:
+            self.memory.set(writer.key, CachedPayload(body=body, headers=dict(headers), expires_at=expires_at))
+
+    async def aabort(self, writer: CacheEntryWriter) -> None:
+        await self._run_io(writer.abort)
+
+    async def adelete(self, key: str) -> None:
+        if self.memory is not None:
+            self.memory.delete(key)
+        await self._run_io(self._remove, key)
+
+    def close(self) -> None:
+        if self.key_index is not None:
+            self.key_index.close()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def _remember(
+        self,
+        key: str,
+        body: bytes,
+        headers: Mapping[str, str],
+        ttl_seconds: Optional[float] = None,
+    ) -> CachedPayload:
+        payload = CachedPayload(
+            body=body,
+            headers=dict(headers),
+            expires_at=time.time() + (self.ttl_seconds if ttl_seconds is None else ttl_seconds),
         )
+        if self.memory is not None:
+            self.memory.set(key, payload)
+        return payload
+
+    async def _run_io(self, func: Callable[..., T], *args: object) -> T:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.io_workers,
+                thread_name_prefix="tile-cache-io",
+            )
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _load(self, key: str, allow_stale: bool = False) -> Optional[CachedPayload]:
+        digest = self._hash_key(key)
+        try:
+            raw = self._path_for_digest(digest).read_bytes()
+        except OSError:
+            return None
+
+        unpacked = _unpack_entry(raw)
+        if unpacked is None:
+            self._remove(key)
+            return None
+        cached, blob = unpacked
+        if cached.is_expired and not allow_stale:
+            return None
+        if blob is not None:
+            body = self.blobs.read(blob) if self.blobs is not None else None
+            if body is None:
+                # Blob reemplazado en paralelo (o dedup desactivado): se trata como fallo sin borrar nada.
+                return None
+            cached = CachedPayload(body=body, headers=cached.headers, expires_at=cached.expires_at)
+        # Las entradas expiradas se conservan para revalidarlas contra NASA; el janitor las retira.
         if cached.is_expired:
+            return cached
+        self._touch(digest)
+        if self.memory is not None and not (blob is not None and self.blobs.is_shared(blob)):
+            self.memory.set(key, cached)
+        return cached
+
+    def _store(self, key: str, payload: CachedPayload) -> None:
+        digest = self._hash_key(key)
+        blob = None
+        if self.blobs is not None and payload.body:
+            blob = self.blobs.store(digest, _layer_of(key), payload.body)
+        data = _pack_entry(key, payload, blob)
+        self._write_atomic(self._path_for_digest(digest), data)
+        if blob is None:
+            self._release_blob(digest)
+        self._account(digest, len(data), payload.expires_at)
+        if self.key_index is not None:
+            # El indice lleva el tamano logico de la entrada, compartido o no.
+            size = len(data) + (payload.size if blob is not None else 0)
+            self.key_index.put(key, digest, size, payload.expires_at)
+
+    def _write_atomic(self, path: Path, data: bytes) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=".", suffix=TEMP_SUFFIX)
+        try:
+            with os.fdopen(fd, "wb") as handle:
+                handle.write(data)
+            os.replace(tmp_name, path)
+        except BaseException:
             try:
-                payload_path.unlink()
-                metadata_path.unlink()
+                os.unlink(tmp_name)
             except OSError:
                 pass
-            return None
-        return cached
+            raise
+
+    def _remove(self, key: str) -> None:
+        self._remove_digest(self._hash_key(key))
+
+    def _remove_digest(self, digest: str) -> None:
+        self._forget(digest)
+        if self.key_index is not None:
+            self.key_index.discard([digest])
+        try:
+            self._path_for_digest(digest).unlink()
+        except OSError:
+            pass
+
+    def _account(self, digest: str, size: int, expires_at: float) -> None:
+        with self._index_lock:
+            previous = self._index.pop(digest, None)
+            if previous is not None:
+                self._total_bytes -= previous[0]
+            self._index[digest] = (size, expires_at)
+            self._total_bytes += size
+
+    def _touch(self, digest: str) -> None:
+        with self._index_lock:
+            if digest in self._index:
+                self._index.move_to_end(digest)
+
+    def _forget(self, digest: str) -> None:
+        with self._index_lock:
+            previous = self._index.pop(digest, None)
+            if previous is not None:
+                self._total_bytes -= previous[0]
+        self._release_blob(digest)
+
+    def rebuild_index(self) -> int:
+        """Recorre el arbol una sola vez para conocer las entradas existentes.
+
+        Las entradas encontradas se ubican como las menos recientes, por detras de
+        las que se escribieron o leyeron mientras corria el escaneo.
+        """
+
+        self.sweep_temp_files()
+        known = self.key_index.digests() if self.key_index is not None else set()
+        scanned: "OrderedDict[str, Tuple[int, float]]" = OrderedDict()
+        for path in self.base_dir.glob(f"*/*/*{ENTRY_SUFFIX}"):
+            try:
+                stat = path.stat()
+                with path.open("rb") as handle:
+                    header = handle.read(ENTRY_HEADER.size)
+                    if len(header) < ENTRY_HEADER.size:
+                        continue
+                    magic, expires_at, meta_len, _ = ENTRY_HEADER.unpack(header)
+                    if magic != ENTRY_MAGIC:
+                        continue
+                    unindexed = self.key_index is not None and path.stem not in known
+                    if unindexed or self.blobs is not None:
+                        meta = json.loads(handle.read(meta_len))
+                        key = meta.get("key")
+                        if self.blobs is not None and "blob" in meta:
+                            self.blobs.link(path.stem, _layer_of(key) if key else "", meta["blob"])
+                        if unindexed and key:
+                            # Entrada escrita por otro proceso o antes del indice: la clave va en su metadata.
+                            self.key_index.put(key, path.stem, stat.st_size + meta.get("size", 0), expires_at)
+            except (OSError, ValueError):
+                continue
+            scanned[path.stem] = (stat.st_size, expires_at)
+        if self.key_index is not None:
+            self.key_index.discard(known.difference(scanned))
+        if self.blobs is not None:
+            self.blobs.scan()
+        # Orden LRU inicial aproximado: los archivos escritos hace mas tiempo primero.
+        ordered = sorted(scanned.items(), key=lambda item: item[1][1])
+        with self._index_lock:
+            live = self._index
+            self._index = OrderedDict((digest, meta) for digest, meta in ordered if digest not in live)
+            self._index.update(live)
+            self._total_bytes = sum(size for size, _ in self._index.values())
+            return len(self._index)
+
+    def sweep_temp_files(self, grace_seconds: float = TEMP_GRACE_SECONDS) -> int:
+        """Borra los temporales de escrituras interrumpidas (proceso caido); devuelve cuantos."""
+
+        cutoff = time.time() - grace_seconds
+        self._temp_swept_at = time.time()
+        pattern = f".*{TEMP_SUFFIX}"
+        candidates = list(self.base_dir.glob(f"*/*/{pattern}"))
+        if self.blobs is not None:
+            candidates.extend(self.blobs.base_dir.glob(f"*/*/{pattern}"))
+        removed = 0
+        for path in candidates:
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+                    removed += 1
+            except OSError:
+                continue
+        if removed:
+            LOGGER.info("Removed %s leftover temporary files from the tile cache", removed)
+        return removed
+
+    def evict(self) -> int:
+        """Elimina entradas hasta cumplir el presupuesto.
+
+        Las expiradas hace mas de ``stale_retention_seconds`` se retiran siempre. Si
+        aun se excede el presupuesto, salen primero las expiradas que se guardaban
+        para revalidar y luego las menos usadas.
+        """
+
+        if self.blobs is not None:
+            self.blobs.sweep()
+        now = time.time()
+        if now - self._temp_swept_at >= TEMP_GRACE_SECONDS:
+            self.sweep_temp_files()
+        victims = []
+        with self._index_lock:
+            stale = []
+            for digest, (size, expires_at) in list(self._index.items()):
+                if expires_at + self.stale_retention_seconds < now:
+                    victims.append(digest)
+                    self._total_bytes -= size
+                    del self._index[digest]
+                    self._release_blob(digest)
+                elif expires_at < now:
+                    stale.append(digest)
+            for digest in stale:
+                if not self._over_budget():
+                    break
+                size, _ = self._index.pop(digest)
+                victims.append(digest)
+                self._total_bytes -= size
+                # Con dedup solo se liberan los bytes del blob si era su ultima referencia.
+                self._release_blob(digest)
+            while self._index and self._over_budget():
+                digest, (size, _) = self._index.popitem(last=False)
+                victims.append(digest)
+                self._total_bytes -= size
+                # Con dedup solo se liberan los bytes del blob si era su ultima referencia.
+                self._release_blob(digest)
+        for digest in victims:
+            try:
+                self._path_for_digest(digest).unlink()
+            except OSError:
+                pass
+        if self.key_index is not None and victims:
+            self.key_index.discard(victims)
+        self.evictions += len(victims)
+        return len(victims)
+
+    def entries(self, key_filter: KeyFilter, limit: Optional[int] = None) -> List[IndexedEntry]:
+        if self.key_index is None:
+            return []
+        return self.key_index.find(key_filter, limit)
+
+    def purge(self, key_filter: KeyFilter) -> Tuple[int, int]:
+        """Elimina las entradas indexadas que coinciden; devuelve (entradas, bytes)."""
+
+        matched = self.entries(key_filter)
+        for entry in matched:
+            if self.memory is not None:
+                self.memory.delete(entry.key)
+            self._forget(entry.digest)
+            try:
+                self._path_for_digest(entry.digest).unlink()
+            except OSError:
+                pass
+        if self.key_index is not None:
+            self.key_index.discard(entry.digest for entry in matched)
+        return len(matched), sum(entry.size for entry in matched)
+
+    async def apurge(self, key_filter: KeyFilter) -> Tuple[int, int]:
+        return await self._run_io(self.purge, key_filter)
+
+    async def aentries(self, key_filter: KeyFilter, limit: Optional[int] = None) -> List[IndexedEntry]:
+        return await self._run_io(self.entries, key_filter, limit)
+
+    def layer_stats(self) -> Dict[str, Dict[str, int]]:
+        """Aciertos, fallos y bytes servidos por capa, junto a entradas y bytes en disco."""
+
+        totals = self.key_index.layer_totals() if self.key_index is not None else {}
+        layers: Dict[str, Dict[str, int]] = {}
+        for layer in set(totals) | set(self._layer_counters):
+            counters = self._layer_counters.get(layer, Counter())
+            layers[layer] = {
+                "hits": counters["hits"],
+                "misses": counters["misses"],
+                "hitBytes": counters["hitBytes"],
+                **totals.get(layer, {"entries": 0, "bytes": 0}),
+            }
+        return layers
+
+    async def alayer_stats(self) -> Dict[str, Dict[str, int]]:
+        return await self._run_io(self.layer_stats)
+
+    def dedup_stats(self) -> Optional[Dict[str, object]]:
+        """Ahorro de la deduplicacion por capa; ``None`` si el modo no esta activo."""
+
+        return self.blobs.stats() if self.blobs is not None else None
+
+    async def adedup_stats(self) -> Optional[Dict[str, object]]:
+        return await self._run_io(self.dedup_stats)
+
+    def _release_blob(self, digest: str) -> None:
+        if self.blobs is not None:
+            self.blobs.release(digest)
+
+    def _over_budget(self) -> bool:
+        total_bytes = self._total_bytes + (self.blobs.total_bytes if self.blobs is not None else 0)
+        if self.max_bytes and total_bytes > self.max_bytes:
+            return True
+        return bool(self.max_entries and len(self._index) > self.max_entries)
+
+    async def arebuild_index(self) -> int:
+        return await self._run_io(self.rebuild_index)
+
+    async def amigrate_legacy_layout(self) -> int:
+        return await self._run_io(self.migrate_legacy_layout)
+
+    async def arekey(self, rename: Callable[[str], Optional[str]]) -> int:
+        return await self._run_io(self.rekey, rename)
+
+    async def aevict(self) -> int:
+        return await self._run_io(self.evict)
+
+    def migrate_legacy_layout(self) -> int:
+        """Convierte pares ``<sha>.bin``/``<sha>.json`` del formato plano anterior.
+
+        El nombre legado ya es el sha256 de la clave, asi que cada entrada se
+        reubica en su shard sin necesitar la clave original. Devuelve la cantidad
+        de entradas migradas; las expiradas o incompletas se descartan.
+        """
 
-    def set(self, key: str, body: bytes, headers: Mapping[str, str]) -> None:
-        metadata: MutableMapping[str, object] = {
-            "headers": dict(headers),
-            "expiresAt": time.time() + self.ttl_seconds,
+        migrated = 0
+        for entry in os.scandir(self.base_dir):
+            # Otros archivos de la raiz (indice, checkpoints) no son entradas legadas.
+            if not entry.is_file() or not entry.name.endswith(".json") or not LEGACY_NAME.fullmatch(entry.name):
+                continue
+            digest = entry.name[: -len(".json")]
+            metadata_path = Path(entry.path)
+            payload_path = self.base_dir / f"{digest}.bin"
+            try:
+                raw_meta = json.loads(metadata_path.read_text(encoding="utf-8"))
+                payload: Optional[CachedPayload] = CachedPayload(
+                    body=payload_path.read_bytes(),
+                    headers=raw_meta.get("headers", {}),
+                    expires_at=raw_meta.get("expiresAt", 0),
+                )
+            except (OSError, ValueError):
+                payload = None
+            if payload is not None and not payload.is_expired:
+                self._write_atomic(self._path_for_digest(digest), _pack_entry(None, payload))
+                migrated += 1
+            for path in (payload_path, metadata_path):
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+        for orphan in self.base_dir.glob("*.bin"):
+            if not LEGACY_NAME.fullmatch(orphan.name):
+                continue
+            try:
+                orphan.unlink()
+            except OSError:
+                pass
+        return migrated
+
+    def rekey(self, rename: Callable[[str], Optional[str]]) -> int:
+        """Reubica las entradas cuya clave cambio de esquema; devuelve cuantas se movieron.
+
+        ``rename`` devuelve la clave nueva o ``None`` si la entrada no cambia. Si la
+        clave nueva ya tiene su propia entrada se conserva esa y se descarta la vieja.
+        """
+
+        moved = 0
+        for key in self._stored_keys():
+            new_key = rename(key)
+            if new_key is None or new_key == key:
+                continue
+            payload = self._load(key, allow_stale=True)
+            if self.memory is not None:
+                self.memory.delete(key)
+            self._remove(key)
+            if payload is None or self._path_for_digest(self._hash_key(new_key)).exists():
+                continue
+            self._store(new_key, payload)
+            moved += 1
+        return moved
+
+    def _stored_keys(self) -> List[str]:
+        if self.key_index is not None:
+            return self.key_index.keys()
+        keys = []
+        for path in self.base_dir.glob(f"*/*/*{ENTRY_SUFFIX}"):
+            try:
+                with path.open("rb") as handle:
+                    header = handle.read(ENTRY_HEADER.size)
+                    if len(header) < ENTRY_HEADER.size:
+                        continue
+                    magic, _, meta_len, _ = ENTRY_HEADER.unpack(header)
+                    if magic == ENTRY_MAGIC and (key := json.loads(handle.read(meta_len)).get("key")):
+                        keys.append(key)
+            except (OSError, ValueError):
+                continue
+        return keys
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        stats: Dict[str, Dict[str, int]] = {
+            "disk": {
+                "entries": len(self._index),
+                "bytes": self._total_bytes,
+                "maxBytes": self.max_bytes,
+                "maxEntries": self.max_entries,
+                "evictions": self.evictions,
+            }
         }
-        self._payload_path(key).write_bytes(body)
-        self._metadata_path(key).write_text(json.dumps(metadata), encoding="utf-8")
+        if self.memory is not None:
+            stats["memory"] = self.memory.stats()
+        return stats
 
     def clear(self) -> None:
-        for file in self.base_dir.glob("*"):
+        if self.memory is not None:
+            self.memory.clear()
+        with self._index_lock:
+            self._index.clear()
+            self._total_bytes = 0
+        if self.key_index is not None:
+            self.key_index.clear()
+        if self.blobs is not None:
+            self.blobs.clear()
+        for entry in os.scandir(self.base_dir):
+            if entry.name.startswith(INDEX_FILENAME):
+                continue
             try:
-                file.unlink()
+                if entry.is_dir(follow_symlinks=False):
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                else:
+                    os.unlink(entry.path)
             except OSError:
                 pass
+
+
+async def run_janitor(
+    cache: TileStore,
+    interval_seconds: float,
+    rename: Optional[Callable[[str], Optional[str]]] = None,
+) -> None:
+    """Tarea de fondo que migra e indexa el cache una vez y luego lo mantiene dentro del presupuesto.
+
+    ``rename`` traduce claves de un esquema anterior (ver ``FileCache.rekey``).
+    """
+
+    migrated = await cache.amigrate_legacy_layout()
+    if migrated:
+        LOGGER.info("Migrated %s legacy tile cache entries", migrated)
+    indexed = await cache.arebuild_index()
+    LOGGER.info("Tile cache index ready with %s entries", indexed)
+    if rename is not None:
+        rekeyed = await cache.arekey(rename)
+        if rekeyed:
+            LOGGER.info("Moved %s tile cache entries to their normalized keys", rekeyed)
+    while True:
+        try:
+            evicted = await cache.aevict()
+        except Exception:  # noqa: BLE001 - una pasada fallida no debe detener al janitor
+            LOGGER.exception("Tile cache janitor pass failed; retrying in %ss", interval_seconds)
+        else:
+            if evicted:
+                LOGGER.info("Tile cache janitor evicted %s entries", evicted)
+        await asyncio.sleep(interval_seconds)
+
+
+def _layer_of(key: str) -> str:
+    return key.rsplit(":", 4)[0]
+
+
+def _entry_meta(key: Optional[str], headers: Mapping[str, str], blob: Optional[str] = None, size: int = 0) -> bytes:
+    meta: Dict[str, object] = {"headers": dict(headers)}
+    if key is not None:
+        meta["key"] = key
+    if blob is not None:
+        meta["blob"] = blob
+        meta["size"] = size
+    return json.dumps(meta, separators=(",", ":")).encode("utf-8")
+
+
+def _pack_entry(key: Optional[str], payload: CachedPayload, blob: Optional[str] = None) -> bytes:
+    """Empaqueta la entrada; con ``blob`` el cuerpo no se incluye y la metadata apunta al blob."""
+
+    raw_meta = _entry_meta(key, payload.headers, blob, payload.size)
+    body = b"" if blob is not None else payload.body
+    header = ENTRY_HEADER.pack(ENTRY_MAGIC, payload.expires_at, len(raw_meta), len(body))
+    return b"".join((header, raw_meta, body))
+
+
+def _unpack_entry(raw: bytes) -> Optional[Tuple[CachedPayload, Optional[str]]]:
+    """Devuelve la entrada y el blob al que apunta (``None`` si el cuerpo va en la misma entrada)."""
+
+    if len(raw) < ENTRY_HEADER.size:
+        return None
+    magic, expires_at, meta_len, body_len = ENTRY_HEADER.unpack_from(raw)
+    body_start = ENTRY_HEADER.size + meta_len
+    if magic != ENTRY_MAGIC or len(raw) != body_start + body_len:
+        return None
+    try:
+        meta = json.loads(raw[ENTRY_HEADER.size : body_start])
+    except ValueError:
+        return None
+    payload = CachedPayload(body=raw[body_start:], headers=meta.get("headers", {}), expires_at=expires_at)
+    return payload, meta.get("blob")
@@ -0,0 +1,228 @@
+from __future__ import annotations
+
+from collections import Counter, OrderedDict, defaultdict
+from hashlib import sha256
+from pathlib import Path
+from threading import Lock
+from typing import BinaryIO, Callable, Dict, List, Optional, Set, Tuple
+
+BLOB_DIRNAME = "blobs"
+BLOB_SUFFIX = ".blob"
+# Referencias minimas para que un blob sea candidato a la copia compartida en memoria.
+SHARED_MIN_REFS = 4
+
+
+class BlobStore:
+    """Cuerpos de tiles guardados una sola vez bajo el sha256 de su contenido.
+
+    Cada entrada del cache apunta a un blob; aqui se lleva cuantas entradas usan
+    cada uno y se borra el archivo cuando la ultima deja de apuntarlo. Las
+    referencias viven en memoria y se reconstruyen desde la metadata de las
+    entradas al arrancar; hasta que ese escaneo termina (``ready``) no se borra
+    ningun blob, porque una entrada aun no vista podria usarlo.
+    """
+
+    def __init__(self, base_dir: Path, write: Callable[[Path, bytes], None], shared_max: int = 64) -> None:
+        self.base_dir = base_dir
+        self.shared_max = shared_max
+        self.ready = False
+        self._write = write
+        self._lock = Lock()
+        # digest de entrada -> (capa, digest del blob)
+        self._links: Dict[str, Tuple[str, str]] = {}
+        self._refs: Counter[str] = Counter()
+        self._sizes: Dict[str, int] = {}
+        self._bytes = 0
+        self._shared: "OrderedDict[str, bytes]" = OrderedDict()
+        self._counters: Counter[str] = Counter()
+        self.base_dir.mkdir(parents=True, exist_ok=True)
+
+    @property
+    def total_bytes(self) -> int:
+        return self._bytes
+
+    def path(self, digest: str) -> Path:
+        return self.base_dir / digest[:2] / digest[2:4] / f"{digest}{BLOB_SUFFIX}"
+
+    def store(self, entry_digest: str, layer: str, body: bytes) -> str:
+        """Guarda el cuerpo si aun no existe y lo enlaza a la entrada; devuelve el digest del blob."""
+
+        digest = sha256(body).hexdigest()
+        with self._lock:
+            # La referencia se toma antes de escribir: nadie puede borrar el blob en el medio.
+            doomed = self._link(entry_digest, layer, digest)
+            known = digest in self._sizes
+            if not known:
+                self._sizes[digest] = len(body)
+                self._bytes += len(body)
+        if known or self.path(digest).exists():
+            self._counters["deduplicated"] += 1
+        else:
+            self._write(self.path(digest), body)
+            self._counters["written"] += 1
+        self._delete(doomed)
+        return digest
+
+    def link(self, entry_digest: str, layer: str, digest: str) -> None:
+        """Registra una entrada existente (escaneo al arrancar)."""
+
+        with self._lock:
+            doomed = self._link(entry_digest, layer, digest)
+        self._delete(doomed)
+
+    def release(self, entry_digest: str) -> int:
+        """Suelta el blob de una entrada que se borra o reemplaza; devuelve los bytes liberados."""
+
+        with self._lock:
+            doomed = self._unlink(entry_digest)
+        return self._delete(doomed)
+
+    def read(self, digest: str) -> Optional[bytes]:
+        shared = self._shared.get(digest)
+        if shared is not None:
+            self._counters["sharedHits"] += 1
+            return shared
+        try:
+            body = self.path(digest).read_bytes()
+        except OSError:
+            return None
+        self._maybe_share(digest, body)
+        return body
+
+    def is_shared(self, digest: str) -> bool:
+        return digest in self._shared
+
+    def open(self, digest: str) -> Optional[BinaryIO]:
+        try:
+            return self.path(digest).open("rb")
+        except OSError:
+            return None
+
+    def scan(self) -> int:
+        """Registra el tamano de los blobs en disco y habilita el borrado; devuelve cuantos hay."""
+
+        found = {}
+        for path in self.base_dir.glob(f"*/*/*{BLOB_SUFFIX}"):
+            try:
+                found[path.stem] = path.stat().st_size
+            except OSError:
+                continue
+        with self._lock:
+            for digest, size in found.items():
+                if digest not in self._sizes:
+                    self._sizes[digest] = size
+                    self._bytes += size
+            self.ready = True
+            return len(self._sizes)
+
+    def sweep(self) -> int:
+        """Borra los blobs que ya no usa ninguna entrada; devuelve los bytes liberados."""
+
+        with self._lock:
+            if not self.ready:
+                return 0
+            doomed = [digest for digest in self._sizes if self._refs.get(digest, 0) <= 0]
+        return self._delete(doomed)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._links.clear()
+            self._refs.clear()
+            self._sizes.clear()
+            self._bytes = 0
+            self._shared.clear()
+
+    def stats(self) -> Dict[str, object]:
+        """Ahorro por deduplicacion por capa y de la copia compartida en memoria."""
+
+        with self._lock:
+            links = list(self._links.values())
+            sizes = dict(self._sizes)
+            refs = dict(self._refs)
+            shared = list(self._shared)
+        logical: Counter[str] = Counter()
+        entries: Counter[str] = Counter()
+        blobs: Dict[str, Set[str]] = defaultdict(set)
+        for layer, digest in links:
+            logical[layer] += sizes.get(digest, 0)
+            entries[layer] += 1
+            blobs[layer].add(digest)
+        layers = {}
+        for layer, digests in blobs.items():
+            stored = sum(sizes.get(digest, 0) for digest in digests)
+            layers[layer] = {
+                "entries": entries[layer],
+                "blobs": len(digests),
+                "logicalBytes": logical[layer],
+                "storedBytes": stored,
+                "dedupRatio": round(logical[layer] / stored, 2) if stored else 1.0,
+            }
+        total_logical = sum(logical.values())
+        total_stored = sum(sizes.values())
+        return {
+            "blobs": len(sizes),
+            "logicalBytes": total_logical,
+            "storedBytes": total_stored,
+            "savedBytes": max(0, total_logical - total_stored),
+            "dedupRatio": round(total_logical / total_stored, 2) if total_stored else 1.0,
+            "written": self._counters["written"],
+            "deduplicated": self._counters["deduplicated"],
+            "shared": {
+                "blobs": len(shared),
+                "bytes": sum(sizes.get(digest, 0) for digest in shared),
+                "hits": self._counters["sharedHits"],
+                # Copias que el nivel en memoria hubiera guardado por separado para cada clave.
+                "savedBytes": sum(max(0, refs.get(digest, 0) - 1) * sizes.get(digest, 0) for digest in shared),
+            },
+            "layers": layers,
+        }
+
+    def _link(self, entry_digest: str, layer: str, digest: str) -> List[str]:
+        previous = self._links.get(entry_digest)
+        if previous is not None and previous[1] == digest:
+            return []
+        self._links[entry_digest] = (layer, digest)
+        self._refs[digest] += 1
+        if previous is None:
+            return []
+        return self._drop_ref(previous[1])
+
+    def _unlink(self, entry_digest: str) -> List[str]:
+        previous = self._links.pop(entry_digest, None)
+        if previous is None:
+            return []
+        return self._drop_ref(previous[1])
+
+    def _drop_ref(self, digest: str) -> List[str]:
+        self._refs[digest] -= 1
+        if self._refs[digest] > 0:
+            return []
+        del self._refs[digest]
+        return [digest] if self.ready else []
+
+    def _delete(self, digests: List[str]) -> int:
+        freed = 0
+        for digest in digests:
+            # Bajo el lock: un ``store`` concurrente no puede ver el archivo a punto de borrarse.
+            with self._lock:
+                # Pudo volver a enlazarse entre que se solto la referencia y este borrado.
+                if self._refs.get(digest, 0) > 0:
+                    continue
+                size = self._sizes.pop(digest, 0)
+                self._bytes -= size
+                freed += size
+                self._shared.pop(digest, None)
+                try:
+                    self.path(digest).unlink()
+                except OSError:
+                    pass
+        return freed
+
+    def _maybe_share(self, digest: str, body: bytes) -> None:
+        if self.shared_max <= 0 or self._refs.get(digest, 0) < SHARED_MIN_REFS:
+            return
+        with self._lock:
+            self._shared[digest] = body
+            if len(self._shared) > self.shared_max:
+                # Sale el blob compartido menos referenciado.
+                del self._shared[min(self._shared, key=lambda candidate: self._refs.get(candidate, 0))]
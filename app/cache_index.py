@@ -0,0 +1,218 @@
+from __future__ import annotations
+
+import logging
+import sqlite3
+from dataclasses import dataclass
+from pathlib import Path
+from threading import Lock, Timer
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+LOGGER = logging.getLogger("app.cache")
+
+INDEX_FILENAME = "index.sqlite3"
+
+_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS entries (
+        key TEXT PRIMARY KEY,
+        digest TEXT NOT NULL,
+        layer TEXT NOT NULL,
+        date TEXT NOT NULL,
+        z INTEGER NOT NULL,
+        size INTEGER NOT NULL,
+        expires_at REAL NOT NULL
+    ) WITHOUT ROWID
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_entries_digest ON entries (digest)",
+    "CREATE INDEX IF NOT EXISTS ix_entries_layer_date_z ON entries (layer, date, z)",
+    "CREATE INDEX IF NOT EXISTS ix_entries_layer_z ON entries (layer, z)",
+)
+
+
+def split_cache_key(key: str) -> Tuple[str, str, int, int, int]:
+    """Separa ``layer:date:z:x:y``; el ``layer_key`` puede contener ``:``."""
+
+    layer, date, z, x, y = key.rsplit(":", 4)
+    return layer, date, int(z), int(x), int(y)
+
+
+@dataclass(frozen=True)
+class IndexedEntry:
+    key: str
+    digest: str
+    size: int
+    expires_at: float
+
+
+@dataclass(frozen=True)
+class KeyFilter:
+    layer: str
+    date: Optional[str] = None
+    min_zoom: Optional[int] = None
+    max_zoom: Optional[int] = None
+
+    def where(self) -> Tuple[str, List[object]]:
+        clauses = ["layer = ?"]
+        params: List[object] = [self.layer]
+        if self.date is not None:
+            clauses.append("date = ?")
+            params.append(self.date)
+        if self.min_zoom is not None:
+            clauses.append("z >= ?")
+            params.append(self.min_zoom)
+        if self.max_zoom is not None:
+            clauses.append("z <= ?")
+            params.append(self.max_zoom)
+        return " AND ".join(clauses), params
+
+
+class CacheKeyIndex:
+    """Indice persistente clave -> archivo del cache de tiles.
+
+    Los archivos del cache se nombran por hash, asi que este indice (SQLite en
+    WAL junto al cache) es lo que permite listar y purgar por capa, fecha o zoom
+    tocando solo las filas que coinciden.
+
+    ``put`` y ``touch`` no escriben en el momento: se acumulan y se aplican en una
+    transaccion al llegar a ``batch_size`` o tras ``flush_interval_seconds``. Las
+    lecturas y los borrados aplican antes lo pendiente.
+    """
+
+    def __init__(self, path: Path, batch_size: int = 256, flush_interval_seconds: float = 0.5) -> None:
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval_seconds = flush_interval_seconds
+        # Orden de locks: primero ``_lock`` (la base), despues ``_pending_lock``.
+        self._lock = Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pending_lock = Lock()
+        self._puts: Dict[str, Tuple[str, str, str, str, int, int, float]] = {}
+        self._touches: Dict[str, float] = {}
+        self._timer: Optional[Timer] = None
+
+    def _db(self) -> sqlite3.Connection:
+        # Se abre al primer uso (llamado con el lock tomado): importar la app no crea archivos.
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            for statement in _SCHEMA:
+                conn.execute(statement)
+            self._conn = conn
+        return self._conn
+
+    def put(self, key: str, digest: str, size: int, expires_at: float) -> None:
+        try:
+            layer, date, z, _, _ = split_cache_key(key)
+        except ValueError:
+            return
+        with self._pending_lock:
+            self._puts[key] = (key, digest, layer, date, z, size, expires_at)
+            # Una renovacion anterior a esta escritura ya no aplica.
+            self._touches.pop(digest, None)
+            full = self._queued()
+        if full:
+            self.flush()
+
+    def touch(self, digest: str, expires_at: float) -> None:
+        with self._pending_lock:
+            self._touches[digest] = expires_at
+            full = self._queued()
+        if full:
+            self.flush()
+
+    def flush(self) -> int:
+        """Aplica las escrituras pendientes en una sola transaccion; devuelve cuantas eran."""
+
+        with self._lock:
+            return self._flush_locked()
+
+    def close(self) -> None:
+        self.flush()
+
+    def discard(self, digests: Iterable[str]) -> None:
+        with self._lock:
+            self._flush_locked()
+            self._db().executemany("DELETE FROM entries WHERE digest = ?", ((digest,) for digest in digests))
+
+    def digests(self) -> Set[str]:
+        with self._lock:
+            self._flush_locked()
+            return {row[0] for row in self._db().execute("SELECT digest FROM entries")}
+
+    def keys(self) -> List[str]:
+        with self._lock:
+            self._flush_locked()
+            return [row[0] for row in self._db().execute("SELECT key FROM entries")]
+
+    def find(self, key_filter: KeyFilter, limit: Optional[int] = None) -> List[IndexedEntry]:
+        where, params = key_filter.where()
+        sql = f"SELECT key, digest, size, expires_at FROM entries WHERE {where} ORDER BY key"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            self._flush_locked()
+            rows = self._db().execute(sql, params).fetchall()
+        return [IndexedEntry(*row) for row in rows]
+
+    def layer_totals(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            self._flush_locked()
+            rows = self._db().execute(
+                "SELECT layer, COUNT(*), COALESCE(SUM(size), 0) FROM entries GROUP BY layer"
+            ).fetchall()
+        return {layer: {"entries": entries, "bytes": size} for layer, entries, size in rows}
+
+    def clear(self) -> None:
+        with self._lock:
+            with self._pending_lock:
+                self._puts.clear()
+                self._touches.clear()
+            self._db().execute("DELETE FROM entries")
+
+    def _queued(self) -> bool:
+        """Con ``_pending_lock`` tomado: ``True`` si el lote esta lleno; si no, agenda el volcado."""
+
+        if len(self._puts) + len(self._touches) >= self.batch_size:
+            return True
+        if self._timer is None:
+            self._timer = Timer(self.flush_interval_seconds, self._flush_later)
+            self._timer.daemon = True
+            self._timer.start()
+        return False
+
+    def _flush_later(self) -> None:
+        try:
+            self.flush()
+        except sqlite3.Error:
+            LOGGER.exception("Failed to flush the cache key index")
+
+    def _flush_locked(self) -> int:
+        with self._pending_lock:
+            puts, self._puts = self._puts, {}
+            touches, self._touches = self._touches, {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not puts and not touches:
+            return 0
+        conn = self._db()
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(
+                "INSERT OR REPLACE INTO entries (key, digest, layer, date, z, size, expires_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                puts.values(),
+            )
+            conn.executemany(
+                "UPDATE entries SET expires_at = ? WHERE digest = ?",
+                ((expires_at, digest) for digest, expires_at in touches.items()),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return len(puts) + len(touches)
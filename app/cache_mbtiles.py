@@ -0,0 +1,848 @@
+"""Backend del cache de tiles sobre SQLite con esquema MBTiles.
+
+Cada capa y fecha vive en su propia base ``<capa>/<fecha>.mbtiles`` bajo el
+directorio del cache. Las tablas ``metadata`` y ``tiles`` siguen la especificacion
+MBTiles 1.3 (filas en orden TMS), por lo que cada archivo sirve tal cual como
+paquete offline para visores que leen MBTiles. La vigencia y los encabezados que
+necesita el proxy van en una tabla aparte, ``tile_cache``.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import queue
+import sqlite3
+import time
+from collections import Counter, OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from threading import Lock
+from typing import Any, Callable, Dict, Iterator, List, Mapping, Optional, Sequence, Tuple, TypeVar
+from urllib.parse import quote, unquote
+
+from app.cache import CachedFile, CachedHead, CachedPayload, MemoryCache
+from app.cache_index import IndexedEntry, KeyFilter, split_cache_key
+
+T = TypeVar("T")
+
+LOGGER = logging.getLogger("app.cache")
+
+MBTILES_SUFFIX = ".mbtiles"
+# Bases abiertas a la vez; las menos usadas se cierran al superar el limite.
+MAX_OPEN_DATABASES = 64
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS metadata (name TEXT NOT NULL, value TEXT)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS name ON metadata (name)",
+    """
+    CREATE TABLE IF NOT EXISTS tiles (
+        zoom_level INTEGER NOT NULL,
+        tile_column INTEGER NOT NULL,
+        tile_row INTEGER NOT NULL,
+        tile_data BLOB NOT NULL
+    )
+    """,
+    "CREATE UNIQUE INDEX IF NOT EXISTS tile_index ON tiles (zoom_level, tile_column, tile_row)",
+)
+
+_CACHE_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS tile_cache (
+        zoom_level INTEGER NOT NULL,
+        tile_column INTEGER NOT NULL,
+        tile_row INTEGER NOT NULL,
+        headers TEXT NOT NULL,
+        expires_at REAL NOT NULL,
+        PRIMARY KEY (zoom_level, tile_column, tile_row)
+    ) WITHOUT ROWID
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_tile_cache_expires ON tile_cache (expires_at)",
+)
+
+_SELECT_ENTRY = (
+    "SELECT c.headers, c.expires_at, t.tile_data FROM tile_cache c LEFT JOIN tiles t "
+    "ON t.zoom_level = c.zoom_level AND t.tile_column = c.tile_column AND t.tile_row = c.tile_row "
+    "WHERE c.zoom_level = ? AND c.tile_column = ? AND c.tile_row = ?"
+)
+_SELECT_HEAD = _SELECT_ENTRY.replace("t.tile_data", "length(t.tile_data)", 1)
+_SELECT_SIZE = _SELECT_ENTRY.replace("c.headers, c.expires_at, t.tile_data", "COALESCE(length(t.tile_data), 0)", 1)
+
+_FORMATS = {"image/png": "png", "image/jpeg": "jpg", "image/jpg": "jpg", "image/webp": "webp"}
+
+TileAddress = Tuple[str, str, int, int, int]
+
+
+def tms_row(z: int, y: int) -> int:
+    """Fila MBTiles (origen abajo) para la fila XYZ/WMTS ``y`` (origen arriba)."""
+
+    return (1 << z) - 1 - y
+
+
+def image_format(content_type: Optional[str]) -> Optional[str]:
+    if not content_type:
+        return None
+    return _FORMATS.get(content_type.split(";", 1)[0].strip().lower())
+
+
+def connect_mbtiles(path: Path, cache_tables: bool = True) -> sqlite3.Connection:
+    """Abre (o crea) una base MBTiles en WAL; ``cache_tables`` agrega la tabla de vigencia del cache."""
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None, timeout=5)
+    # Debe fijarse antes de crear tablas para que los DELETE devuelvan espacio al disco.
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    for statement in _SCHEMA + (_CACHE_SCHEMA if cache_tables else ()):
+        conn.execute(statement)
+    return conn
+
+
+class TileDatabase:
+    """Una base MBTiles con un escritor serializado y un pool de conexiones de lectura."""
+
+    def __init__(self, path: Path, name: str, readers: int = 4) -> None:
+        self.path = path
+        self.name = name
+        self.max_readers = readers
+        self.last_used = time.time()
+        self.closed = False
+        self._readers: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._write_lock = Lock()
+        self._writer: Optional[sqlite3.Connection] = connect_mbtiles(path)
+        self._writer.execute(
+            "INSERT OR IGNORE INTO metadata (name, value) VALUES ('name', ?), ('type', 'baselayer'), ('version', '1.0')",
+            (name,),
+        )
+
+    @contextmanager
+    def reader(self) -> Iterator[sqlite3.Connection]:
+        self.last_used = time.time()
+        try:
+            conn = self._readers.get_nowait()
+        except queue.Empty:
+            conn = connect_mbtiles(self.path)
+        try:
+            yield conn
+        finally:
+            if self.closed or self._readers.qsize() >= self.max_readers:
+                conn.close()
+            else:
+                self._readers.put(conn)
+
+    @contextmanager
+    def writer(self) -> Iterator[sqlite3.Connection]:
+        """Conexion de escritura dentro de una transaccion; una sola a la vez por base."""
+
+        self.last_used = time.time()
+        with self._write_lock:
+            if self._writer is None:
+                # Base cerrada por el LRU mientras alguien la usaba: se reabre para esta escritura.
+                self._writer = connect_mbtiles(self.path)
+            conn = self._writer
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def close(self) -> None:
+        self.closed = True
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class BufferedEntryWriter:
+    """Escritura por partes en memoria; la base solo recibe el tile completo al ``commit``."""
+
+    def __init__(self, key: str) -> None:
+        self.key = key
+        self._chunks: List[bytes] = []
+
+    def write(self, chunk: bytes) -> None:
+        self._chunks.append(chunk)
+
+    def body(self) -> bytes:
+        return b"".join(self._chunks)
+
+    def abort(self) -> None:
+        self._chunks.clear()
+
+
+class MBTilesCache:
+    """Cache de tiles en bases SQLite/MBTiles, una por capa y fecha.
+
+    Las escrituras se acumulan y se vuelcan en lotes de ``batch_size`` o cada
+    ``flush_interval_seconds``, en una transaccion por base; mientras tanto las
+    lecturas las ven desde el buffer. Como ``FileCache``, puede tener un
+    ``MemoryCache`` delante y ejecuta el acceso a disco en un pool de hilos.
+    """
+
+    def __init__(
+        self,
+        base_dir: Path,
+        ttl_seconds: int,
+        memory: Optional[MemoryCache] = None,
+        io_workers: int = 4,
+        max_bytes: int = 0,
+        stale_retention_seconds: float = 0,
+        batch_size: int = 64,
+        flush_interval_seconds: float = 0.5,
+        readers: int = 4,
+    ) -> None:
+        self.base_dir = base_dir
+        self.ttl_seconds = ttl_seconds
+        self.memory = memory
+        self.io_workers = io_workers
+        self.max_bytes = max_bytes
+        self.stale_retention_seconds = stale_retention_seconds
+        self.batch_size = batch_size
+        self.flush_interval_seconds = flush_interval_seconds
+        self.readers = readers
+        self.evictions = 0
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._databases: "OrderedDict[Path, TileDatabase]" = OrderedDict()
+        self._databases_lock = Lock()
+        self._pending: "OrderedDict[str, CachedPayload]" = OrderedDict()
+        self._pending_lock = Lock()
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._flushes: set = set()
+        self._layer_counters: Dict[str, Counter[str]] = defaultdict(Counter)
+        # Entradas y bytes de tiles: se recorren las bases al arrancar y luego se ajustan en cada escritura o borrado.
+        self._entries = 0
+        self._bytes = 0
+        self._totals_lock = Lock()
+        self.base_dir.mkdir(parents=True, exist_ok=True)
+
+    def path_for(self, layer: str, date: str) -> Path:
+        return self.base_dir / quote(layer, safe="") / f"{date}{MBTILES_SUFFIX}"
+
+    # Lectura
+
+    def hot(self, key: str) -> Optional[CachedPayload]:
+        hot = self._hot(key)
+        return self._record(key, hot) if hot is not None else None
+
+    def get(self, key: str, allow_stale: bool = False) -> Optional[CachedPayload]:
+        hot = self._hot(key)
+        if hot is not None:
+            return self._record(key, hot)
+        return self._record(key, self._load(key, allow_stale))
+
+    async def aget(self, key: str, allow_stale: bool = False) -> Optional[CachedPayload]:
+        hot = self._hot(key)
+        if hot is not None:
+            return self._record(key, hot)
+        return self._record(key, await self._run_io(self._load, key, allow_stale))
+
+    def head(self, key: str) -> Optional[CachedHead]:
+        """Encabezados y vigencia de una entrada vigente; de la base solo se lee el largo del blob."""
+
+        hot = self._hot_head(key)
+        return hot if hot is not None else self._load_head(key)
+
+    async def ahead(self, key: str) -> Optional[CachedHead]:
+        hot = self._hot_head(key)
+        return hot if hot is not None else await self._run_io(self._load_head, key)
+
+    async def aopen(self, key: str) -> Optional[CachedFile]:
+        # Los tiles viven dentro de la base: no hay rango de archivo para envio zero-copy.
+        return None
+
+    def _hot(self, key: str) -> Optional[CachedPayload]:
+        if self.memory is not None:
+            hot = self.memory.get(key)
+            if hot is not None:
+                return hot
+        with self._pending_lock:
+            pending = self._pending.get(key)
+        if pending is not None and not pending.is_expired:
+            return pending
+        return None
+
+    def _hot_head(self, key: str) -> Optional[CachedHead]:
+        hot = self._hot(key)
+        if hot is None:
+            return None
+        return CachedHead(headers=hot.headers, expires_at=hot.expires_at, size=hot.size)
+
+    def _load_head(self, key: str) -> Optional[CachedHead]:
+        with self._pending_lock:
+            pending = self._pending.get(key)
+        if pending is not None:
+            head = CachedHead(headers=pending.headers, expires_at=pending.expires_at, size=pending.size)
+        else:
+            row = self._query(key, _SELECT_HEAD)
+            if row is None:
+                return None
+            headers, expires_at, size = row
+            head = CachedHead(headers=json.loads(headers), expires_at=expires_at, size=size or 0)
+        return None if head.is_expired else head
+
+    def _load(self, key: str, allow_stale: bool = False) -> Optional[CachedPayload]:
+        with self._pending_lock:
+            cached = self._pending.get(key)
+        if cached is None:
+            cached = self._select(key)
+        if cached is None or (cached.is_expired and not allow_stale):
+            return None
+        if not cached.is_expired and self.memory is not None:
+            self.memory.set(key, cached)
+        return cached
+
+    def _select(self, key: str) -> Optional[CachedPayload]:
+        row = self._query(key, _SELECT_ENTRY)
+        if row is None:
+            return None
+        headers, expires_at, data = row
+        return CachedPayload(body=bytes(data or b""), headers=json.loads(headers), expires_at=expires_at)
+
+    def _query(self, key: str, sql: str) -> Optional[Tuple[Any, ...]]:
+        address = _address(key)
+        if address is None:
+            return None
+        layer, date, z, x, y = address
+        database = self._database(layer, date, create=False)
+        if database is None:
+            return None
+        try:
+            with database.reader() as conn:
+                return conn.execute(sql, (z, x, tms_row(z, y))).fetchone()
+        except sqlite3.Error:
+            LOGGER.exception("Failed to read %s from %s", key, database.path)
+            return None
+
+    def _record(self, key: str, cached: Optional[CachedPayload]) -> Optional[CachedPayload]:
+        counters = self._layer_counters[key.rsplit(":", 4)[0]]
+        if cached is not None and not cached.is_expired:
+            counters["hits"] += 1
+            counters["hitBytes"] += cached.size
+        else:
+            counters["misses"] += 1
+        return cached
+
+    # Escritura
+
+    def set(self, key: str, body: bytes, headers: Mapping[str, str], ttl_seconds: Optional[float] = None) -> None:
+        self._store(key, self._remember(key, body, headers, ttl_seconds))
+
+    async def aset(
+        self,
+        key: str,
+        body: bytes,
+        headers: Mapping[str, str],
+        ttl_seconds: Optional[float] = None,
+    ) -> None:
+        await self._run_io(self._store, key, self._remember(key, body, headers, ttl_seconds))
+        self._schedule_flush()
+
+    async def aopen_writer(self, key: str, headers: Mapping[str, str]) -> BufferedEntryWriter:
+        return BufferedEntryWriter(key)
+
+    async def awrite(self, writer: BufferedEntryWriter, chunk: bytes) -> None:
+        writer.write(chunk)
+
+    async def acommit(
+        self,
+        writer: BufferedEntryWriter,
+        headers: Mapping[str, str],
+        body: Optional[bytes] = None,
+        ttl_seconds: Optional[float] = None,
+    ) -> None:
+        await self.aset(writer.key, writer.body() if body is None else body, headers, ttl_seconds)
+
+    async def aabort(self, writer: BufferedEntryWriter) -> None:
+        writer.abort()
+
+    def refresh(self, key: str, cached: Optional[CachedPayload] = None, ttl_seconds: Optional[float] = None) -> bool:
+        """Extiende la vigencia sin reescribir el tile (revalidacion con 304)."""
+
+        expires_at = time.time() + (self.ttl_seconds if ttl_seconds is None else ttl_seconds)
+        with self._pending_lock:
+            pending = self._pending.get(key)
+            if pending is not None:
+                pending.expires_at = expires_at
+        refreshed = pending is not None
+        address = _address(key)
+        database = self._database(address[0], address[1], create=False) if address is not None else None
+        if database is not None:
+            layer, date, z, x, y = address
+            with database.writer() as conn:
+                updated = conn.execute(
+                    "UPDATE tile_cache SET expires_at = ? WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+                    (expires_at, z, x, tms_row(z, y)),
+                ).rowcount
+            refreshed = refreshed or updated > 0
+        if refreshed and self.memory is not None and cached is not None:
+            self.memory.set(key, CachedPayload(body=cached.body, headers=cached.headers, expires_at=expires_at))
+        return refreshed
+
+    async def arefresh(
+        self,
+        key: str,
+        cached: Optional[CachedPayload] = None,
+        ttl_seconds: Optional[float] = None,
+    ) -> bool:
+        return await self._run_io(self.refresh, key, cached, ttl_seconds)
+
+    def delete(self, key: str) -> None:
+        if self.memory is not None:
+            self.memory.delete(key)
+        with self._pending_lock:
+            self._pending.pop(key, None)
+        address = _address(key)
+        if address is None:
+            return
+        layer, date, z, x, y = address
+        database = self._database(layer, date, create=False)
+        if database is not None:
+            with database.writer() as conn:
+                self._adjust(*_delete_tile(conn, z, x, tms_row(z, y)))
+
+    async def adelete(self, key: str) -> None:
+        await self._run_io(self.delete, key)
+
+    def _remember(
+        self,
+        key: str,
+        body: bytes,
+        headers: Mapping[str, str],
+        ttl_seconds: Optional[float] = None,
+    ) -> CachedPayload:
+        payload = CachedPayload(
+            body=body,
+            headers=dict(headers),
+            expires_at=time.time() + (self.ttl_seconds if ttl_seconds is None else ttl_seconds),
+        )
+        if self.memory is not None:
+            self.memory.set(key, payload)
+        return payload
+
+    def _store(self, key: str, payload: CachedPayload) -> None:
+        with self._pending_lock:
+            self._pending[key] = payload
+            self._pending.move_to_end(key)
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self.flush()
+
+    def flush(self) -> int:
+        """Vuelca las escrituras pendientes, una transaccion por base; devuelve cuantas se escribieron."""
+
+        with self._pending_lock:
+            pending, self._pending = self._pending, OrderedDict()
+        grouped: Dict[Tuple[str, str], List[Tuple[int, int, int, CachedPayload]]] = defaultdict(list)
+        for key, payload in pending.items():
+            address = _address(key)
+            if address is not None:
+                layer, date, z, x, y = address
+                grouped[(layer, date)].append((z, x, y, payload))
+        for (layer, date), rows in grouped.items():
+            database = self._database(layer, date, create=True)
+            try:
+                with database.writer() as conn:
+                    self._adjust(*_write_tiles(conn, rows))
+            except sqlite3.Error:
+                LOGGER.exception("Failed to write %s tiles to %s", len(rows), database.path)
+        return len(pending)
+
+    async def aflush(self) -> int:
+        return await self._run_io(self.flush)
+
+    def _schedule_flush(self) -> None:
+        if self._flush_handle is not None or not self._pending:
+            return
+        loop = asyncio.get_running_loop()
+        self._flush_handle = loop.call_later(self.flush_interval_seconds, self._flush_later)
+
+    def _flush_later(self) -> None:
+        self._flush_handle = None
+        task = asyncio.ensure_future(self.aflush())
+        # Se guarda la referencia para que la tarea no se recolecte antes de terminar.
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    # Bases
+
+    def _database(self, layer: str, date: str, create: bool) -> Optional[TileDatabase]:
+        path = self.path_for(layer, date)
+        evicted = []
+        with self._databases_lock:
+            database = self._databases.get(path)
+            if database is not None:
+                self._databases.move_to_end(path)
+                return database
+            if not create and not path.exists():
+                return None
+            database = TileDatabase(path, layer, self.readers)
+            self._databases[path] = database
+            while len(self._databases) > MAX_OPEN_DATABASES:
+                evicted.append(self._databases.popitem(last=False)[1])
+        for stale in evicted:
+            stale.close()
+        return database
+
+    def _database_files(self, layer: Optional[str] = None) -> Iterator[Tuple[str, str, Path]]:
+        directories = [self.base_dir / quote(layer, safe="")] if layer is not None else self.base_dir.iterdir()
+        for directory in directories:
+            if not directory.is_dir():
+                continue
+            for path in directory.glob(f"*{MBTILES_SUFFIX}"):
+                yield unquote(directory.name), path.name[: -len(MBTILES_SUFFIX)], path
+
+    def _forget_database(self, layer: str, date: str, path: Path) -> Tuple[int, int]:
+        """Borra una base completa; devuelve (entradas, bytes en disco) liberados."""
+
+        entries, size = self._count(layer, date)
+        with self._databases_lock:
+            database = self._databases.pop(path, None)
+        if database is not None:
+            database.close()
+        freed = 0
+        for suffix in ("", "-wal", "-shm"):
+            file = Path(f"{path}{suffix}")
+            try:
+                freed += file.stat().st_size
+                file.unlink()
+            except OSError:
+                pass
+        self._adjust(-entries, -size)
+        return entries, freed
+
+    # Mantenimiento
+
+    def entries(self, key_filter: KeyFilter, limit: Optional[int] = None) -> List[IndexedEntry]:
+        self.flush()
+        found: List[IndexedEntry] = []
+        for layer, date, path in sorted(self._database_files(key_filter.layer)):
+            if key_filter.date is not None and date != key_filter.date:
+                continue
+            database = self._database(layer, date, create=False)
+            if database is None:
+                continue
+            where, params = _zoom_clause(key_filter)
+            with database.reader() as conn:
+                rows = conn.execute(
+                    "SELECT c.zoom_level, c.tile_column, c.tile_row, c.expires_at, COALESCE(length(t.tile_data), 0) "
+                    "FROM tile_cache c LEFT JOIN tiles t ON t.zoom_level = c.zoom_level "
+                    "AND t.tile_column = c.tile_column AND t.tile_row = c.tile_row "
+                    f"WHERE {where} ORDER BY c.zoom_level, c.tile_column, c.tile_row",
+                    params,
+                ).fetchall()
+            for z, x, row, expires_at, size in rows:
+                key = f"{layer}:{date}:{z}:{x}:{tms_row(z, row)}"
+                found.append(IndexedEntry(key=key, digest=path.name, size=size, expires_at=expires_at))
+                if limit is not None and len(found) >= limit:
+                    return found
+        return found
+
+    async def aentries(self, key_filter: KeyFilter, limit: Optional[int] = None) -> List[IndexedEntry]:
+        return await self._run_io(self.entries, key_filter, limit)
+
+    def purge(self, key_filter: KeyFilter) -> Tuple[int, int]:
+        """Elimina las entradas que coinciden; devuelve (entradas, bytes)."""
+
+        matched = self.entries(key_filter)
+        by_database: Dict[Tuple[str, str], List[Tuple[int, int, int]]] = defaultdict(list)
+        for entry in matched:
+            if self.memory is not None:
+                self.memory.delete(entry.key)
+            layer, date, z, x, y = split_cache_key(entry.key)
+            by_database[(layer, date)].append((z, x, tms_row(z, y)))
+        for (layer, date), tiles in by_database.items():
+            database = self._database(layer, date, create=False)
+            if database is None:
+                continue
+            with database.writer() as conn:
+                for z, x, row in tiles:
+                    self._adjust(*_delete_tile(conn, z, x, row))
+                conn.execute("PRAGMA incremental_vacuum")
+        return len(matched), sum(entry.size for entry in matched)
+
+    async def apurge(self, key_filter: KeyFilter) -> Tuple[int, int]:
+        return await self._run_io(self.purge, key_filter)
+
+    def layer_stats(self) -> Dict[str, Dict[str, int]]:
+        self.flush()
+        totals: Dict[str, Dict[str, int]] = defaultdict(lambda: {"entries": 0, "bytes": 0})
+        for layer, date, _ in self._database_files():
+            entries, size = self._count(layer, date)
+            totals[layer]["entries"] += entries
+            totals[layer]["bytes"] += size
+        layers: Dict[str, Dict[str, int]] = {}
+        for layer in set(totals) | set(self._layer_counters):
+            counters = self._layer_counters.get(layer, Counter())
+            layers[layer] = {
+                "hits": counters["hits"],
+                "misses": counters["misses"],
+                "hitBytes": counters["hitBytes"],
+                **totals.get(layer, {"entries": 0, "bytes": 0}),
+            }
+        return layers
+
+    async def alayer_stats(self) -> Dict[str, Dict[str, int]]:
+        return await self._run_io(self.layer_stats)
+
+    async def adedup_stats(self) -> Optional[Dict[str, object]]:
+        return None
+
+    def rebuild_index(self) -> int:
+        """Recorre todas las bases para recalcular entradas y bytes; solo al arrancar."""
+
+        self.flush()
+        entries = size = 0
+        for layer, date, _ in self._database_files():
+            counted, counted_size = self._count(layer, date)
+            entries += counted
+            size += counted_size
+        with self._totals_lock:
+            self._entries = entries
+            self._bytes = size
+        return entries
+
+    async def arebuild_index(self) -> int:
+        return await self._run_io(self.rebuild_index)
+
+    async def amigrate_legacy_layout(self) -> int:
+        return 0
+
+    def rekey(self, rename: Callable[[str], Optional[str]]) -> int:
+        """Mueve las filas de bases cuya capa/fecha cambio de esquema; devuelve cuantas se movieron.
+
+        ``rename`` se prueba con una clave de cada base: si la capa o la fecha cambian,
+        todas sus filas pasan a la base nueva sin pisar las que ya existian alli.
+        """
+
+        self.flush()
+        moved = 0
+        for layer, date, path in list(self._database_files()):
+            probe = rename(f"{layer}:{date}:0:0:0")
+            target = _address(probe) if probe is not None else None
+            if target is None or target[:2] == (layer, date):
+                continue
+            source = self._database(layer, date, create=False)
+            destination = self._database(target[0], target[1], create=True)
+            if source is None or destination is None:
+                continue
+            with source.reader() as reader, destination.writer() as writer:
+                rows = reader.execute(
+                    "SELECT c.zoom_level, c.tile_column, c.tile_row, c.headers, c.expires_at, t.tile_data "
+                    "FROM tile_cache c LEFT JOIN tiles t ON t.zoom_level = c.zoom_level "
+                    "AND t.tile_column = c.tile_column AND t.tile_row = c.tile_row"
+                )
+                for z, x, row, headers, expires_at, data in rows:
+                    inserted = writer.execute(
+                        "INSERT OR IGNORE INTO tile_cache (zoom_level, tile_column, tile_row, headers, expires_at) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (z, x, row, headers, expires_at),
+                    ).rowcount
+                    if inserted and data:
+                        writer.execute(
+                            "INSERT OR REPLACE INTO tiles (zoom_level, tile_column, tile_row, tile_data) VALUES (?, ?, ?, ?)",
+                            (z, x, row, data),
+                        )
+                    if inserted:
+                        self._adjust(1, len(data or b""))
+                    moved += inserted
+            self._forget_database(layer, date, path)
+        return moved
+
+    async def arekey(self, rename: Callable[[str], Optional[str]]) -> int:
+        return await self._run_io(self.rekey, rename)
+
+    def evict(self) -> int:
+        """Retira las entradas vencidas hace mas de ``stale_retention_seconds``.
+
+        Si aun se excede ``max_bytes`` se eliminan bases completas, empezando por
+        las usadas hace mas tiempo (un paquete por capa y fecha).
+        """
+
+        self.flush()
+        cutoff = time.time() - self.stale_retention_seconds
+        removed = 0
+        for layer, date, _ in list(self._database_files()):
+            database = self._database(layer, date, create=False)
+            if database is None:
+                continue
+            with database.writer() as conn:
+                expired, size = conn.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(length(t.tile_data)), 0) FROM tile_cache c LEFT JOIN tiles t "
+                    "ON t.zoom_level = c.zoom_level AND t.tile_column = c.tile_column AND t.tile_row = c.tile_row "
+                    "WHERE c.expires_at < ?",
+                    (cutoff,),
+                ).fetchone()
+                if not expired:
+                    continue
+                conn.execute(
+                    "DELETE FROM tiles WHERE (zoom_level, tile_column, tile_row) IN "
+                    "(SELECT zoom_level, tile_column, tile_row FROM tile_cache WHERE expires_at < ?)",
+                    (cutoff,),
+                )
+                conn.execute("DELETE FROM tile_cache WHERE expires_at < ?", (cutoff,))
+                conn.execute("PRAGMA incremental_vacuum")
+            self._adjust(-expired, -size)
+            removed += expired
+        if self.max_bytes:
+            # Se mide el disco una vez por pasada y se descuenta lo que libera cada base borrada.
+            disk = self._disk_bytes()
+            if disk > self.max_bytes:
+                by_age = sorted(self._database_files(), key=lambda item: self._last_used(item[2]))
+                for layer, date, path in by_age:
+                    if disk <= self.max_bytes:
+                        break
+                    entries, freed = self._forget_database(layer, date, path)
+                    removed += entries
+                    disk -= freed
+        self.evictions += removed
+        return removed
+
+    async def aevict(self) -> int:
+        return await self._run_io(self.evict)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        stats: Dict[str, Dict[str, int]] = {
+            "disk": {
+                "entries": self._entries,
+                "bytes": self._bytes,
+                "maxBytes": self.max_bytes,
+                "databases": len(self._databases),
+                "pendingWrites": len(self._pending),
+                "evictions": self.evictions,
+            }
+        }
+        if self.memory is not None:
+            stats["memory"] = self.memory.stats()
+        return stats
+
+    def close(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        self.flush()
+        with self._databases_lock:
+            databases = list(self._databases.values())
+            self._databases.clear()
+        for database in databases:
+            database.close()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def _count(self, layer: str, date: str) -> Tuple[int, int]:
+        database = self._database(layer, date, create=False)
+        if database is None:
+            return 0, 0
+        with database.reader() as conn:
+            entries = conn.execute("SELECT COUNT(*) FROM tile_cache").fetchone()[0]
+            size = conn.execute("SELECT COALESCE(SUM(length(tile_data)), 0) FROM tiles").fetchone()[0]
+        return entries, size
+
+    def _adjust(self, entries: int, size: int) -> None:
+        with self._totals_lock:
+            self._entries += entries
+            self._bytes += size
+
+    def _disk_bytes(self) -> int:
+        total = 0
+        for _, _, path in self._database_files():
+            for suffix in ("", "-wal"):
+                try:
+                    total += Path(f"{path}{suffix}").stat().st_size
+                except OSError:
+                    pass
+        return total
+
+    def _last_used(self, path: Path) -> float:
+        database = self._databases.get(path)
+        if database is not None:
+            return database.last_used
+        try:
+            return path.stat().st_mtime
+        except OSError:
+            return 0.0
+
+    async def _run_io(self, func: Callable[..., T], *args: object) -> T:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.io_workers,
+                thread_name_prefix="tile-cache-io",
+            )
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+
+def write_tiles(conn: sqlite3.Connection, rows: Sequence[Tuple[int, int, int, bytes]]) -> None:
+    """Inserta tiles ``(z, x, y, data)`` en la tabla MBTiles, con la fila convertida a TMS."""
+
+    conn.executemany(
+        "INSERT OR REPLACE INTO tiles (zoom_level, tile_column, tile_row, tile_data) VALUES (?, ?, ?, ?)",
+        [(z, x, tms_row(z, y), data) for z, x, y, data in rows],
+    )
+
+
+def _write_tiles(conn: sqlite3.Connection, rows: Sequence[Tuple[int, int, int, CachedPayload]]) -> Tuple[int, int]:
+    """Escribe entradas del cache; devuelve la variacion de (entradas, bytes) de la base."""
+
+    entries = size = 0
+    for z, x, y, payload in rows:
+        previous = conn.execute(_SELECT_SIZE, (z, x, tms_row(z, y))).fetchone()
+        entries += previous is None
+        size += len(payload.body) - (previous[0] if previous is not None else 0)
+    write_tiles(conn, [(z, x, y, payload.body) for z, x, y, payload in rows if payload.body])
+    # Las entradas negativas (sin cuerpo) no dejan un tile vacio en el paquete offline.
+    conn.executemany(
+        "DELETE FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+        [(z, x, tms_row(z, y)) for z, x, y, payload in rows if not payload.body],
+    )
+    conn.executemany(
+        "INSERT OR REPLACE INTO tile_cache (zoom_level, tile_column, tile_row, headers, expires_at) VALUES (?, ?, ?, ?, ?)",
+        [
+            (z, x, tms_row(z, y), json.dumps(dict(payload.headers), separators=(",", ":")), payload.expires_at)
+            for z, x, y, payload in rows
+        ],
+    )
+    for _, _, _, payload in rows:
+        if payload.body and (fmt := image_format(payload.headers.get("Content-Type"))):
+            conn.execute("INSERT OR IGNORE INTO metadata (name, value) VALUES ('format', ?)", (fmt,))
+            break
+    return entries, size
+
+
+def _delete_tile(conn: sqlite3.Connection, z: int, x: int, row: int) -> Tuple[int, int]:
+    previous = conn.execute(_SELECT_SIZE, (z, x, row)).fetchone()
+    if previous is None:
+        return 0, 0
+    conn.execute("DELETE FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?", (z, x, row))
+    conn.execute("DELETE FROM tile_cache WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?", (z, x, row))
+    return -1, -previous[0]
+
+
+def _zoom_clause(key_filter: KeyFilter) -> Tuple[str, List[object]]:
+    clauses = ["1 = 1"]
+    params: List[object] = []
+    if key_filter.min_zoom is not None:
+        clauses.append("c.zoom_level >= ?")
+        params.append(key_filter.min_zoom)
+    if key_filter.max_zoom is not None:
+        clauses.append("c.zoom_level <= ?")
+        params.append(key_filter.max_zoom)
+    return " AND ".join(clauses), params
+
+
+def _address(key: str) -> Optional[TileAddress]:
+    try:
+        return split_cache_key(key)
+    except ValueError:
+        return None
@@ -2,7 +2,7 @@ from __future__ import annotations
 
 from functools import lru_cache
 from pathlib import Path
-from typing import List
+from typing import List, Literal
 from urllib.parse import quote_plus
 
 from pydantic import AnyUrl, Field
@@ -56,6 +56,108 @@ class Settings(BaseSettings):
         default="https://trek.nasa.gov/tiles",
         description="Base URL for NASA Solar System Treks WMTS REST endpoint.",
     )
+    nasa_gibs_mirror_urls: List[AnyUrl] = Field(
+        default_factory=list,
+        description="Additional base URLs serving the same GIBS WMTS tree; requests go to the fastest healthy one.",
+    )
+    nasa_treks_mirror_urls: List[AnyUrl] = Field(
+        default_factory=list,
+        description="Additional base URLs serving the same Treks tile tree.",
+    )
+    nasa_endpoint_eject_after_failures: int = Field(
+        default=3,
+        ge=1,
+        description="Consecutive failures after which a mirror is taken out of rotation.",
+    )
+    nasa_endpoint_ejection_seconds: float = Field(
+        default=30.0,
+        ge=0,
+        description="Seconds an ejected mirror stays out of rotation.",
+    )
+    nasa_gibs_max_connections: int = Field(
+        default=100,
+        ge=1,
+        description="Maximum concurrent connections to the GIBS host.",
+    )
+    nasa_gibs_max_keepalive_connections: int = Field(
+        default=20,
+        ge=0,
+        description="Idle keep-alive connections kept open to the GIBS host.",
+    )
+    nasa_gibs_keepalive_expiry_seconds: float = Field(
+        default=5.0,
+        ge=0,
+        description="Seconds an idle GIBS connection is kept before closing it.",
+    )
+    nasa_gibs_http2: bool = Field(
+        default=False,
+        description="Use HTTP/2 multiplexing towards GIBS (requires the optional 'h2' package).",
+    )
+    nasa_treks_max_connections: int = Field(
+        default=50,
+        ge=1,
+        description="Maximum concurrent connections to the Solar System Treks host.",
+    )
+    nasa_treks_max_keepalive_connections: int = Field(
+        default=20,
+        ge=0,
+        description="Idle keep-alive connections kept open to the Treks host.",
+    )
+    nasa_treks_keepalive_expiry_seconds: float = Field(
+        default=5.0,
+        ge=0,
+        description="Seconds an idle Treks connection is kept before closing it.",
+    )
+    nasa_treks_http2: bool = Field(
+        default=False,
+        description="Use HTTP/2 multiplexing towards Treks (requires the optional 'h2' package).",
+    )
+    nasa_circuit_failure_threshold: int = Field(
+        default=5,
+        ge=1,
+        description="Consecutive timeouts/5xx from one NASA host that open its circuit breaker.",
+    )
+    nasa_circuit_reset_seconds: float = Field(
+        default=30.0,
+        gt=0,
+        description="Seconds an open circuit fails fast before letting a probe request through.",
+    )
+    nasa_latency_target_seconds: float = Field(
+        default=2.0,
+        ge=0,
+        description="Upstream latency above which the adaptive concurrency limit shrinks; 0 adapts only on failures.",
+    )
+    nasa_min_concurrency: int = Field(
+        default=4,
+        ge=1,
+        description="Floor for the adaptive per-host concurrency limit.",
+    )
+    nasa_hedge_percentile: float = Field(
+        default=0.0,
+        ge=0,
+        lt=1,
+        description="Fire a duplicate upstream request when the first has not answered within this latency percentile (e.g. 0.95); 0 disables hedging.",
+    )
+    nasa_hedge_min_delay_seconds: float = Field(
+        default=0.05,
+        ge=0,
+        description="Lower bound for the hedging delay.",
+    )
+    nasa_max_retries: int = Field(
+        default=1,
+        ge=0,
+        description="Retries (with exponential backoff and full jitter) for upstream timeouts, connection errors and 502/503/504.",
+    )
+    nasa_retry_backoff_seconds: float = Field(
+        default=0.1,
+        ge=0,
+        description="Base delay for upstream retry backoff.",
+    )
+    nasa_retry_budget_ratio: float = Field(
+        default=0.1,
+        ge=0,
+        description="Retries and hedges allowed per original upstream request (token bucket capped at 10).",
+    )
     tile_cache_dir: Path = Field(
         default=Path(".cache/tiles"),
         description="Filesystem directory used to persist proxied tile responses.",
@@ -65,12 +167,192 @@ class Settings(BaseSettings):
         ge=0,
         description="Cache TTL for NASA tile responses in seconds.",
     )
+    tile_cache_backend: Literal["files", "mbtiles"] = Field(
+        default="files",
+        description="Tile store: packed files per tile or one SQLite/MBTiles database per layer and date.",
+    )
+    tile_mbtiles_batch_size: int = Field(
+        default=64,
+        ge=1,
+        description="Pending tile writes that trigger a transactional flush to the MBTiles databases.",
+    )
+    tile_mbtiles_flush_interval_seconds: float = Field(
+        default=0.5,
+        ge=0,
+        description="Longest time a tile write waits in the MBTiles batch before being flushed.",
+    )
+    tile_mbtiles_readers: int = Field(
+        default=4,
+        ge=1,
+        description="Pooled read connections kept open per MBTiles database.",
+    )
+    tile_cache_dedup: bool = Field(
+        default=False,
+        description="Store tile bodies once per content hash and point cache entries at them with reference counts.",
+    )
+    tile_cache_shared_blobs: int = Field(
+        default=64,
+        ge=0,
+        description="Most referenced deduplicated bodies kept as a single shared copy in memory; 0 disables it.",
+    )
+    tile_immutable_ttl_seconds: int = Field(
+        default=30 * 24 * 3600,
+        ge=0,
+        description="Cache TTL for tiles that can no longer change: non-temporal layers and dates whose period has closed.",
+    )
+    tile_historical_after_days: int = Field(
+        default=3,
+        ge=0,
+        description="Days after a layer period ends before its imagery is considered final and served as immutable.",
+    )
+    tile_cache_max_bytes: int = Field(
+        default=512 * 1024 * 1024,
+        ge=0,
+        description="Total byte budget for the on-disk tile cache (0 disables the limit).",
+    )
+    tile_cache_max_entries: int = Field(
+        default=0,
+        ge=0,
+        description="Maximum number of on-disk tile cache entries (0 disables the limit).",
+    )
+    tile_cache_stale_retention_seconds: float = Field(
+        default=86400.0,
+        ge=0,
+        description="How long expired tile cache entries are kept for conditional revalidation against NASA.",
+    )
+    tile_cache_janitor_interval_seconds: float = Field(
+        default=60.0,
+        gt=0,
+        description="Seconds between background tile cache eviction passes.",
+    )
+    tile_memory_cache_max_bytes: int = Field(
+        default=64 * 1024 * 1024,
+        ge=0,
+        description="Byte budget for the in-process LRU tile tier in front of the disk cache (0 disables it).",
+    )
+    tile_cache_io_workers: int = Field(
+        default=4,
+        ge=1,
+        description="Size of the thread pool that performs tile cache disk I/O off the event loop.",
+    )
+    tile_stale_while_revalidate_seconds: float = Field(
+        default=60.0,
+        ge=0,
+        description="Window after expiry during which a stale tile is served immediately while it is refreshed in the background.",
+    )
+    tile_stale_if_error_seconds: float = Field(
+        default=86400.0,
+        ge=0,
+        description="Window after expiry during which a stale tile is served when NASA times out or fails (bounded by the stale retention).",
+    )
+    tile_negative_cache_ttl_seconds: float = Field(
+        default=300.0,
+        ge=0,
+        description="TTL for negative cache entries when NASA has no imagery for a tile (404/400 or empty body); 0 disables them.",
+    )
+    tile_negative_placeholder: bool = Field(
+        default=False,
+        description="Serve a shared transparent PNG instead of an error for tiles NASA has no imagery for.",
+    )
+    tile_stream_passthrough: bool = Field(
+        default=False,
+        description="Stream upstream tile bodies to the client while they are written to the cache on cold misses.",
+    )
+    tile_batch_max_tiles: int = Field(
+        default=256,
+        ge=1,
+        description="Maximum number of tiles accepted by the bulk tile endpoint.",
+    )
+    tile_batch_concurrency: int = Field(
+        default=8,
+        ge=1,
+        description="Concurrent upstream fetches per bulk tile request.",
+    )
+    tile_prefetch_enabled: bool = Field(
+        default=False,
+        description="Prefetch neighbor and child tiles in the background after serving a tile.",
+    )
+    tile_prefetch_ring: int = Field(
+        default=1,
+        ge=0,
+        description="Neighbor ring (in tiles) prefetched around each served tile.",
+    )
+    tile_prefetch_queue_size: int = Field(
+        default=256,
+        ge=1,
+        description="Maximum pending prefetches; the oldest are dropped when full.",
+    )
+    tile_prefetch_workers: int = Field(
+        default=2,
+        ge=1,
+        description="Concurrent upstream fetches used by the prefetcher.",
+    )
+    tile_series_max_frames: int = Field(
+        default=366,
+        ge=1,
+        description="Maximum number of dates returned by the temporal tile series endpoint.",
+    )
+    tile_series_concurrency: int = Field(
+        default=8,
+        ge=1,
+        description="Concurrent frame fetches per temporal tile series request.",
+    )
+    tile_static_max_tiles: int = Field(
+        default=64,
+        ge=1,
+        description="Maximum number of tiles stitched into one static map render.",
+    )
+    tile_static_concurrency: int = Field(
+        default=8,
+        ge=1,
+        description="Concurrent tile fetches per static map render.",
+    )
+    tile_static_cache_max_bytes: int = Field(
+        default=32 * 1024 * 1024,
+        ge=0,
+        description="In-memory budget for encoded static map renders; 0 disables the render cache.",
+    )
+    tile_static_cache_ttl_seconds: int = Field(
+        default=3600,
+        ge=0,
+        description="Lifetime of a cached static map render and its Cache-Control max-age.",
+    )
+    tile_warmup_concurrency: int = Field(
+        default=8,
+        ge=1,
+        description="Default concurrent upstream fetches for cache warm-up runs.",
+    )
+    tile_export_dir: Path = Field(
+        default=Path(".cache/exports"),
+        description="Directory where offline MBTiles export packages are written.",
+    )
+    tile_export_max_tiles: int = Field(
+        default=100_000,
+        ge=1,
+        description="Maximum number of tiles in a single offline export job.",
+    )
+    tile_export_concurrency: int = Field(
+        default=8,
+        ge=1,
+        description="Default concurrent tile fetches for offline export jobs.",
+    )
+    tile_export_batch_size: int = Field(
+        default=256,
+        ge=1,
+        description="Tiles written per transaction to the export package; bounds the memory a job holds.",
+    )
+    tile_export_retention_seconds: int = Field(
+        default=24 * 3600,
+        ge=0,
+        description="Age after which finished export packages are deleted when a new export starts.",
+    )
     http_timeout_seconds: float = Field(
         default=10.0,
         ge=0.1,
         description="Timeout for outbound HTTP requests to NASA services.",
     )
     annotation_delete_secret: str = Field(default="qminds")
+    cache_admin_secret: str = Field(default="qminds")
 
     @property
     def database_url(self) -> str:
@@ -89,6 +371,7 @@ def get_settings() -> Settings:
 
     settings = Settings()
     settings.tile_cache_dir.mkdir(parents=True, exist_ok=True)
+    settings.tile_export_dir.mkdir(parents=True, exist_ok=True)
     return settings
 
 
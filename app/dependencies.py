@@ -3,9 +3,11 @@ from __future__ import annotations
 from collections import defaultdict, deque
 from threading import Lock
 from time import monotonic
-from typing import Deque, Dict
+from typing import Deque, Dict, Optional
 
-from fastapi import HTTPException, Request, status
+from fastapi import HTTPException, Query, Request, status
+
+from app.core.config import settings
 
 RATE_LIMIT_PER_MINUTE = 120
 WINDOW_SECONDS = 60.0
@@ -42,3 +44,17 @@ rate_limiter = RateLimiter(limit=RATE_LIMIT_PER_MINUTE, window=WINDOW_SECONDS)
 async def limit_db_requests(request: Request) -> None:
     client_host = request.client.host if request.client else "unknown"
     rate_limiter.hit(client_host)
+
+
+async def require_cache_admin_secret(
+    secret: Optional[str] = Query(None, description="Codigo secreto requerido", alias="secret"),
+) -> None:
+    if not secret or secret != settings.cache_admin_secret:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail={
+                "status": "forbidden",
+                "code": "invalid_secret",
+                "message": "Codigo secreto invalido.",
+            },
+        )
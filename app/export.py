@@ -0,0 +1,227 @@
+"""Exportacion de una region de una capa a un paquete MBTiles para uso offline.
+
+Los tiles se piden via ``NasaBroadcast`` (los que ya estan en cache no salen a
+NASA) y se escriben a disco en lotes a medida que llegan: en memoria solo vive el
+lote en curso, sin importar el tamano de la piramide. El archivo se arma como
+``<id>.mbtiles.part`` y se renombra al terminar, asi que un paquete con el nombre
+final siempre esta completo.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import sqlite3
+import time
+from dataclasses import dataclass, field
+from datetime import date as DateType
+from pathlib import Path
+from threading import Lock
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+from app.broadcast.nasa import NasaBroadcast, is_missing_tile, is_placeholder
+from app.cache_mbtiles import MBTILES_SUFFIX, connect_mbtiles, write_tiles
+from app.core.config import settings
+from app.layers_catalog import TEMPORAL_NONE, LayerConfig, layer_temporal
+from app.tiling import BBox, count_tiles_in_bbox, tiles_in_bbox
+
+PART_SUFFIX = ".part"
+
+TileRow = Tuple[int, int, int, bytes]
+
+
+@dataclass(frozen=True)
+class ExportSpec:
+    layer: LayerConfig
+    bbox: BBox
+    min_zoom: int
+    max_zoom: int
+    date: Optional[DateType] = None
+
+    @property
+    def zooms(self) -> range:
+        max_zoom = self.max_zoom if self.layer.max_zoom is None else min(self.max_zoom, self.layer.max_zoom)
+        return range(self.min_zoom, max_zoom + 1)
+
+    def count(self) -> int:
+        return sum(count_tiles_in_bbox(self.layer.projection, self.bbox, z) for z in self.zooms)
+
+    def tiles(self) -> Iterator[Tuple[int, int, int]]:
+        for z in self.zooms:
+            yield from tiles_in_bbox(self.layer.projection, self.bbox, z)
+
+    def metadata(self) -> Dict[str, str]:
+        bbox = self.bbox
+        metadata = {
+            "name": self.layer.title,
+            "type": "baselayer",
+            "version": "1.0",
+            "description": self.layer.layer_key,
+            "bounds": f"{bbox.min_lon},{bbox.min_lat},{bbox.max_lon},{bbox.max_lat}",
+            "minzoom": str(self.zooms.start),
+            "maxzoom": str(max(self.zooms.start, self.zooms.stop - 1)),
+            # Clave propia: MBTiles asume Web Mercator y las capas geograficas usan EPSG:4326.
+            "projection": self.layer.projection,
+        }
+        if self.layer.image_format:
+            metadata["format"] = self.layer.image_format
+        if self.date is not None and layer_temporal(self.layer) != TEMPORAL_NONE:
+            metadata["date"] = self.date.isoformat()
+        return metadata
+
+
+@dataclass
+class ExportProgress:
+    total: int = 0
+    processed: int = 0
+    written: int = 0
+    missing: int = 0
+    failed: int = 0
+    bytes: int = 0
+    started_at: float = field(default_factory=time.time)
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "total": self.total,
+            "processed": self.processed,
+            "written": self.written,
+            "missing": self.missing,
+            "failed": self.failed,
+            "bytes": self.bytes,
+            "elapsedSeconds": round(time.time() - self.started_at, 1),
+        }
+
+
+class TileExporter:
+    """Descarga los tiles de un ``ExportSpec`` y los vuelca a un archivo MBTiles."""
+
+    def __init__(
+        self,
+        broadcast: NasaBroadcast,
+        spec: ExportSpec,
+        path: Path,
+        concurrency: int = 8,
+        batch_size: int = 256,
+        on_progress: Optional[Callable[[ExportProgress], None]] = None,
+    ) -> None:
+        self.broadcast = broadcast
+        self.spec = spec
+        self.path = path
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.on_progress = on_progress
+        self.progress = ExportProgress()
+        self._batch: List[TileRow] = []
+        self._flush_lock = asyncio.Lock()
+        # Un lote cancelado a mitad puede seguir escribiendo en su hilo mientras se cierra la base.
+        self._db_lock = Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    async def run(self) -> ExportProgress:
+        self.progress.total = self.spec.count()
+        part = self.path.with_name(self.path.name + PART_SUFFIX)
+        self._conn = await asyncio.to_thread(self._open, part)
+        tiles = self.spec.tiles()
+        workers = [asyncio.create_task(self._worker(tiles)) for _ in range(self.concurrency)]
+        try:
+            await asyncio.gather(*workers)
+            await self._flush()
+            await asyncio.to_thread(self._close)
+            os.replace(part, self.path)
+        except BaseException:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            await asyncio.to_thread(self._close)
+            _remove(part)
+            raise
+        self._report()
+        return self.progress
+
+    async def _worker(self, tiles: Iterator[Tuple[int, int, int]]) -> None:
+        for z, x, y in tiles:
+            try:
+                body, _ = await self.broadcast.get_tile(self.spec.layer, z, x, y, self.spec.date, background=True)
+            except HTTPException as exc:
+                if is_missing_tile(exc):
+                    self.progress.missing += 1
+                else:
+                    self.progress.failed += 1
+            else:
+                # Un placeholder no se guarda: el visor offline muestra el hueco en lugar de un tile vacio.
+                if is_placeholder(body):
+                    self.progress.missing += 1
+                else:
+                    self._batch.append((z, x, y, body))
+                    self.progress.bytes += len(body)
+                    if len(self._batch) >= self.batch_size:
+                        await self._flush()
+            self.progress.processed += 1
+
+    async def _flush(self) -> None:
+        async with self._flush_lock:
+            rows, self._batch = self._batch, []
+            if not rows:
+                return
+            await asyncio.to_thread(self._write, rows)
+            self.progress.written += len(rows)
+            self._report()
+
+    def _open(self, part: Path) -> sqlite3.Connection:
+        _remove(part)
+        conn = connect_mbtiles(part, cache_tables=False)
+        conn.executemany(
+            "INSERT OR REPLACE INTO metadata (name, value) VALUES (?, ?)",
+            list(self.spec.metadata().items()),
+        )
+        return conn
+
+    def _write(self, rows: List[TileRow]) -> None:
+        with self._db_lock:
+            if self._conn is None:
+                return
+            self._conn.execute("BEGIN")
+            write_tiles(self._conn, rows)
+            self._conn.execute("COMMIT")
+
+    def _close(self) -> None:
+        with self._db_lock:
+            if self._conn is None:
+                return
+            # Un solo archivo autocontenido para descargar, sin -wal ni -shm al lado.
+            self._conn.execute("PRAGMA journal_mode=DELETE")
+            self._conn.close()
+            self._conn = None
+
+    def _report(self) -> None:
+        if self.on_progress is not None:
+            self.on_progress(self.progress)
+
+
+def export_path(job_id: str) -> Path:
+    return settings.tile_export_dir / f"{job_id}{MBTILES_SUFFIX}"
+
+
+def prune_exports(max_age_seconds: float) -> int:
+    """Borra paquetes (y restos ``.part``) mas viejos que ``max_age_seconds``; devuelve cuantos."""
+
+    cutoff = time.time() - max_age_seconds
+    removed = 0
+    for path in settings.tile_export_dir.glob(f"*{MBTILES_SUFFIX}*"):
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+                removed += 1
+        except OSError:
+            continue
+    return removed
+
+
+def _remove(path: Path) -> None:
+    for suffix in ("", "-wal", "-shm", "-journal"):
+        try:
+            Path(f"{path}{suffix}").unlink()
+        except OSError:
+            pass
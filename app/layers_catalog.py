@@ -2,8 +2,16 @@ from __future__ import annotations
 
 from dataclasses import dataclass
 from datetime import date as DateType
+from datetime import timedelta
 from typing import Dict, Optional
 
+# Resolucion temporal de una capa: cada cuanto publica NASA una imagen distinta.
+TEMPORAL_NONE = "none"
+TEMPORAL_DAILY = "daily"
+TEMPORAL_MONTHLY = "monthly"
+TEMPORAL_YEARLY = "yearly"
+TEMPORAL_RESOLUTIONS = (TEMPORAL_NONE, TEMPORAL_DAILY, TEMPORAL_MONTHLY, TEMPORAL_YEARLY)
+
 
 @dataclass(frozen=True)
 class LayerConfig:
@@ -18,6 +26,7 @@ class LayerConfig:
     max_zoom: Optional[int]
     default_date: Optional[DateType]
     source_template: str
+    temporal: str = TEMPORAL_DAILY
 
 
 _LAYERS: tuple[LayerConfig, ...] = (
@@ -98,6 +107,7 @@ _LAYERS: tuple[LayerConfig, ...] = (
         max_zoom=8,
         default_date=DateType(2004, 1, 1),
         source_template="{layerId}/default/{date}/{matrixSet}/{z}/{y}/{x}.{format}",
+        temporal=TEMPORAL_NONE,
     ),
     LayerConfig(
         layer_key="gibs:BlueMarble_ShadedRelief_Bathymetry",
@@ -111,6 +121,7 @@ _LAYERS: tuple[LayerConfig, ...] = (
         max_zoom=8,
         default_date=DateType(2004, 1, 1),
         source_template="{layerId}/default/{date}/{matrixSet}/{z}/{y}/{x}.{format}",
+        temporal=TEMPORAL_NONE,
     ),
     LayerConfig(
         layer_key="gibs:VIIRS_CityLights_2012",
@@ -124,6 +135,7 @@ _LAYERS: tuple[LayerConfig, ...] = (
         max_zoom=8,
         default_date=DateType(2012, 1, 1),
         source_template="{layerId}/default/{date}/{matrixSet}/{z}/{y}/{x}.{format}",
+        temporal=TEMPORAL_NONE,
     ),
     LayerConfig(
         layer_key="trek:Mars:Mars_MGS_MOLA_ClrShade_merge_global_463m",
@@ -137,6 +149,7 @@ _LAYERS: tuple[LayerConfig, ...] = (
         max_zoom=10,
         default_date=None,
         source_template="https://trek.nasa.gov/tiles/Mars/EQ/Mars_MGS_MOLA_ClrShade_merge_global_463m/1.0.0/{style}/{matrixSet}/{z}/{y}/{x}.{format}",
+        temporal=TEMPORAL_NONE,
     ),
     LayerConfig(
         layer_key="trek:Mars:Mars_Viking_MDIM21_ClrMosaic_global_232m",
@@ -150,6 +163,7 @@ _LAYERS: tuple[LayerConfig, ...] = (
         max_zoom=10,
         default_date=None,
         source_template="https://trek.nasa.gov/tiles/Mars/EQ/Mars_Viking_MDIM21_ClrMosaic_global_232m/1.0.0/{style}/{matrixSet}/{z}/{y}/{x}.{format}",
+        temporal=TEMPORAL_NONE,
     ),
     LayerConfig(
         layer_key="trek:Moon:LRO_LOLA_ClrShade_Global_128ppd_v04",
@@ -163,6 +177,7 @@ _LAYERS: tuple[LayerConfig, ...] = (
         max_zoom=8,
         default_date=None,
         source_template="https://trek.nasa.gov/tiles/Moon/EQ/LRO_LOLA_ClrShade_Global_128ppd_v04/1.0.0/{style}/{matrixSet}/{z}/{y}/{x}.{format}",
+        temporal=TEMPORAL_NONE,
     ),
     LayerConfig(
         layer_key="trek:Ceres:Ceres_Dawn_FC_HAMO_ClrShade_DLR_Global_60ppd_Oct2016",
@@ -176,6 +191,7 @@ _LAYERS: tuple[LayerConfig, ...] = (
         max_zoom=10,
         default_date=None,
         source_template="https://trek.nasa.gov/tiles/Ceres/EQ/Ceres_Dawn_FC_HAMO_ClrShade_DLR_Global_60ppd_Oct2016/1.0.0/{style}/{matrixSet}/{z}/{y}/{x}.{format}",
+        temporal=TEMPORAL_NONE,
     ),
 )
 
@@ -187,4 +203,32 @@ def get_layer(layer_key: str) -> Optional[LayerConfig]:
 
 
 def all_layers() -> Dict[str, LayerConfig]:
-    return dict(_LAYER_BY_KEY)
\ No newline at end of file
+    return dict(_LAYER_BY_KEY)
+
+
+def layer_temporal(layer: object) -> str:
+    """Resolucion temporal de la capa; las capas sin el dato (p. ej. de la base) se infieren por tipo."""
+
+    temporal = getattr(layer, "temporal", None)
+    if temporal in TEMPORAL_RESOLUTIONS:
+        return temporal
+    return TEMPORAL_NONE if getattr(layer, "kind", None) == "trek" else TEMPORAL_DAILY
+
+
+def period_start(temporal: str, day: DateType) -> DateType:
+    """Primer dia del periodo que publica NASA para ``day`` (todas las fechas del periodo comparten imagen)."""
+
+    if temporal == TEMPORAL_MONTHLY:
+        return day.replace(day=1)
+    if temporal == TEMPORAL_YEARLY:
+        return day.replace(month=1, day=1)
+    return day
+
+
+def period_end(temporal: str, day: DateType) -> DateType:
+    start = period_start(temporal, day)
+    if temporal == TEMPORAL_MONTHLY:
+        return (start + timedelta(days=31)).replace(day=1) - timedelta(days=1)
+    if temporal == TEMPORAL_YEARLY:
+        return start.replace(month=12, day=31)
+    return start
@@ -1,14 +1,17 @@
 from __future__ import annotations
 
+import asyncio
 import logging
 
 from fastapi import FastAPI, Request, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 
-from app.api.routes import annotations, health, layers, tiles
+from app.api.routes import annotations, cache_admin, health, layers, tiles
 from app.broadcast.nasa import get_nasa_broadcast
+from app.cache import run_janitor
 from app.core.config import settings
+from app.jobs import job_registry
 
 logging.basicConfig(level=logging.INFO)
 LOGGER = logging.getLogger("app.startup")
@@ -58,6 +61,7 @@ app.include_router(health.router, prefix="/api")
 app.include_router(layers.router)
 app.include_router(tiles.router)
 app.include_router(annotations.router)
+app.include_router(cache_admin.router)
 
 
 @app.on_event("startup")
@@ -71,6 +75,14 @@ async def startup_event() -> None:
             "db_name": settings.db_name,
         },
     )
+    # Migracion del formato anterior, indexado y desalojo corren en segundo plano para no demorar el arranque.
+    app.state.tile_cache_janitor = asyncio.create_task(
+        run_janitor(
+            get_nasa_broadcast().cache,
+            settings.tile_cache_janitor_interval_seconds,
+            rename=get_nasa_broadcast().normalize_cache_key,
+        )
+    )
     if settings.run_migrations_on_startup:
         LOGGER.warning("run_migrations_on_startup is enabled but automatic execution is disabled in code")
     LOGGER.info("Startup completed")
@@ -78,6 +90,10 @@ async def startup_event() -> None:
 
 @app.on_event("shutdown")
 async def shutdown_event() -> None:
+    janitor = getattr(app.state, "tile_cache_janitor", None)
+    if janitor is not None:
+        janitor.cancel()
+    await job_registry.shutdown()
     await get_nasa_broadcast().close()
 
 
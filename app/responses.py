@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+from typing import Mapping, Optional
+
+import anyio
+from starlette.background import BackgroundTask
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+from app.cache import CachedFile
+
+ZERO_COPY_EXTENSION = "http.response.zerocopysend"
+CHUNK_SIZE = 64 * 1024
+
+
+class CachedFileResponse(Response):
+    """Envia el cuerpo de una entrada del cache directamente desde su archivo.
+
+    Si el servidor ASGI ofrece la extension ``http.response.zerocopysend`` se le
+    entrega el descriptor con offset y largo para que use ``sendfile``; si no, el
+    rango se lee en bloques fuera del event loop sin materializar el tile entero.
+
+    uvicorn no ofrece esa extension, asi que ahi siempre se usa el envio en bloques.
+    ``http.response.pathsend`` (lo que usa ``FileResponse``) no sirve: manda un
+    archivo entero y el cuerpo de una entrada empieza despues de su encabezado.
+    Los tiles calientes no llegan aca: se sirven desde el nivel en memoria.
+    """
+
+    def __init__(
+        self,
+        cached: CachedFile,
+        headers: Optional[Mapping[str, str]] = None,
+        media_type: Optional[str] = None,
+        background: Optional[BackgroundTask] = None,
+    ) -> None:
+        self.cached = cached
+        self.status_code = 200
+        self.media_type = media_type
+        self.background = background
+        self.init_headers(headers)
+        self.headers["content-length"] = str(cached.length)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": self.status_code,
+                    "headers": self.raw_headers,
+                }
+            )
+            if ZERO_COPY_EXTENSION in scope.get("extensions", {}):
+                await send(
+                    {
+                        "type": ZERO_COPY_EXTENSION,
+                        "file": self.cached.fileno(),
+                        "offset": self.cached.offset,
+                        "count": self.cached.length,
+                        "more_body": False,
+                    }
+                )
+            else:
+                await self._send_chunks(send)
+        finally:
+            self.cached.close()
+        if self.background is not None:
+            await self.background()
+
+    async def _send_chunks(self, send: Send) -> None:
+        handle = self.cached.handle
+        remaining = self.cached.length
+        await anyio.to_thread.run_sync(handle.seek, self.cached.offset)
+        while remaining > 0:
+            chunk = await anyio.to_thread.run_sync(handle.read, min(CHUNK_SIZE, remaining))
+            if not chunk:
+                # Archivo truncado por fuera del cache: se cierra la respuesta para no colgar al cliente.
+                break
+            remaining -= len(chunk)
+            await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining == 0:
+                return
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
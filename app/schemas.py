@@ -4,7 +4,7 @@ from __future__ import annotations
 from datetime import date as DateType, datetime
 from typing import Any, Dict, List, Literal, Optional
 
-from pydantic import BaseModel, ConfigDict, Field
+from pydantic import BaseModel, ConfigDict, Field, model_validator
 
 
 def to_camel(string: str) -> str:
@@ -17,6 +17,7 @@ class CamelModel(BaseModel):
 
 
 LayerKind = Literal["gibs", "trek"]
+TemporalResolution = Literal["none", "daily", "monthly", "yearly"]
 
 
 class Layer(CamelModel):
@@ -32,6 +33,9 @@ class Layer(CamelModel):
     default_date: Optional[DateType] = Field(
         default=None, description="Fecha por defecto para capas temporales."
     )
+    temporal: TemporalResolution = Field(
+        default="daily", description="Cada cuanto cambia la imagen (none para capas sin fecha)."
+    )
 
 
 class MapState(CamelModel):
@@ -91,6 +95,55 @@ class AnnotationBulkResponse(CamelModel):
     features: List[AnnotationFeature] = Field(default_factory=list)
 
 
+class TileCoordinate(CamelModel):
+    z: int = Field(..., ge=0, description="Zoom")
+    x: int = Field(..., ge=0, description="Columna del tile")
+    y: int = Field(..., ge=0, description="Fila del tile")
+
+
+class TileBatchRequest(CamelModel):
+    tiles: List[TileCoordinate] = Field(default_factory=list, description="Tiles z/x/y solicitados.")
+    bbox: Optional[FrameExtent] = Field(default=None, description="Cuadro a cubrir (alternativa a tiles).")
+    zoom: Optional[int] = Field(default=None, ge=0, description="Zoom usado junto con bbox.")
+    date: Optional[DateType] = Field(default=None, description="Fecha para capas temporales.")
+
+    @model_validator(mode="after")
+    def _require_tiles_or_bbox(self) -> "TileBatchRequest":
+        if not self.tiles and (self.bbox is None or self.zoom is None):
+            raise ValueError("Se requiere 'tiles' o bien 'bbox' junto con 'zoom'.")
+        return self
+
+
+class WarmupRequest(CamelModel):
+    layer_keys: List[str] = Field(..., min_length=1, description="Capas del catalogo a precargar.")
+    dates: List[DateType] = Field(default_factory=list, description="Fechas para capas temporales.")
+    bbox: FrameExtent = Field(..., description="Cuadro a precargar.")
+    min_zoom: int = Field(default=0, ge=0, description="Zoom minimo.")
+    max_zoom: int = Field(..., ge=0, description="Zoom maximo (acotado por el de cada capa).")
+    concurrency: Optional[int] = Field(default=None, ge=1, le=64, description="Descargas simultaneas.")
+
+    @model_validator(mode="after")
+    def _check_zoom_range(self) -> "WarmupRequest":
+        if self.min_zoom > self.max_zoom:
+            raise ValueError("'minZoom' no puede ser mayor que 'maxZoom'.")
+        return self
+
+
+class ExportRequest(CamelModel):
+    layer_key: str = Field(..., description="Capa del catalogo a exportar.")
+    date: Optional[DateType] = Field(default=None, description="Fecha para capas temporales.")
+    bbox: FrameExtent = Field(..., description="Cuadro a exportar.")
+    min_zoom: int = Field(default=0, ge=0, description="Zoom minimo.")
+    max_zoom: int = Field(..., ge=0, description="Zoom maximo (acotado por el de la capa).")
+    concurrency: Optional[int] = Field(default=None, ge=1, le=64, description="Descargas simultaneas.")
+
+    @model_validator(mode="after")
+    def _check_zoom_range(self) -> "ExportRequest":
+        if self.min_zoom > self.max_zoom:
+            raise ValueError("'minZoom' no puede ser mayor que 'maxZoom'.")
+        return self
+
+
 class User(CamelModel):
     id: Optional[int] = None
     username: str
@@ -3,7 +3,7 @@ from __future__ import annotations
 from collections import defaultdict
 from typing import Dict, List
 
-from app.layers_catalog import all_layers
+from app.layers_catalog import TEMPORAL_NONE, all_layers, layer_temporal
 from app.schemas import Layer
 
 
@@ -12,7 +12,8 @@ class LayerService:
         catalog = defaultdict(list)
         for config in all_layers().values():
             template = f"/v1/layers/{config.layer_key}/tiles/{{z}}/{{x}}/{{y}}"
-            if config.kind == "gibs":
+            temporal = layer_temporal(config)
+            if config.kind == "gibs" and temporal != TEMPORAL_NONE:
                 template += "?date={date}"
             catalog[config.body].append(
                 Layer(
@@ -26,6 +27,7 @@ class LayerService:
                     tile_template=template,
                     max_zoom=config.max_zoom,
                     default_date=config.default_date,
+                    temporal=temporal,  # type: ignore[arg-type]
                 )
             )
         return dict(catalog)
\ No newline at end of file
@@ -1,12 +1,37 @@
 from __future__ import annotations
 
+import asyncio
+import json
+import struct
+import time
+from collections import deque
+from dataclasses import dataclass
 from datetime import date as DateType
-from typing import Optional, Tuple
+from datetime import timedelta
+from email.utils import parsedate_to_datetime
+from typing import AsyncIterator, Deque, Dict, List, Mapping, Optional, Tuple
 
 from fastapi import HTTPException, status
 
-from app.broadcast.nasa import NasaBroadcast
-from app.layers_catalog import get_layer
+from app.broadcast.nasa import NasaBroadcast, content_etag, is_missing_tile, is_placeholder
+from app.cache import CachedFile, CachedPayload
+from app.core.config import settings
+from app.layers_catalog import TEMPORAL_NONE, LayerConfig, get_layer, layer_temporal
+from app.schemas import TileBatchRequest
+from app.static_map import STATIC_FORMATS, MosaicPlan, compose, load_pillow, plan_mosaic, render_cache, render_flight
+from app.tiling import BBox, count_tiles_in_bbox, tiles_in_bbox
+
+BUNDLE_MEDIA_TYPE = "application/x-tile-bundle"
+BUNDLE_LENGTH = struct.Struct(">I")
+
+
+@dataclass
+class TileResult:
+    headers: dict[str, str]
+    body: Optional[bytes] = None
+    file: Optional[CachedFile] = None
+    stream: Optional[AsyncIterator[bytes]] = None
+    not_modified: bool = False
 
 
 class TileService:
@@ -20,7 +45,302 @@ class TileService:
         x: int,
         y: int,
         date_override: Optional[DateType],
-    ) -> Tuple[bytes, dict[str, str]]:
+        if_none_match: Optional[str] = None,
+        if_modified_since: Optional[str] = None,
+    ) -> TileResult:
+        layer = self._resolve_layer(layer_key, date_override)
+        prefetcher = self.broadcast.prefetcher
+        if prefetcher is not None:
+            prefetcher.observe(layer, z, x, y, date_override)
+        result = await self._serve_tile(layer, z, x, y, date_override, if_none_match, if_modified_since)
+        if prefetcher is not None:
+            prefetcher.schedule(layer, z, x, y, date_override)
+        return result
+
+    async def _serve_tile(
+        self,
+        layer: LayerConfig,
+        z: int,
+        x: int,
+        y: int,
+        date_override: Optional[DateType],
+        if_none_match: Optional[str],
+        if_modified_since: Optional[str],
+    ) -> TileResult:
+        # Tiles calientes: se resuelven en el loop, sin pasar por el pool de hilos del disco.
+        hot = self.broadcast.get_hot_tile(layer, z, x, y, date_override)
+        if hot is not None:
+            body, headers = hot
+            if is_not_modified(headers, if_none_match, if_modified_since):
+                return TileResult(headers=headers, not_modified=True)
+            return TileResult(headers=headers, body=body)
+
+        if if_none_match or if_modified_since:
+            cached_headers = await self.broadcast.get_tile_headers(layer, z, x, y, date_override)
+            if cached_headers and is_not_modified(cached_headers, if_none_match, if_modified_since):
+                return TileResult(headers=cached_headers, not_modified=True)
+
+        cached_file = await self.broadcast.open_cached_tile(layer, z, x, y, date_override)
+        if cached_file is not None:
+            if "ETag" in cached_file.headers:
+                return TileResult(headers=dict(cached_file.headers), file=cached_file)
+            # Entradas anteriores sin ETag: se leen completas para derivarlo del contenido.
+            cached_file.close()
+        elif settings.tile_stream_passthrough and not (if_none_match or if_modified_since):
+            download = await self.broadcast.stream_tile(layer, z, x, y, date_override)
+            if download is not None:
+                return TileResult(headers=dict(download.headers), stream=download.iter_body())
+
+        body, headers = await self.broadcast.get_tile(layer, z, x, y, date_override)
+        if is_not_modified(headers, if_none_match, if_modified_since):
+            return TileResult(headers=headers, not_modified=True)
+        return TileResult(headers=headers, body=body)
+
+    def resolve_batch(self, layer_key: str, request: TileBatchRequest) -> Tuple[LayerConfig, List[Tuple[int, int, int]]]:
+        """Valida la capa y expande la lista de tiles (o el bbox) antes de empezar a transmitir."""
+
+        layer = self._resolve_layer(layer_key, request.date)
+        coords = [(tile.z, tile.x, tile.y) for tile in request.tiles]
+        if not coords and request.bbox is not None and request.zoom is not None:
+            bbox = BBox(
+                min_lon=request.bbox.min_lon,
+                min_lat=request.bbox.min_lat,
+                max_lon=request.bbox.max_lon,
+                max_lat=request.bbox.max_lat,
+            )
+            if count_tiles_in_bbox(layer.projection, bbox, request.zoom) > settings.tile_batch_max_tiles:
+                raise _too_many_tiles()
+            coords = list(tiles_in_bbox(layer.projection, bbox, request.zoom))
+        coords = list(dict.fromkeys(coords))
+        if len(coords) > settings.tile_batch_max_tiles:
+            raise _too_many_tiles()
+        return layer, coords
+
+    async def stream_batch(
+        self,
+        layer: LayerConfig,
+        coords: List[Tuple[int, int, int]],
+        date_override: Optional[DateType],
+    ) -> AsyncIterator[bytes]:
+        """Emite un frame del bundle por tile en el orden en que se resuelven.
+
+        Los tiles en cache salen de inmediato; solo las descargas hacia NASA pasan
+        por el semaforo de concurrencia.
+        """
+
+        semaphore = asyncio.Semaphore(settings.tile_batch_concurrency)
+
+        async def resolve(z: int, x: int, y: int) -> bytes:
+            meta: Dict[str, object] = {"z": z, "x": x, "y": y}
+            try:
+                found = await self.broadcast.get_cached_tile(layer, z, x, y, date_override)
+                if found is None:
+                    async with semaphore:
+                        found = await self.broadcast.get_tile(layer, z, x, y, date_override)
+            except HTTPException as exc:
+                detail = exc.detail if isinstance(exc.detail, dict) else {}
+                meta.update(status=exc.status_code, code=detail.get("code"))
+                return encode_bundle_frame(meta, b"")
+            body, headers = found
+            meta.update(status=200, contentType=headers.get("Content-Type"), etag=headers.get("ETag"))
+            return encode_bundle_frame(meta, body)
+
+        tasks = [asyncio.ensure_future(resolve(z, x, y)) for z, x, y in coords]
+        try:
+            for next_frame in asyncio.as_completed(tasks):
+                yield await next_frame
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def resolve_series(
+        self,
+        layer_key: str,
+        start: DateType,
+        end: DateType,
+        step_days: int,
+    ) -> Tuple[LayerConfig, List[DateType]]:
+        """Valida la capa y arma las fechas de la serie, una por periodo de la capa."""
+
+        layer = self._resolve_layer(layer_key, start)
+        if layer_temporal(layer) == TEMPORAL_NONE:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail={
+                    "status": "invalid",
+                    "code": "layer_not_temporal",
+                    "message": f"La capa '{layer_key}' no cambia con la fecha.",
+                },
+            )
+        if end < start:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail={
+                    "status": "invalid",
+                    "code": "invalid_date_range",
+                    "message": "'end' no puede ser anterior a 'start'.",
+                },
+            )
+        # En capas mensuales o anuales varios dias caen en el mismo periodo: un solo frame por periodo.
+        periods: Dict[str, DateType] = {}
+        current = start
+        while current <= end:
+            periods.setdefault(self.broadcast.cache_date(layer, current), current)
+            if len(periods) > settings.tile_series_max_frames:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail={
+                        "status": "invalid",
+                        "code": "too_many_frames",
+                        "message": f"La serie supera el maximo de {settings.tile_series_max_frames} fechas.",
+                    },
+                )
+            try:
+                current += timedelta(days=step_days)
+            except OverflowError:
+                break
+        return layer, list(periods.values())
+
+    async def stream_series(
+        self,
+        layer: LayerConfig,
+        z: int,
+        x: int,
+        y: int,
+        dates: List[DateType],
+    ) -> AsyncIterator[bytes]:
+        """Emite un frame del bundle por fecha, en orden cronologico.
+
+        Las descargas avanzan en una ventana de ``tile_series_concurrency`` fechas
+        por delante de la que se esta enviando. Las fechas sin imagen (404 o entrada
+        negativa en cache) se omiten; otros errores salen como frame con ``status``.
+        """
+
+        async def resolve(target_date: DateType) -> Optional[bytes]:
+            meta: Dict[str, object] = {"date": self.broadcast.cache_date(layer, target_date)}
+            try:
+                found = await self.broadcast.get_cached_tile(layer, z, x, y, target_date)
+                if found is None:
+                    if await self.broadcast.is_known_missing(layer, z, x, y, target_date):
+                        return None
+                    found = await self.broadcast.get_tile(layer, z, x, y, target_date)
+                    if is_placeholder(found[0]):
+                        return None
+            except HTTPException as exc:
+                if is_missing_tile(exc):
+                    return None
+                detail = exc.detail if isinstance(exc.detail, dict) else {}
+                meta.update(status=exc.status_code, code=detail.get("code"))
+                return encode_bundle_frame(meta, b"")
+            body, headers = found
+            meta.update(status=200, contentType=headers.get("Content-Type"), etag=headers.get("ETag"))
+            return encode_bundle_frame(meta, body)
+
+        pending = iter(dates)
+        window: Deque[asyncio.Future] = deque()
+        try:
+            for target_date in pending:
+                window.append(asyncio.ensure_future(resolve(target_date)))
+                if len(window) >= settings.tile_series_concurrency:
+                    break
+            while window:
+                frame = await window.popleft()
+                next_date = next(pending, None)
+                if next_date is not None:
+                    window.append(asyncio.ensure_future(resolve(next_date)))
+                if frame is not None:
+                    yield frame
+        finally:
+            for task in window:
+                task.cancel()
+
+    async def render_static(
+        self,
+        layer_key: str,
+        bbox: BBox,
+        zoom: int,
+        image_format: str,
+        date_override: Optional[DateType],
+    ) -> Tuple[bytes, Dict[str, str]]:
+        """Imagen unica del bbox en el zoom pedido, armada con los tiles del broadcast.
+
+        El resultado se guarda en memoria bajo una clave derivada de los parametros
+        (con la fecha normalizada como en las claves de tiles) y los renders
+        simultaneos de la misma clave se resuelven una sola vez.
+        """
+
+        layer = self._resolve_layer(layer_key, date_override)
+        if layer.max_zoom is not None and zoom > layer.max_zoom:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail={
+                    "status": "invalid",
+                    "code": "zoom_out_of_range",
+                    "message": f"La capa '{layer_key}' llega hasta el zoom {layer.max_zoom}.",
+                },
+            )
+        plan = plan_mosaic(layer.projection, bbox, zoom)
+        if plan.tiles > settings.tile_static_max_tiles:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail={
+                    "status": "invalid",
+                    "code": "too_many_tiles",
+                    "message": f"El mapa supera el maximo de {settings.tile_static_max_tiles} tiles; baje el zoom.",
+                },
+            )
+        bounds = ",".join(f"{value:.6f}" for value in (bbox.min_lon, bbox.min_lat, bbox.max_lon, bbox.max_lat))
+        key = f"{layer.layer_key}:{self.broadcast.cache_date(layer, date_override)}:{zoom}:{bounds}:{image_format}"
+        cached = render_cache.get(key)
+        if cached is not None:
+            return cached.body, dict(cached.headers)
+        # Sin Pillow se responde 503 antes de pedir tiles a NASA.
+        load_pillow()
+        rendered = await render_flight.do(key, lambda: self._render(layer, plan, image_format, date_override))
+        render_cache.set(key, rendered)
+        return rendered.body, dict(rendered.headers)
+
+    async def _render(
+        self,
+        layer: LayerConfig,
+        plan: MosaicPlan,
+        image_format: str,
+        date_override: Optional[DateType],
+    ) -> CachedPayload:
+        semaphore = asyncio.Semaphore(settings.tile_static_concurrency)
+
+        async def fetch(x: int, y: int) -> Optional[bytes]:
+            try:
+                async with semaphore:
+                    body, _ = await self.broadcast.get_tile(layer, plan.zoom, x, y, date_override)
+            except HTTPException as exc:
+                # Un tile sin imagen queda transparente; cualquier otra falla corta el render.
+                if is_missing_tile(exc):
+                    return None
+                raise
+            return None if is_placeholder(body) else body
+
+        coords = plan.coords()
+        bodies = await asyncio.gather(*(fetch(x, y) for x, y in coords))
+        if not any(bodies):
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail={
+                    "status": "not_found",
+                    "code": "tiles_not_found",
+                    "message": "NASA no tiene imagen para el area pedida.",
+                },
+            )
+        body = await asyncio.to_thread(compose, plan, dict(zip(coords, bodies)), image_format)
+        ttl = settings.tile_static_cache_ttl_seconds
+        headers = {
+            "Content-Type": STATIC_FORMATS[image_format][1],
+            "Cache-Control": f"public, max-age={ttl}",
+            "ETag": content_etag(body),
+        }
+        return CachedPayload(body=body, headers=headers, expires_at=time.time() + ttl)
+
+    def _resolve_layer(self, layer_key: str, date_override: Optional[DateType]) -> LayerConfig:
         layer = get_layer(layer_key)
         if layer is None:
             raise HTTPException(
@@ -40,4 +360,47 @@ class TileService:
                     "message": "Las capas GIBS requieren fecha (query ?date=YYYY-MM-DD).",
                 },
             )
-        return await self.broadcast.get_tile(layer, z, x, y, date_override)
\ No newline at end of file
+        return layer
+
+
+def encode_bundle_frame(meta: Mapping[str, object], body: bytes) -> bytes:
+    """Frame del bundle: largo + JSON de metadata y largo + cuerpo (enteros u32 big-endian)."""
+
+    raw_meta = json.dumps(meta, separators=(",", ":")).encode("utf-8")
+    return b"".join((BUNDLE_LENGTH.pack(len(raw_meta)), raw_meta, BUNDLE_LENGTH.pack(len(body)), body))
+
+
+def _too_many_tiles() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail={
+            "status": "invalid",
+            "code": "too_many_tiles",
+            "message": f"El lote supera el maximo de {settings.tile_batch_max_tiles} tiles.",
+        },
+    )
+
+
+def is_not_modified(
+    headers: Mapping[str, str],
+    if_none_match: Optional[str],
+    if_modified_since: Optional[str],
+) -> bool:
+    """Evalua los validadores del cliente segun RFC 9110 (If-None-Match tiene prioridad)."""
+
+    if if_none_match:
+        etag = headers.get("ETag")
+        if not etag:
+            return False
+        candidates = {candidate.strip() for candidate in if_none_match.split(",")}
+        return "*" in candidates or _weak(etag) in {_weak(candidate) for candidate in candidates}
+    if if_modified_since and (last_modified := headers.get("Last-Modified")):
+        try:
+            return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _weak(etag: str) -> str:
+    return etag[2:] if etag.startswith("W/") else etag
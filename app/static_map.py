@@ -0,0 +1,113 @@
+"""Composicion de mapas estaticos: une los tiles de un bbox, recorta y codifica una imagen.
+
+Pillow es opcional: se importa recien al renderizar y, si no esta instalado, el
+endpoint responde 503 sin afectar al resto de la API.
+"""
+
+from __future__ import annotations
+
+import io
+from dataclasses import dataclass
+from types import ModuleType
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, status
+
+from app.broadcast.singleflight import SingleFlight
+from app.cache import CachedPayload, MemoryCache
+from app.core.config import settings
+from app.tiling import BBox, lonlat_to_tile_fraction, tile_range
+
+# formato pedido -> (formato de Pillow, Content-Type)
+STATIC_FORMATS: Dict[str, Tuple[str, str]] = {
+    "png": ("PNG", "image/png"),
+    "jpeg": ("JPEG", "image/jpeg"),
+    "webp": ("WEBP", "image/webp"),
+}
+LOSSY_QUALITY = 85
+
+
+@dataclass(frozen=True)
+class MosaicPlan:
+    """Tiles que cubren el bbox y el recorte, en unidades de tile relativas al primero."""
+
+    zoom: int
+    min_x: int
+    min_y: int
+    max_x: int
+    max_y: int
+    crop: Tuple[float, float, float, float]
+
+    @property
+    def tiles(self) -> int:
+        return (self.max_x - self.min_x + 1) * (self.max_y - self.min_y + 1)
+
+    def coords(self) -> List[Tuple[int, int]]:
+        return [(x, y) for y in range(self.min_y, self.max_y + 1) for x in range(self.min_x, self.max_x + 1)]
+
+
+def plan_mosaic(projection: str, bbox: BBox, zoom: int) -> MosaicPlan:
+    min_x, min_y, max_x, max_y = tile_range(projection, bbox, zoom)
+    left, top = lonlat_to_tile_fraction(projection, zoom, bbox.min_lon, bbox.max_lat)
+    right, bottom = lonlat_to_tile_fraction(projection, zoom, bbox.max_lon, bbox.min_lat)
+    return MosaicPlan(
+        zoom=zoom,
+        min_x=min_x,
+        min_y=min_y,
+        max_x=max_x,
+        max_y=max_y,
+        crop=(left - min_x, top - min_y, right - min_x, bottom - min_y),
+    )
+
+
+def load_pillow() -> ModuleType:
+    try:
+        from PIL import Image
+    except ImportError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail={
+                "status": "unavailable",
+                "code": "imaging_unavailable",
+                "message": "El render de mapas estaticos requiere Pillow, que no esta instalado.",
+            },
+        ) from exc
+    return Image
+
+
+def compose(plan: MosaicPlan, tiles: Dict[Tuple[int, int], Optional[bytes]], image_format: str) -> bytes:
+    """Une los tiles (``None`` queda transparente), recorta al bbox y codifica la imagen."""
+
+    Image = load_pillow()
+    decoded = {coords: Image.open(io.BytesIO(body)) for coords, body in tiles.items() if body}
+    # Los placeholders de tiles faltantes pueden tener otro tamano que los tiles reales.
+    tile_w = max(image.width for image in decoded.values())
+    tile_h = max(image.height for image in decoded.values())
+    columns = plan.max_x - plan.min_x + 1
+    rows = plan.max_y - plan.min_y + 1
+    canvas = Image.new("RGBA", (columns * tile_w, rows * tile_h), (0, 0, 0, 0))
+    for (x, y), image in decoded.items():
+        if image.size != (tile_w, tile_h):
+            image = image.resize((tile_w, tile_h))
+        canvas.paste(image.convert("RGBA"), ((x - plan.min_x) * tile_w, (y - plan.min_y) * tile_h))
+
+    left, top, right, bottom = plan.crop
+    box = (round(left * tile_w), round(top * tile_h), round(right * tile_w), round(bottom * tile_h))
+    box = (box[0], box[1], max(box[2], box[0] + 1), max(box[3], box[1] + 1))
+    image = canvas.crop(box)
+
+    pillow_format, _ = STATIC_FORMATS[image_format]
+    if pillow_format == "JPEG":
+        # JPEG no tiene canal alfa: lo transparente queda en negro, como el fondo de las capas.
+        image = image.convert("RGB")
+    output = io.BytesIO()
+    if pillow_format == "PNG":
+        image.save(output, format=pillow_format, optimize=True)
+    else:
+        image.save(output, format=pillow_format, quality=LOSSY_QUALITY)
+    return output.getvalue()
+
+
+# Renders ya codificados, por clave derivada de los parametros; compartidos por todo el proceso.
+render_cache = MemoryCache(settings.tile_static_cache_max_bytes)
+render_flight: SingleFlight[CachedPayload] = SingleFlight()
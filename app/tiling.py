@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import math
+from dataclasses import dataclass
+from typing import Iterator, Tuple
+
+WEB_MERCATOR = "EPSG:3857"
+GEOGRAPHIC = "EPSG:4326"
+MAX_MERCATOR_LAT = 85.0511287798066
+EDGE_EPSILON = 1e-9
+
+
+@dataclass(frozen=True)
+class BBox:
+    min_lon: float
+    min_lat: float
+    max_lon: float
+    max_lat: float
+
+
+def matrix_size(projection: str, z: int) -> Tuple[int, int]:
+    """Columnas y filas del tile matrix en el zoom ``z``.
+
+    GoogleMapsCompatible (EPSG:3857) es 1x1 en z0; los matrix sets geograficos de
+    GIBS/Treks (EPSG:4326) son 2x1 en z0 con tiles de 180 grados.
+    """
+
+    if projection == GEOGRAPHIC:
+        return 2 ** (z + 1), 2**z
+    return 2**z, 2**z
+
+
+def lonlat_to_tile(projection: str, z: int, lon: float, lat: float) -> Tuple[int, int]:
+    columns, rows = matrix_size(projection, z)
+    x, y = lonlat_to_tile_fraction(projection, z, lon, lat)
+    return min(int(x), columns - 1), min(int(y), rows - 1)
+
+
+def lonlat_to_tile_fraction(projection: str, z: int, lon: float, lat: float) -> Tuple[float, float]:
+    """Posicion en unidades de tile (con decimales) dentro del tile matrix del zoom ``z``."""
+
+    columns, rows = matrix_size(projection, z)
+    lon = min(max(lon, -180.0), 180.0)
+    x = (lon + 180.0) / 360.0 * columns
+    if projection == GEOGRAPHIC:
+        lat = min(max(lat, -90.0), 90.0)
+        y = (90.0 - lat) / 180.0 * rows
+    else:
+        lat = min(max(lat, -MAX_MERCATOR_LAT), MAX_MERCATOR_LAT)
+        lat_rad = math.radians(lat)
+        y = (1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * rows
+    return x, y
+
+
+def tile_bounds(projection: str, z: int, x: int, y: int) -> BBox:
+    columns, rows = matrix_size(projection, z)
+    min_lon = x / columns * 360.0 - 180.0
+    max_lon = (x + 1) / columns * 360.0 - 180.0
+    if projection == GEOGRAPHIC:
+        max_lat = 90.0 - y / rows * 180.0
+        min_lat = 90.0 - (y + 1) / rows * 180.0
+    else:
+        max_lat = _mercator_row_lat(y, rows)
+        min_lat = _mercator_row_lat(y + 1, rows)
+    return BBox(min_lon=min_lon, min_lat=min_lat, max_lon=max_lon, max_lat=max_lat)
+
+
+def tile_range(projection: str, bbox: BBox, z: int) -> Tuple[int, int, int, int]:
+    """Rango inclusivo ``(min_x, min_y, max_x, max_y)`` de tiles que cubren el bbox."""
+
+    min_x, min_y = lonlat_to_tile(projection, z, bbox.min_lon, bbox.max_lat)
+    # El borde maximo es exclusivo: un bbox que termina justo en el limite no toma el tile vecino.
+    max_x, max_y = lonlat_to_tile(projection, z, bbox.max_lon - EDGE_EPSILON, bbox.min_lat + EDGE_EPSILON)
+    max_x, max_y = max(min_x, max_x), max(min_y, max_y)
+    return min_x, min_y, max_x, max_y
+
+
+def tiles_in_bbox(projection: str, bbox: BBox, z: int) -> Iterator[Tuple[int, int, int]]:
+    min_x, min_y, max_x, max_y = tile_range(projection, bbox, z)
+    for y in range(min_y, max_y + 1):
+        for x in range(min_x, max_x + 1):
+            yield z, x, y
+
+
+def count_tiles_in_bbox(projection: str, bbox: BBox, z: int) -> int:
+    min_x, min_y, max_x, max_y = tile_range(projection, bbox, z)
+    return (max_x - min_x + 1) * (max_y - min_y + 1)
+
+
+def _mercator_row_lat(row: int, rows: int) -> float:
+    return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / rows))))
@@ -0,0 +1,262 @@
+"""Precarga del cache de tiles para capas, fechas, bbox y rango de zoom.
+
+Uso desde la raiz del repo::
+
+    python -m app.warmup --layer gibs:MODIS_Terra_CorrectedReflectance_TrueColor \\
+        --date 2024-05-01 --bbox -75,-56,-53,-21 --zoom 0-6 --concurrency 8
+
+El recorrido es determinista, asi que un checkpoint en ``tile_cache_dir`` permite
+retomar una corrida interrumpida con los mismos parametros. Los tiles que ya estan
+vigentes en cache se omiten sin contactar a NASA; los que NASA no tiene se cuentan
+como faltantes, no como fallas.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import date as DateType
+from hashlib import sha256
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+from app.broadcast.nasa import NasaBroadcast, is_missing_tile, is_placeholder
+from app.core.config import settings
+from app.layers_catalog import TEMPORAL_NONE, LayerConfig, get_layer, layer_temporal
+from app.tiling import BBox, count_tiles_in_bbox, tiles_in_bbox
+
+CHECKPOINT_EVERY = 100
+CHECKPOINT_DIRNAME = "warmup"
+
+TileTask = Tuple[LayerConfig, Optional[DateType], int, int, int]
+
+
+@dataclass(frozen=True)
+class WarmupSpec:
+    layer_keys: Tuple[str, ...]
+    bbox: BBox
+    min_zoom: int
+    max_zoom: int
+    dates: Tuple[Optional[DateType], ...] = (None,)
+
+    def layers(self) -> List[LayerConfig]:
+        layers = []
+        for layer_key in self.layer_keys:
+            layer = get_layer(layer_key)
+            if layer is None:
+                raise ValueError(f"La capa '{layer_key}' no esta registrada.")
+            layers.append(layer)
+        return layers
+
+    def fingerprint(self) -> str:
+        raw = json.dumps(asdict(self), default=str, sort_keys=True)
+        return sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+    def _plan(self) -> Iterator[Tuple[LayerConfig, Optional[DateType], int]]:
+        for layer in self.layers():
+            max_zoom = self.max_zoom if layer.max_zoom is None else min(self.max_zoom, layer.max_zoom)
+            # Las capas sin dimension temporal (trek, BlueMarble...) se recorren una sola vez.
+            dates = self.dates if layer_temporal(layer) != TEMPORAL_NONE else (None,)
+            for target_date in dates:
+                for z in range(self.min_zoom, max_zoom + 1):
+                    yield layer, target_date, z
+
+    def count(self) -> int:
+        return sum(count_tiles_in_bbox(layer.projection, self.bbox, z) for layer, _, z in self._plan())
+
+    def tiles(self) -> Iterator[TileTask]:
+        for layer, target_date, z in self._plan():
+            for _, x, y in tiles_in_bbox(layer.projection, self.bbox, z):
+                yield layer, target_date, z, x, y
+
+
+@dataclass
+class WarmupProgress:
+    total: int = 0
+    processed: int = 0
+    fetched: int = 0
+    skipped: int = 0
+    missing: int = 0
+    failed: int = 0
+    resumed_from: int = 0
+    started_at: float = field(default_factory=time.time)
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "total": self.total,
+            "processed": self.processed,
+            "fetched": self.fetched,
+            "skipped": self.skipped,
+            "missing": self.missing,
+            "failed": self.failed,
+            "resumedFrom": self.resumed_from,
+            "elapsedSeconds": round(time.time() - self.started_at, 1),
+        }
+
+
+class TileWarmer:
+    """Recorre los tiles de un ``WarmupSpec`` y los descarga via ``NasaBroadcast``."""
+
+    def __init__(
+        self,
+        broadcast: NasaBroadcast,
+        spec: WarmupSpec,
+        concurrency: int = 8,
+        checkpoint_path: Optional[Path] = None,
+        on_progress: Optional[Callable[[WarmupProgress], None]] = None,
+    ) -> None:
+        self.broadcast = broadcast
+        self.spec = spec
+        self.concurrency = concurrency
+        self.checkpoint_path = checkpoint_path or default_checkpoint_path(spec)
+        self.on_progress = on_progress
+        self.progress = WarmupProgress()
+        # Marca de agua: todos los tiles con indice menor ya se procesaron.
+        self._watermark = 0
+        self._completed: set[int] = set()
+
+    async def run(self) -> WarmupProgress:
+        self.progress.total = self.spec.count()
+        start = await asyncio.to_thread(self._read_checkpoint)
+        self._watermark = start
+        self.progress.resumed_from = start
+        self.progress.processed = start
+
+        tiles = enumerate(self.spec.tiles())
+        for _ in range(start):
+            next(tiles, None)
+
+        workers = [asyncio.create_task(self._worker(tiles)) for _ in range(self.concurrency)]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.to_thread(self._write_checkpoint, self._watermark)
+        await asyncio.to_thread(self._clear_checkpoint)
+        self._report()
+        return self.progress
+
+    async def _worker(self, tiles: Iterator[Tuple[int, TileTask]]) -> None:
+        for index, (layer, target_date, z, x, y) in tiles:
+            try:
+                if await self.broadcast.get_tile_headers(layer, z, x, y, target_date) is not None:
+                    self.progress.skipped += 1
+                else:
+                    body, _ = await self.broadcast.get_tile(layer, z, x, y, target_date, background=True)
+                    if is_placeholder(body):
+                        self.progress.missing += 1
+                    else:
+                        self.progress.fetched += 1
+            except HTTPException as exc:
+                if is_missing_tile(exc):
+                    self.progress.missing += 1
+                else:
+                    self.progress.failed += 1
+            await self._mark_done(index)
+
+    async def _mark_done(self, index: int) -> None:
+        self.progress.processed += 1
+        self._completed.add(index)
+        while self._watermark in self._completed:
+            self._completed.remove(self._watermark)
+            self._watermark += 1
+        if self.progress.processed % CHECKPOINT_EVERY == 0:
+            await asyncio.to_thread(self._write_checkpoint, self._watermark)
+            self._report()
+
+    def _report(self) -> None:
+        if self.on_progress is not None:
+            self.on_progress(self.progress)
+
+    def _read_checkpoint(self) -> int:
+        try:
+            raw = json.loads(self.checkpoint_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return 0
+        if raw.get("fingerprint") != self.spec.fingerprint():
+            return 0
+        return int(raw.get("completed", 0))
+
+    def _write_checkpoint(self, completed: int) -> None:
+        payload = {"fingerprint": self.spec.fingerprint(), "completed": completed}
+        self.checkpoint_path.parent.mkdir(parents=True, exist_ok=True)
+        self.checkpoint_path.write_text(json.dumps(payload), encoding="utf-8")
+
+    def _clear_checkpoint(self) -> None:
+        try:
+            self.checkpoint_path.unlink()
+        except OSError:
+            pass
+
+
+def default_checkpoint_path(spec: WarmupSpec) -> Path:
+    # Directorio propio: la raiz del cache la recorren el janitor y la migracion del formato anterior.
+    return settings.tile_cache_dir / CHECKPOINT_DIRNAME / f"{spec.fingerprint()}.json"
+
+
+def _parse_bbox(raw: str) -> BBox:
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(part) for part in raw.split(","))
+    except ValueError as exc:
+        raise argparse.ArgumentTypeError("bbox debe ser minLon,minLat,maxLon,maxLat") from exc
+    return BBox(min_lon=min_lon, min_lat=min_lat, max_lon=max_lon, max_lat=max_lat)
+
+
+def _parse_zoom(raw: str) -> Tuple[int, int]:
+    low, _, high = raw.partition("-")
+    try:
+        return int(low), int(high or low)
+    except ValueError as exc:
+        raise argparse.ArgumentTypeError("zoom debe ser N o MIN-MAX") from exc
+
+
+def _print_progress(progress: WarmupProgress) -> None:
+    print(json.dumps(progress.to_dict()), flush=True)
+
+
+async def _main(args: argparse.Namespace) -> int:
+    min_zoom, max_zoom = args.zoom
+    spec = WarmupSpec(
+        layer_keys=tuple(args.layer),
+        bbox=args.bbox,
+        min_zoom=min_zoom,
+        max_zoom=max_zoom,
+        dates=tuple(args.date) or (None,),
+    )
+    broadcast = NasaBroadcast()
+    try:
+        progress = await TileWarmer(
+            broadcast,
+            spec,
+            concurrency=args.concurrency,
+            on_progress=_print_progress,
+        ).run()
+    finally:
+        await broadcast.close()
+    return 1 if progress.failed else 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--layer", action="append", required=True, help="layer_key del catalogo (repetible).")
+    parser.add_argument("--date", action="append", default=[], type=DateType.fromisoformat, help="YYYY-MM-DD (repetible).")
+    parser.add_argument("--bbox", required=True, type=_parse_bbox, help="minLon,minLat,maxLon,maxLat")
+    parser.add_argument("--zoom", required=True, type=_parse_zoom, help="N o MIN-MAX")
+    parser.add_argument("--concurrency", type=int, default=settings.tile_warmup_concurrency)
+    args = parser.parse_args(argv)
+    try:
+        return asyncio.run(_main(args))
+    except ValueError as exc:
+        parser.error(str(exc))
+        return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+"""Mide el lag del event loop con acceso al cache sincrono vs asincrono.
+
+Uso (desde la raiz del repo)::
+
+    python -m benchmarks.cache_event_loop_lag --requests 400 --disk-latency-ms 5
+
+``--disk-latency-ms`` agrega una espera artificial a cada lectura/escritura para
+emular un volumen lento (EFS, disco compartido). Un ticker duerme 1 ms en bucle y
+registra cuanto se retrasa cada despertar: ese retraso es el tiempo que el loop
+estuvo bloqueado y que sufren todas las demas corrutinas del worker.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from typing import List, Optional
+
+from app.cache import CachedPayload, FileCache
+
+TICK_SECONDS = 0.001
+
+
+class SlowDiskCache(FileCache):
+    def __init__(self, *args, disk_latency: float, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.disk_latency = disk_latency
+
+    def _load(self, key: str, allow_stale: bool = False) -> Optional[CachedPayload]:
+        time.sleep(self.disk_latency)
+        return super()._load(key, allow_stale)
+
+    def _store(self, key: str, payload: CachedPayload) -> None:
+        time.sleep(self.disk_latency)
+        super()._store(key, payload)
+
+
+async def _ticker(stop: asyncio.Event, lags: List[float]) -> None:
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(TICK_SECONDS)
+        lags.append(max(0.0, time.perf_counter() - started - TICK_SECONDS))
+
+
+async def _sync_request(cache: FileCache, key: str, body: bytes) -> None:
+    if cache.get(key) is None:
+        cache.set(key, body, {"Content-Type": "image/jpeg"})
+    await asyncio.sleep(0)
+
+
+async def _async_request(cache: FileCache, key: str, body: bytes) -> None:
+    if await cache.aget(key) is None:
+        await cache.aset(key, body, {"Content-Type": "image/jpeg"})
+
+
+async def _run(mode: str, args: argparse.Namespace) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = SlowDiskCache(
+            Path(tmp),
+            ttl_seconds=3600,
+            io_workers=args.io_workers,
+            disk_latency=args.disk_latency_ms / 1000,
+        )
+        body = b"\0" * args.payload_bytes
+        keys = [f"bench:2024-01-01:{args.zoom}:{i % args.distinct}:0" for i in range(args.requests)]
+        request = _sync_request if mode == "sync" else _async_request
+
+        lags: List[float] = []
+        stop = asyncio.Event()
+        ticker = asyncio.create_task(_ticker(stop, lags))
+        await asyncio.sleep(TICK_SECONDS * 5)
+
+        started = time.perf_counter()
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def bounded(key: str) -> None:
+            async with semaphore:
+                await request(cache, key, body)
+
+        await asyncio.gather(*(bounded(key) for key in keys))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await ticker
+        cache.close()
+
+    lags_ms = sorted(lag * 1000 for lag in lags) or [0.0]
+    return {
+        "mode": mode,
+        "elapsed_s": round(elapsed, 3),
+        "ticks": len(lags_ms),
+        "lag_mean_ms": round(statistics.mean(lags_ms), 3),
+        "lag_p99_ms": round(lags_ms[min(len(lags_ms) - 1, int(len(lags_ms) * 0.99))], 3),
+        "lag_max_ms": round(lags_ms[-1], 3),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--distinct", type=int, default=200, help="Cantidad de claves distintas.")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--payload-bytes", type=int, default=64 * 1024)
+    parser.add_argument("--disk-latency-ms", type=float, default=2.0)
+    parser.add_argument("--io-workers", type=int, default=4)
+    parser.add_argument("--zoom", type=int, default=3)
+    args = parser.parse_args()
+
+    for mode in ("sync", "async"):
+        result = asyncio.run(_run(mode, args))
+        print("  ".join(f"{name}={value}" for name, value in result.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,399 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import time
+
+import pytest
+
+from app.cache import TEMP_GRACE_SECONDS, CachedPayload, FileCache, MemoryCache, run_janitor
+from app.cache_blobs import BLOB_DIRNAME
+from app.cache_index import INDEX_FILENAME, CacheKeyIndex, KeyFilter
+from app.cache_mbtiles import MBTilesCache
+
+
+def test_memory_tier_serves_hot_entries_without_disk(tmp_path):
+    cache = FileCache(tmp_path, ttl_seconds=60, memory=MemoryCache(max_bytes=1024))
+    cache.set("layer:2024-01-01:0:0:0", b"hot", {"Content-Type": "image/png"})
+
+    for shard in tmp_path.iterdir():
+        shutil.rmtree(shard)
+
+    cached = cache.get("layer:2024-01-01:0:0:0")
+    assert cached is not None
+    assert cached.body == b"hot"
+    assert cache.memory.hits == 1
+
+
+def test_memory_tier_evicts_least_recently_used_by_bytes():
+    memory = MemoryCache(max_bytes=40)
+    expires_at = time.time() + 60
+    for key in ("a", "b", "c"):
+        memory.set(key, CachedPayload(body=b"x" * 10, headers={}, expires_at=expires_at))
+    assert memory.get("a") is not None
+
+    memory.set("d", CachedPayload(body=b"x" * 10, headers={}, expires_at=expires_at))
+    memory.set("e", CachedPayload(body=b"x" * 10, headers={}, expires_at=expires_at))
+
+    assert memory.get("b") is None
+    assert memory.get("a") is not None
+    assert memory.stats()["bytes"] <= 40
+
+
+def test_memory_tier_respects_expiry():
+    memory = MemoryCache(max_bytes=1024)
+    memory.set("old", CachedPayload(body=b"x", headers={}, expires_at=time.time() - 1))
+    assert memory.get("old") is None
+    assert memory.stats()["entries"] == 0
+
+
+@pytest.mark.asyncio
+async def test_async_interface_round_trip(tmp_path):
+    cache = FileCache(tmp_path, ttl_seconds=60, io_workers=2)
+    await cache.aset("layer:2024-01-01:1:0:0", b"async", {"Content-Type": "image/png"})
+
+    cached = await cache.aget("layer:2024-01-01:1:0:0")
+    assert cached is not None
+    assert cached.body == b"async"
+
+    await cache.adelete("layer:2024-01-01:1:0:0")
+    assert await cache.aget("layer:2024-01-01:1:0:0") is None
+    cache.close()
+
+
+def test_entries_are_single_sharded_files(tmp_path):
+    cache = FileCache(tmp_path, ttl_seconds=60)
+    cache.set("layer:2024-01-01:2:1:1", b"packed", {"ETag": '"abc"'})
+
+    files = [path for path in tmp_path.rglob("*") if path.is_file()]
+    assert len(files) == 1
+    digest = files[0].stem
+    assert files[0].relative_to(tmp_path).parts == (digest[:2], digest[2:4], f"{digest}.tile")
+
+    cached = cache.get("layer:2024-01-01:2:1:1")
+    assert cached is not None
+    assert cached.body == b"packed"
+    assert cached.headers == {"ETag": '"abc"'}
+
+
+def test_truncated_entries_are_treated_as_misses(tmp_path):
+    cache = FileCache(tmp_path, ttl_seconds=60)
+    cache.set("layer:2024-01-01:2:1:1", b"packed-body", {})
+    entry = next(path for path in tmp_path.rglob("*.tile"))
+    entry.write_bytes(entry.read_bytes()[:-3])
+
+    assert cache.get("layer:2024-01-01:2:1:1") is None
+    assert not entry.exists()
+
+
+def test_migrate_legacy_layout(tmp_path):
+    key = "layer:2024-01-01:0:0:0"
+    digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+    (tmp_path / f"{digest}.bin").write_bytes(b"legacy")
+    (tmp_path / f"{digest}.json").write_text(
+        json.dumps({"headers": {"Content-Type": "image/jpeg"}, "expiresAt": time.time() + 60}),
+        encoding="utf-8",
+    )
+    stale = "f" * 64
+    (tmp_path / f"{stale}.bin").write_bytes(b"old")
+    (tmp_path / f"{stale}.json").write_text(json.dumps({"headers": {}, "expiresAt": 0}), encoding="utf-8")
+
+    cache = FileCache(tmp_path, ttl_seconds=60)
+    assert cache.migrate_legacy_layout() == 1
+
+    assert not list(tmp_path.glob("*.bin")) and not list(tmp_path.glob("*.json"))
+    cached = cache.get(key)
+    assert cached is not None
+    assert cached.body == b"legacy"
+    assert cached.headers["Content-Type"] == "image/jpeg"
+
+
+def test_evict_removes_expired_then_least_recently_used(tmp_path):
+    cache = FileCache(tmp_path, ttl_seconds=60, max_entries=2)
+    cache.set("layer:2024-01-01:0:0:0", b"a", {})
+    cache.set("layer:2024-01-01:0:0:1", b"b", {})
+    cache.set("layer:2024-01-01:0:0:2", b"c", {})
+    cache.ttl_seconds = -1
+    cache.set("layer:2024-01-01:0:0:3", b"expired", {})
+    cache.ttl_seconds = 60
+    assert cache.get("layer:2024-01-01:0:0:0") is not None
+
+    assert cache.evict() == 2
+
+    assert cache.get("layer:2024-01-01:0:0:1") is None
+    assert cache.get("layer:2024-01-01:0:0:0") is not None
+    assert cache.get("layer:2024-01-01:0:0:2") is not None
+    assert cache.stats()["disk"]["entries"] == 2
+    assert len(list(tmp_path.rglob("*.tile"))) == 2
+
+
+def test_rebuild_index_accounts_existing_entries(tmp_path):
+    FileCache(tmp_path, ttl_seconds=60).set("layer:2024-01-01:0:0:0", b"x" * 100, {})
+
+    cache = FileCache(tmp_path, ttl_seconds=60, max_bytes=10)
+    assert cache.rebuild_index() == 1
+    assert cache.stats()["disk"]["bytes"] > 100
+
+    assert cache.evict() == 1
+    assert cache.stats()["disk"] == {
+        "entries": 0,
+        "bytes": 0,
+        "maxBytes": 10,
+        "maxEntries": 0,
+        "evictions": 1,
+    }
+
+
+def test_leftover_temp_files_are_swept_after_a_grace_period(tmp_path):
+    cache = FileCache(tmp_path, ttl_seconds=60, dedup=True)
+    cache.set("layer:2024-01-01:0:0:0", b"x" * 10, {})
+    entry = next(tmp_path.glob("*/*/*.tile"))
+    blob = next((tmp_path / BLOB_DIRNAME).glob("*/*/*.blob"))
+    old = time.time() - TEMP_GRACE_SECONDS - 60
+    leftovers = [entry.parent / ".crashed.tmp", blob.parent / ".crashed.tmp"]
+    for path in leftovers:
+        path.write_bytes(b"partial")
+        os.utime(path, (old, old))
+    recent = entry.parent / ".writing.tmp"
+    recent.write_bytes(b"partial")
+
+    assert FileCache(tmp_path, ttl_seconds=60, dedup=True).rebuild_index() == 1
+    assert not any(path.exists() for path in leftovers)
+    assert recent.exists()
+    assert cache.get("layer:2024-01-01:0:0:0").body == b"x" * 10
+
+
+def test_key_index_lists_and_purges_by_layer_date_and_zoom(tmp_path):
+    cache = FileCache(tmp_path, ttl_seconds=60, key_index=CacheKeyIndex(tmp_path / INDEX_FILENAME))
+    for date in ("2024-01-01", "2024-01-02"):
+        for z in (1, 5):
+            cache.set(f"gibs:LAYER_A:{date}:{z}:0:0", b"a" * 10, {})
+    cache.set("trek:Mars:LAYER_B:2024-01-01:1:0:0", b"b" * 10, {})
+    assert cache.get("gibs:LAYER_A:2024-01-02:5:0:0") is not None
+    assert cache.get("gibs:LAYER_A:2024-01-03:5:0:0") is None
+
+    listed = cache.entries(KeyFilter(layer="gibs:LAYER_A", date="2024-01-01"))
+    assert [entry.key for entry in listed] == ["gibs:LAYER_A:2024-01-01:1:0:0", "gibs:LAYER_A:2024-01-01:5:0:0"]
+
+    purged, size = cache.purge(KeyFilter(layer="gibs:LAYER_A", min_zoom=3))
+    assert purged == 2
+    assert size > 20
+    assert cache.get("gibs:LAYER_A:2024-01-01:5:0:0") is None
+    assert cache.get("gibs:LAYER_A:2024-01-01:1:0:0") is not None
+    assert cache.get("trek:Mars:LAYER_B:2024-01-01:1:0:0") is not None
+
+    stats = cache.layer_stats()
+    assert stats["gibs:LAYER_A"]["entries"] == 2
+    assert stats["gibs:LAYER_A"]["hits"] == 2
+    assert stats["gibs:LAYER_A"]["misses"] == 2
+    assert stats["trek:Mars:LAYER_B"]["entries"] == 1
+
+
+def test_key_index_is_created_on_first_use(tmp_path):
+    path = tmp_path / "tiles" / INDEX_FILENAME
+    index = CacheKeyIndex(path)
+    assert not path.exists()
+    assert index.keys() == []
+    assert path.exists()
+
+
+def test_key_index_batches_writes_into_one_transaction(tmp_path):
+    path = tmp_path / INDEX_FILENAME
+    index = CacheKeyIndex(path, batch_size=3, flush_interval_seconds=60)
+
+    def stored() -> int:
+        with sqlite3.connect(path) as conn:
+            return conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    index.put("layer:2024-01-01:0:0:0", "a", 10, time.time() + 60)
+    index.put("layer:2024-01-01:1:0:0", "b", 10, time.time() + 60)
+    assert not path.exists()
+    index.put("layer:2024-01-01:1:1:0", "c", 10, time.time() + 60)
+    assert stored() == 3
+
+    index.put("layer:2024-01-01:1:1:1", "d", 10, time.time() + 60)
+    index.touch("a", 0)
+    assert stored() == 3
+    assert {entry.digest for entry in index.find(KeyFilter(layer="layer"))} == {"a", "b", "c", "d"}
+    assert stored() == 4
+    index.close()
+
+
+def test_key_index_flushes_on_a_timer(tmp_path):
+    path = tmp_path / INDEX_FILENAME
+    index = CacheKeyIndex(path, flush_interval_seconds=0.01)
+    index.put("layer:2024-01-01:0:0:0", "a", 10, time.time() + 60)
+    for _ in range(100):
+        if index._timer is None:
+            break
+        time.sleep(0.01)
+    with index._lock, sqlite3.connect(path) as conn:
+        assert conn.execute("SELECT key FROM entries").fetchall() == [("layer:2024-01-01:0:0:0",)]
+    index.close()
+
+
+def test_rebuild_index_backfills_key_index_from_entry_metadata(tmp_path):
+    FileCache(tmp_path, ttl_seconds=60).set("gibs:LAYER_A:2024-01-01:2:1:1", b"x", {})
+
+    cache = FileCache(tmp_path, ttl_seconds=60, key_index=CacheKeyIndex(tmp_path / INDEX_FILENAME))
+    cache.rebuild_index()
+
+    assert [entry.key for entry in cache.entries(KeyFilter(layer="gibs:LAYER_A"))] == [
+        "gibs:LAYER_A:2024-01-01:2:1:1"
+    ]
+
+
+def test_dedup_stores_identical_bodies_once_and_reports_savings(tmp_path):
+    cache = FileCache(tmp_path, ttl_seconds=60, dedup=True)
+    cache.rebuild_index()
+    black = b"\x00" * 1000
+    for x in range(3):
+        cache.set(f"gibs:NIGHT:2024-01-01:2:{x}:0", black, {"Content-Type": "image/png"})
+    cache.set("gibs:NIGHT:2024-01-02:2:0:0", black, {})
+    cache.set("gibs:DAY:2024-01-01:2:0:0", b"land", {})
+
+    assert len(list(tmp_path.rglob("*.blob"))) == 2
+    assert cache.get("gibs:NIGHT:2024-01-02:2:0:0").body == black
+    report = cache.dedup_stats()
+    assert report["layers"]["gibs:NIGHT"] == {
+        "entries": 4,
+        "blobs": 1,
+        "logicalBytes": 4000,
+        "storedBytes": 1000,
+        "dedupRatio": 4.0,
+    }
+    assert report["savedBytes"] == 3000
+
+    # El cuerpo compartido se sirve desde una sola copia en memoria.
+    first = cache.get("gibs:NIGHT:2024-01-01:2:1:0").body
+    assert cache.get("gibs:NIGHT:2024-01-01:2:2:0").body is first
+    assert cache.dedup_stats()["shared"]["blobs"] == 1
+
+    for x in range(3):
+        cache.delete(f"gibs:NIGHT:2024-01-01:2:{x}:0")
+    assert len(list(tmp_path.rglob("*.blob"))) == 2
+    cache.delete("gibs:NIGHT:2024-01-02:2:0:0")
+    assert len(list(tmp_path.rglob("*.blob"))) == 1
+
+
+def test_dedup_eviction_keeps_blobs_still_referenced(tmp_path):
+    FileCache(tmp_path, ttl_seconds=60, dedup=True).set("layer:2024-01-01:0:0:0", b"same", {})
+    cache = FileCache(tmp_path, ttl_seconds=60, max_entries=1, dedup=True)
+    cache.set("layer:2024-01-02:0:0:0", b"same", {})
+    cache.rebuild_index()
+
+    assert cache.evict() == 1
+
+    assert cache.get("layer:2024-01-01:0:0:0") is None
+    assert cache.get("layer:2024-01-02:0:0:0").body == b"same"
+    assert len(list(tmp_path.rglob("*.blob"))) == 1
+    cache.delete("layer:2024-01-02:0:0:0")
+    assert not list(tmp_path.rglob("*.blob"))
+
+
+def test_mbtiles_backend_batches_writes_into_valid_mbtiles(tmp_path):
+    cache = MBTilesCache(tmp_path, ttl_seconds=60, batch_size=2)
+    cache.set("Layer:2024-01-01:3:2:1", b"png", {"Content-Type": "image/png"})
+    # Aun en el buffer: se lee sin haber tocado la base.
+    assert cache.get("Layer:2024-01-01:3:2:1").body == b"png"
+    assert not cache.path_for("Layer", "2024-01-01").exists()
+
+    cache.set("Layer:2024-01-01:3:2:2", b"", {"X-Tile-Missing": "404"})
+    database = cache.path_for("Layer", "2024-01-01")
+    conn = sqlite3.connect(database)
+    tiles = conn.execute("SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles").fetchall()
+    metadata = dict(conn.execute("SELECT name, value FROM metadata"))
+    conn.close()
+    # Filas en orden TMS; la entrada negativa no deja un tile vacio.
+    assert tiles == [(3, 2, 6, b"png")]
+    assert metadata["format"] == "png"
+
+    negative = cache.get("Layer:2024-01-01:3:2:2")
+    assert negative is not None and negative.body == b""
+    assert cache.get("Layer:2024-01-01:3:2:1").headers == {"Content-Type": "image/png"}
+    cache.close()
+
+
+def test_mbtiles_head_reads_metadata_without_the_blob(tmp_path):
+    cache = MBTilesCache(tmp_path, ttl_seconds=60, batch_size=100)
+    cache.set("Layer:2024-01-01:3:2:1", b"png" * 100, {"Content-Type": "image/png"})
+    cache.set("Layer:2024-01-01:3:2:2", b"old", {}, ttl_seconds=-10)
+    assert cache.head("Layer:2024-01-01:3:2:1").size == 300
+    cache.flush()
+
+    head = cache.head("Layer:2024-01-01:3:2:1")
+    assert head.size == 300
+    assert head.headers == {"Content-Type": "image/png"}
+    assert cache.head("Layer:2024-01-01:3:2:2") is None
+    assert cache.head("Layer:2024-01-01:3:9:9") is None
+    assert asyncio.run(cache.ahead("Layer:2024-01-01:3:2:1")).size == 300
+    cache.close()
+
+
+def test_mbtiles_backend_lists_purges_and_evicts(tmp_path):
+    cache = MBTilesCache(tmp_path, ttl_seconds=60, batch_size=100)
+    for z in (1, 2, 3):
+        cache.set(f"Layer:2024-01-01:{z}:0:0", b"x" * z, {})
+    cache.set("Layer:2024-01-02:1:0:0", b"y", {})
+    cache.set("Layer:2024-01-02:2:0:0", b"old", {}, ttl_seconds=-10)
+
+    entries = cache.entries(KeyFilter(layer="Layer", date="2024-01-01", min_zoom=2))
+    assert [entry.key for entry in entries] == ["Layer:2024-01-01:2:0:0", "Layer:2024-01-01:3:0:0"]
+    assert cache.purge(KeyFilter(layer="Layer", date="2024-01-01", min_zoom=2)) == (2, 5)
+    assert cache.get("Layer:2024-01-01:2:0:0") is None
+    assert cache.get("Layer:2024-01-01:1:0:0") is not None
+
+    disk = cache.stats()["disk"]
+    assert (disk["entries"], disk["bytes"]) == (3, 5)
+
+    assert cache.evict() == 1
+    assert cache.get("Layer:2024-01-02:2:0:0", allow_stale=True) is None
+    assert cache.layer_stats()["Layer"]["entries"] == 2
+    disk = cache.stats()["disk"]
+    assert (disk["entries"], disk["bytes"]) == (2, 2)
+    assert cache.rebuild_index() == 2
+    assert cache.stats()["disk"]["bytes"] == 2
+    cache.close()
+
+
+def test_mbtiles_eviction_keeps_running_totals_without_a_full_rescan(tmp_path, monkeypatch):
+    cache = MBTilesCache(tmp_path, ttl_seconds=60, batch_size=100, max_bytes=1)
+    cache.set("Layer:2024-01-01:1:0:0", b"a" * 10, {})
+    cache.set("Layer:2024-01-01:1:0:0", b"a" * 4, {})
+    cache.set("Layer:2024-01-02:1:0:0", b"b" * 6, {})
+    cache.flush()
+    assert (cache.stats()["disk"]["entries"], cache.stats()["disk"]["bytes"]) == (2, 10)
+
+    def rescan() -> int:
+        raise AssertionError("evict no debe recorrer todas las bases")
+
+    monkeypatch.setattr(cache, "rebuild_index", rescan)
+    assert cache.evict() == 2
+    assert list(tmp_path.rglob("*.mbtiles")) == []
+    assert (cache.stats()["disk"]["entries"], cache.stats()["disk"]["bytes"]) == (0, 0)
+    cache.close()
+
+
+@pytest.mark.asyncio
+async def test_janitor_keeps_running_after_a_failed_pass(tmp_path, monkeypatch):
+    cache = FileCache(tmp_path, ttl_seconds=60)
+    passes = []
+
+    async def flaky_evict() -> int:
+        passes.append(len(passes))
+        if len(passes) == 1:
+            raise OSError("disk hiccup")
+        return 0
+
+    monkeypatch.setattr(cache, "aevict", flaky_evict)
+    janitor = asyncio.create_task(run_janitor(cache, interval_seconds=0.01))
+    await asyncio.sleep(0.2)
+
+    assert not janitor.done()
+    assert len(passes) >= 2
+    janitor.cancel()
+    cache.close()
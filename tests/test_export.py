@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import sqlite3
+from datetime import date as DateType
+
+import httpx
+import pytest
+
+from app.broadcast.nasa import NasaBroadcast
+from app.cache import FileCache
+from app.export import ExportSpec, TileExporter
+from app.layers_catalog import get_layer
+from app.tiling import BBox
+
+LAYER_KEY = "gibs:MODIS_Terra_CorrectedReflectance_TrueColor"
+DATE = DateType(2024, 5, 1)
+WORLD = BBox(min_lon=-180.0, min_lat=-85.0, max_lon=180.0, max_lat=85.0)
+
+
+def _mock_tiles(respx_mock) -> None:
+    respx_mock.get(url__regex=r"https://gibs\.earthdata\.nasa\.gov/.*").mock(
+        return_value=httpx.Response(200, content=b"tile", headers={"Content-Type": "image/jpeg"})
+    )
+
+
+@pytest.mark.asyncio
+async def test_export_streams_tiles_into_mbtiles_package(tmp_path, respx_mock):
+    _mock_tiles(respx_mock)
+    service = NasaBroadcast(cache=FileCache(tmp_path / "cache", ttl_seconds=60))
+    spec = ExportSpec(layer=get_layer(LAYER_KEY), bbox=WORLD, min_zoom=0, max_zoom=1, date=DATE)
+    path = tmp_path / "export.mbtiles"
+    reports = []
+
+    progress = await TileExporter(service, spec, path, concurrency=2, batch_size=2, on_progress=reports.append).run()
+
+    assert progress.total == 5
+    assert progress.written == 5
+    assert len(reports) >= 3
+    assert not (tmp_path / "export.mbtiles.part").exists()
+    conn = sqlite3.connect(path)
+    rows = conn.execute("SELECT zoom_level, tile_column, tile_row FROM tiles ORDER BY 1, 2, 3").fetchall()
+    metadata = dict(conn.execute("SELECT name, value FROM metadata"))
+    conn.close()
+    assert rows[0] == (0, 0, 0)
+    assert (1, 1, 0) in rows and (1, 1, 1) in rows
+    assert metadata["format"] == "jpg"
+    assert metadata["date"] == "2024-05-01"
+    assert metadata["maxzoom"] == "1"
+    await service.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("placeholder", [False, True])
+async def test_export_skips_tiles_nasa_does_not_have(tmp_path, respx_mock, placeholder):
+    service = NasaBroadcast(cache=FileCache(tmp_path / "cache", ttl_seconds=60))
+    service.serve_placeholder = placeholder
+    layer = get_layer(LAYER_KEY)
+    respx_mock.get(service._build_gibs(layer, 1, 1, 1, DATE)).mock(return_value=httpx.Response(404))
+    _mock_tiles(respx_mock)
+    path = tmp_path / "export.mbtiles"
+
+    spec = ExportSpec(layer=layer, bbox=WORLD, min_zoom=0, max_zoom=1, date=DATE)
+    progress = await TileExporter(service, spec, path, concurrency=2).run()
+
+    assert (progress.written, progress.missing, progress.failed) == (4, 1, 0)
+    conn = sqlite3.connect(path)
+    rows = conn.execute("SELECT zoom_level, tile_column, tile_row FROM tiles").fetchall()
+    conn.close()
+    # La fila TMS de (1, 1, 1) es 0: el hueco no deja un tile en el paquete.
+    assert (1, 1, 0) not in rows and len(rows) == 4
+    await service.close()
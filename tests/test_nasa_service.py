@@ -1,13 +1,20 @@
 from __future__ import annotations
 
+import asyncio
+import time
+from dataclasses import replace
 from datetime import date as DateType
 
 import httpx
 import pytest
+from fastapi import HTTPException
 
 from app.broadcast.nasa import NasaBroadcast
+from app.broadcast.prefetch import TilePrefetcher
+from app.broadcast.upstreams import AdaptiveLimiter, CircuitBreaker, Upstream, http2_available
 from app.cache import FileCache
 from app.db.models import LayerModel
+from app.layers_catalog import TEMPORAL_MONTHLY, get_layer
 
 
 @pytest.mark.asyncio
@@ -47,3 +54,643 @@ async def test_gibs_tile_fetch_and_cache(tmp_path, respx_mock):
     assert respx_mock.calls.call_count == 1
 
     await service.close()
+
+
+def _gibs_layer() -> LayerModel:
+    return LayerModel(
+        layer_key="gibs:TEST_LAYER",
+        title="Test Layer",
+        kind="gibs",
+        body="earth",
+        projection="EPSG:3857",
+        matrix_set="GoogleMapsCompatible_Level9",
+        image_format="png",
+        style="default",
+        max_zoom=9,
+        default_date=DateType(2024, 1, 1),
+        source_template="{layerId}/default/{date}/{matrixSet}/{z}/{y}/{x}.{format}",
+    )
+
+
+def _store_expired(cache: FileCache, key: str, body: bytes, headers: dict, seconds_ago: int = 1) -> None:
+    ttl = cache.ttl_seconds
+    cache.ttl_seconds = -seconds_ago
+    cache.set(key, body, headers)
+    cache.ttl_seconds = ttl
+
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_are_coalesced(tmp_path, respx_mock):
+    service = NasaBroadcast(cache=FileCache(tmp_path, ttl_seconds=60))
+    layer = _gibs_layer()
+    url = service._build_gibs(layer, z=3, x=2, y=1, date_override=None)
+
+    async def delayed_response(request):
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, content=b"shared")
+
+    respx_mock.get(url).mock(side_effect=delayed_response)
+
+    results = await asyncio.gather(*(service.get_tile(layer, z=3, x=2, y=1) for _ in range(5)))
+
+    assert [body for body, _ in results] == [b"shared"] * 5
+    assert respx_mock.calls.call_count == 1
+    stats = service.stats()["singleflight"]
+    assert stats["leaders"] == 1
+    assert stats["coalesced"] == 4
+    assert stats["inFlight"] == 0
+
+    await service.close()
+
+
+@pytest.mark.asyncio
+async def test_coalesced_waiters_share_upstream_errors(tmp_path, respx_mock):
+    service = NasaBroadcast(cache=FileCache(tmp_path, ttl_seconds=60))
+    service.upstreams["gibs"].max_retries = 0
+    layer = _gibs_layer()
+    url = service._build_gibs(layer, z=3, x=2, y=1, date_override=None)
+
+    async def delayed_timeout(request):
+        await asyncio.sleep(0.05)
+        raise httpx.ConnectTimeout("slow", request=request)
+
+    respx_mock.get(url).mock(side_effect=delayed_timeout)
+
+    results = await asyncio.gather(
+        *(service.get_tile(layer, z=3, x=2, y=1) for _ in range(3)),
+        return_exceptions=True,
+    )
+
+    assert all(isinstance(exc, HTTPException) and exc.status_code == 504 for exc in results)
+    assert respx_mock.calls.call_count == 1
+
+    await service.close()
+
+
+@pytest.mark.asyncio
+async def test_cancelled_leader_does_not_cancel_waiters(tmp_path, respx_mock):
+    service = NasaBroadcast(cache=FileCache(tmp_path, ttl_seconds=60))
+    layer = _gibs_layer()
+    url = service._build_gibs(layer, z=3, x=2, y=1, date_override=None)
+    release = asyncio.Event()
+
+    async def slow_response(request):
+        await release.wait()
+        return httpx.Response(200, content=b"late")
+
+    respx_mock.get(url).mock(side_effect=slow_response)
+
+    leader = asyncio.create_task(service.get_tile(layer, z=3, x=2, y=1))
+    await asyncio.sleep(0)
+    follower = asyncio.create_task(service.get_tile(layer, z=3, x=2, y=1))
+    await asyncio.sleep(0)
+    leader.cancel()
+    release.set()
+
+    body, _ = await follower
+    assert body == b"late"
+    assert leader.cancelled()
+    assert respx_mock.calls.call_count == 1
+
+    await service.close()
+
+
+@pytest.mark.asyncio
+async def test_expired_entry_is_revalidated_with_validators(tmp_path, respx_mock):
+    cache = FileCache(tmp_path, ttl_seconds=60)
+    service = NasaBroadcast(cache=cache)
+    service.stale_while_revalidate_seconds = 0
+    layer = _gibs_layer()
+    cache_key = service._cache_key(layer, 4, 3, 2)
+    _store_expired(cache, cache_key, b"original", {"Content-Type": "image/png", "ETag": '"v1"', "Last-Modified": "Mon, 01 Jan 2024 00:00:00 GMT"})
+
+    url = service._build_gibs(layer, z=4, x=3, y=2, date_override=None)
+    route = respx_mock.get(url).mock(return_value=httpx.Response(304))
+
+    body, headers = await service.get_tile(layer, z=4, x=3, y=2)
+
+    assert body == b"original"
+    assert headers["ETag"] == '"v1"'
+    sent = route.calls.last.request.headers
+    assert sent["If-None-Match"] == '"v1"'
+    assert sent["If-Modified-Since"] == "Mon, 01 Jan 2024 00:00:00 GMT"
+    refreshed = cache.get(cache_key)
+    assert refreshed is not None and not refreshed.is_expired
+    assert service.stats()["upstream"]["notModified"] == 1
+
+    await service.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "freshness, ttl",
+    [
+        ({"Cache-Control": "public, max-age=120"}, 120),
+        ({"Date": "Mon, 01 Jan 2024 00:00:00 GMT", "Expires": "Mon, 01 Jan 2024 00:05:00 GMT"}, 300),
+    ],
+)
+async def test_not_modified_merges_updated_headers_and_ttl(tmp_path, respx_mock, freshness, ttl):
+    cache = FileCache(tmp_path, ttl_seconds=60)
+    service = NasaBroadcast(cache=cache)
+    service.stale_while_revalidate_seconds = 0
+    service.immutable_ttl_seconds = 0
+    layer = _gibs_layer()
+    cache_key = service._cache_key(layer, 4, 3, 2)
+    _store_expired(cache, cache_key, b"original", {"Content-Type": "image/png", "ETag": '"v1"'})
+    url = service._build_gibs(layer, z=4, x=3, y=2, date_override=None)
+    respx_mock.get(url).mock(return_value=httpx.Response(304, headers={"ETag": '"v2"', **freshness}))
+
+    body, headers = await service.get_tile(layer, z=4, x=3, y=2)
+
+    assert body == b"original"
+    assert headers["ETag"] == '"v2"'
+    stored = cache.get(cache_key)
+    assert stored.body == b"original"
+    assert stored.headers["ETag"] == '"v2"'
+    assert stored.headers["Content-Type"] == "image/png"
+    assert stored.expires_at == pytest.approx(time.time() + ttl, abs=5)
+    await service.close()
+
+
+@pytest.mark.asyncio
+async def test_stale_while_revalidate_serves_stale_and_refreshes(tmp_path, respx_mock):
+    cache = FileCache(tmp_path, ttl_seconds=60)
+    service = NasaBroadcast(cache=cache)
+    service.stale_while_revalidate_seconds = 30
+    layer = _gibs_layer()
+    cache_key = service._cache_key(layer, 5, 1, 1)
+    _store_expired(cache, cache_key, b"stale", {"Content-Type": "image/png"})
+    url = service._build_gibs(layer, z=5, x=1, y=1, date_override=None)
+    respx_mock.get(url).mock(return_value=httpx.Response(200, content=b"fresh"))
+
+    body, headers = await service.get_tile(layer, z=5, x=1, y=1)
+    assert body == b"stale"
+    assert headers["Cache-Control"] == "no-cache"
+
+    for _ in range(50):
+        if not service._singleflight.in_flight(cache_key):
+            break
+        await asyncio.sleep(0.01)
+    body, _ = await service.get_tile(layer, z=5, x=1, y=1)
+    assert body == b"fresh"
+    assert respx_mock.calls.call_count == 1
+
+    await service.close()
+
+
+@pytest.mark.asyncio
+async def test_stale_if_error_serves_stale_when_nasa_fails(tmp_path, respx_mock):
+    cache = FileCache(tmp_path, ttl_seconds=60)
+    service = NasaBroadcast(cache=cache)
+    service.stale_while_revalidate_seconds = 0
+    service.stale_if_error_seconds = 3600
+    layer = _gibs_layer()
+    cache_key = service._cache_key(layer, 5, 1, 2)
+    _store_expired(cache, cache_key, b"stale", {"Content-Type": "image/png"}, seconds_ago=120)
+    url = service._build_gibs(layer, z=5, x=1, y=2, date_override=None)
+    respx_mock.get(url).mock(return_value=httpx.Response(503))
+
+    body, _ = await service.get_tile(layer, z=5, x=1, y=2)
+    assert body == b"stale"
+    assert service.stats()["upstream"]["staleIfError"] == 1
+
+    service.stale_if_error_seconds = 60
+    with pytest.raises(HTTPException) as excinfo:
+        await service.get_tile(layer, z=5, x=1, y=2)
+    assert excinfo.value.status_code == 502
+
+    await service.close()
+
+
+def test_prefetch_candidates_stay_inside_matrix_and_max_zoom(tmp_path):
+    service = NasaBroadcast(cache=FileCache(tmp_path, ttl_seconds=60))
+    prefetcher = TilePrefetcher(service, ring=1)
+    layer = _gibs_layer()
+
+    corner = set(prefetcher.candidates(layer, 2, 0, 0))
+    assert corner == {(2, 1, 0), (2, 0, 1), (2, 1, 1), (3, 0, 0), (3, 1, 0), (3, 0, 1), (3, 1, 1)}
+    assert all(z == 9 for z, _, _ in prefetcher.candidates(layer, 9, 10, 10))
+
+
+@pytest.mark.asyncio
+async def test_prefetch_waits_for_foreground_and_counts_hits(tmp_path, respx_mock):
+    service = NasaBroadcast(cache=FileCache(tmp_path, ttl_seconds=60))
+    prefetcher = TilePrefetcher(service, ring=1, workers=1)
+    service.prefetcher = prefetcher
+    layer = _gibs_layer()
+    release = asyncio.Event()
+
+    async def slow_tile(request):
+        await release.wait()
+        return httpx.Response(200, content=b"tile", headers={"Content-Type": "image/png"})
+
+    foreground_url = service._build_gibs(layer, z=1, x=0, y=0, date_override=None)
+    respx_mock.get(foreground_url).mock(side_effect=slow_tile)
+    respx_mock.get(url__regex=r".*/GoogleMapsCompatible_Level9/.*").mock(
+        return_value=httpx.Response(200, content=b"tile", headers={"Content-Type": "image/png"})
+    )
+
+    foreground = asyncio.create_task(service.get_tile(layer, z=1, x=0, y=0))
+    await asyncio.sleep(0.01)
+    prefetcher.schedule(layer, 0, 0, 0, None)
+    await asyncio.sleep(0.05)
+    assert prefetcher.stats()["queued"] == 4
+    assert prefetcher.stats()["fetched"] == 0
+
+    release.set()
+    await foreground
+    for _ in range(100):
+        if prefetcher.stats()["queued"] == 0 and prefetcher.stats()["fetched"] + prefetcher.stats()["skipped"] == 4:
+            break
+        await asyncio.sleep(0.01)
+    stats = prefetcher.stats()
+    assert stats["enqueued"] == 4
+    assert stats["skipped"] == 1
+    assert stats["fetched"] == 3
+
+    prefetcher.observe(layer, 1, 1, 1, None)
+    assert prefetcher.stats()["hits"] == 1
+    assert prefetcher.stats()["hitRate"] == round(1 / 3, 4)
+    await service.close()
+
+
+@pytest.mark.asyncio
+async def test_prefetch_counts_tiles_nasa_does_not_have_as_missing(tmp_path, respx_mock):
+    service = NasaBroadcast(cache=FileCache(tmp_path, ttl_seconds=60))
+    prefetcher = TilePrefetcher(service, ring=0, workers=1)
+    layer = _gibs_layer()
+    respx_mock.get(url__regex=r"https://gibs\.earthdata\.nasa\.gov/.*").mock(return_value=httpx.Response(404))
+
+    prefetcher.schedule(layer, 0, 0, 0, None)
+    for _ in range(100):
+        if prefetcher.stats()["missing"] == 4:
+            break
+        await asyncio.sleep(0.01)
+    stats = prefetcher.stats()
+    assert stats["missing"] == 4
+    assert stats["fetched"] == 0
+    assert stats["failed"] == 0
+    prefetcher.observe(layer, 1, 0, 0, None)
+    assert prefetcher.stats()["hits"] == 0
+    await prefetcher.close()
+    await service.close()
+
+
+@pytest.mark.asyncio
+async def test_missing_tiles_are_negatively_cached(tmp_path, respx_mock):
+    service = NasaBroadcast(cache=FileCache(tmp_path, ttl_seconds=60))
+    service.negative_ttl_seconds = 30
+    layer = _gibs_layer()
+    url = service._build_gibs(layer, z=7, x=1, y=2, date_override=None)
+    respx_mock.get(url).mock(return_value=httpx.Response(404))
+
+    for _ in range(3):
+        with pytest.raises(HTTPException) as excinfo:
+            await service.get_tile(layer, z=7, x=1, y=2)
+        assert excinfo.value.detail["details"]["status_code"] == 404
+    assert respx_mock.calls.call_count == 1
+    assert service.stats()["upstream"]["negativeHits"] == 2
+    assert await service.get_tile_headers(layer, 7, 1, 2) is None
+    assert await service.open_cached_tile(layer, 7, 1, 2) is None
+
+    service.serve_placeholder = True
+    body, headers = await service.get_tile(layer, z=7, x=1, y=2)
+    assert body.startswith(b"\x89PNG")
+    assert headers["Content-Type"] == "image/png"
+    assert headers["Cache-Control"] == "public, max-age=30"
+    assert respx_mock.calls.call_count == 1
+
+    await service.close()
+
+
+@pytest.mark.asyncio
+async def test_expired_negative_entry_is_fetched_again(tmp_path, respx_mock):
+    cache = FileCache(tmp_path, ttl_seconds=60)
+    service = NasaBroadcast(cache=cache)
+    layer = _gibs_layer()
+    cache_key = service._cache_key(layer, 7, 3, 4)
+    _store_expired(cache, cache_key, b"", {"X-Nasa-Status": "404"})
+    url = service._build_gibs(layer, z=7, x=3, y=4, date_override=None)
+    respx_mock.get(url).mock(return_value=httpx.Response(200, content=b"now-there", headers={"Content-Type": "image/png"}))
+
+    body, _ = await service.get_tile(layer, z=7, x=3, y=4)
+
+    assert body == b"now-there"
+    assert "If-None-Match" not in respx_mock.calls.last.request.headers
+    await service.close()
+
+
+@pytest.mark.asyncio
+async def test_upstream_pool_reports_wait_and_times_out(respx_mock):
+    release = asyncio.Event()
+
+    async def slow_tile(request):
+        await release.wait()
+        return httpx.Response(200, content=b"tile")
+
+    respx_mock.get("https://trek.nasa.gov/tiles/a.png").mock(side_effect=slow_tile)
+    upstream = Upstream("trek", timeout=0.05, max_connections=1)
+
+    first = asyncio.create_task(upstream.get("https://trek.nasa.gov/tiles/a.png"))
+    await asyncio.sleep(0.01)
+    with pytest.raises(httpx.PoolTimeout):
+        await upstream.get("https://trek.nasa.gov/tiles/a.png")
+    release.set()
+    await first
+    await upstream.get("https://trek.nasa.gov/tiles/a.png")
+
+    stats = upstream.stats()
+    assert stats["requests"] == 2
+    assert stats["poolTimeouts"] == 1
+    assert stats["inFlight"] == 0
+    await upstream.aclose()
+
+    fallback = Upstream("gibs", timeout=1.0, http2=True)
+    assert fallback.http2 is http2_available()
+    await fallback.aclose()
+
+
+@pytest.mark.asyncio
+async def test_open_circuit_fails_fast_per_upstream_and_serves_stale(tmp_path, respx_mock):
+    cache = FileCache(tmp_path, ttl_seconds=60)
+    service = NasaBroadcast(cache=cache)
+    service.stale_while_revalidate_seconds = 0
+    service.stale_if_error_seconds = 3600
+    gibs = service.upstreams["gibs"]
+    gibs.breaker.failure_threshold = 2
+    gibs.max_retries = 0
+    layer = _gibs_layer()
+    respx_mock.get(url__regex=r"https://gibs\.earthdata\.nasa\.gov/.*").mock(return_value=httpx.Response(503))
+    trek_layer = get_layer("trek:Mars:Mars_MGS_MOLA_ClrShade_merge_global_463m")
+    respx_mock.get(service._build_treks(trek_layer, 1, 0, 0)).mock(return_value=httpx.Response(200, content=b"mars"))
+
+    for x in range(2):
+        with pytest.raises(HTTPException) as excinfo:
+            await service.get_tile(layer, z=4, x=x, y=0)
+        assert excinfo.value.status_code == 502
+    assert gibs.breaker.state == "open"
+
+    with pytest.raises(HTTPException) as excinfo:
+        await service.get_tile(layer, z=4, x=5, y=0)
+    assert excinfo.value.status_code == 503
+    assert excinfo.value.detail["code"] == "nasa_unavailable"
+    assert "Retry-After" in excinfo.value.headers
+    assert respx_mock.calls.call_count == 2
+
+    _store_expired(cache, service._cache_key(layer, 4, 6, 0), b"stale", {"Content-Type": "image/png"}, seconds_ago=120)
+    body, _ = await service.get_tile(layer, z=4, x=6, y=0)
+    assert body == b"stale"
+
+    body, _ = await service.get_tile(trek_layer, z=1, x=0, y=0)
+    assert body == b"mars"
+    assert service.upstreams["trek"].breaker.state == "closed"
+    await service.close()
+
+
+def test_circuit_half_open_probe_closes_on_success():
+    breaker = CircuitBreaker("gibs", failure_threshold=1, reset_seconds=0)
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+    assert breaker.allow() is True
+    assert breaker.state == "half_open"
+    assert breaker.allow() is False
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+def test_adaptive_limiter_shrinks_on_slow_responses_and_recovers():
+    limiter = AdaptiveLimiter(max_limit=16, min_limit=2, latency_target=0.5)
+    limiter.in_flight = 2
+
+    limiter.release(latency=2.0, ok=True)
+    assert limiter.stats()["limit"] == 8
+    limiter.release(latency=0.1, ok=True)
+    assert 8 < limiter.limit < 9
+    limiter.in_flight = 1
+    limiter._last_decrease = 0.0
+    limiter.release(latency=0.1, ok=False)
+    assert limiter.stats()["limit"] == 4
+
+
+@pytest.mark.asyncio
+async def test_adaptive_limiter_caps_background_and_serves_foreground_first():
+    limiter = AdaptiveLimiter(max_limit=4)
+    await limiter.acquire(background=True)
+    await limiter.acquire(background=True)
+    capped = asyncio.create_task(limiter.acquire(background=True))
+    await asyncio.sleep(0)
+    assert not capped.done()
+
+    await limiter.acquire()
+    await limiter.acquire()
+    foreground = asyncio.create_task(limiter.acquire())
+    await asyncio.sleep(0)
+    limiter.release(latency=0.1, ok=True, background=True)
+    await asyncio.sleep(0)
+    assert foreground.done()
+    assert not capped.done()
+
+    limiter.release(latency=0.1, ok=True)
+    await asyncio.sleep(0)
+    assert capped.done()
+    assert limiter.stats()["backgroundInFlight"] == 2
+
+
+@pytest.mark.asyncio
+async def test_upstream_retries_transient_errors_within_budget(respx_mock, monkeypatch):
+    monkeypatch.setattr("app.broadcast.upstreams.random.uniform", lambda low, high: 0)
+    route = respx_mock.get("https://trek.nasa.gov/tiles/r.png")
+    route.side_effect = [httpx.Response(503), httpx.ConnectError("reset"), httpx.Response(200, content=b"ok")]
+    upstream = Upstream("trek", timeout=1.0, max_retries=2)
+
+    response = await upstream.get("https://trek.nasa.gov/tiles/r.png")
+    assert response.content == b"ok"
+    assert upstream.retries == 2
+
+    upstream.budget.tokens = 0
+    route.side_effect = None
+    route.return_value = httpx.Response(503)
+    response = await upstream.get("https://trek.nasa.gov/tiles/r.png")
+    assert response.status_code == 503
+    assert upstream.retries == 2
+    assert upstream.budget.exhausted == 1
+    await upstream.aclose()
+
+
+@pytest.mark.asyncio
+async def test_slow_upstream_request_is_hedged(respx_mock):
+    calls = 0
+
+    async def first_is_slow(request):
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            await asyncio.sleep(1)
+            return httpx.Response(200, content=b"slow")
+        return httpx.Response(200, content=b"fast")
+
+    respx_mock.get("https://trek.nasa.gov/tiles/h.png").mock(side_effect=first_is_slow)
+    upstream = Upstream("trek", timeout=5.0, hedge_percentile=0.95)
+    upstream._hedge_delay = 0.02
+
+    response = await upstream.get("https://trek.nasa.gov/tiles/h.png")
+
+    assert response.content == b"fast"
+    assert upstream.hedges == 1
+    assert upstream.hedge_wins == 1
+    assert upstream.in_flight == 0
+    await upstream.aclose()
+
+
+@pytest.mark.asyncio
+async def test_upstream_prefers_fast_mirror_and_ejects_failing_one(respx_mock):
+    primary = respx_mock.get("https://trek.nasa.gov/tiles/Mars/t.png").mock(side_effect=httpx.ConnectError("down"))
+    mirror = respx_mock.get("https://mirror.example.com/tiles/Mars/t.png").mock(
+        return_value=httpx.Response(200, content=b"mirror")
+    )
+    upstream = Upstream(
+        "trek",
+        timeout=1.0,
+        max_retries=1,
+        retry_backoff=0,
+        failure_threshold=10,
+        eject_after=1,
+        base_urls=["https://trek.nasa.gov/tiles", "https://mirror.example.com/tiles/"],
+    )
+
+    for _ in range(3):
+        response = await upstream.get("https://trek.nasa.gov/tiles/Mars/t.png")
+        assert response.content == b"mirror"
+
+    assert primary.call_count == 1
+    assert mirror.call_count == 3
+    primary_stats, mirror_stats = upstream.stats()["endpoints"]
+    assert primary_stats["ejected"] is True
+    assert mirror_stats["failures"] == 0
+    await upstream.aclose()
+
+
+def test_upstream_occasionally_probes_slower_mirrors(monkeypatch):
+    upstream = Upstream("trek", timeout=1.0, base_urls=["https://a.example.com", "https://b.example.com"])
+    fast, slow = upstream.endpoints
+    fast.ewma, slow.ewma = 0.05, 2.0
+
+    monkeypatch.setattr("app.broadcast.upstreams.random.random", lambda: 0.5)
+    assert upstream._pick_endpoint() is fast
+    monkeypatch.setattr("app.broadcast.upstreams.random.random", lambda: 0.0)
+    assert upstream._pick_endpoint() is slow
+
+    # La muestra nueva del mirror recuperado lo vuelve a poner adelante.
+    for _ in range(20):
+        slow.record(0.01, True, upstream.eject_after, upstream.ejection_seconds)
+    monkeypatch.setattr("app.broadcast.upstreams.random.random", lambda: 0.5)
+    assert upstream._pick_endpoint() is slow
+
+
+class _ChunkedBody(httpx.AsyncByteStream):
+    def __init__(self, chunks, error: Exception | None = None) -> None:
+        self.chunks = chunks
+        self.error = error
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            yield chunk
+            await asyncio.sleep(0)
+        if self.error is not None:
+            raise self.error
+
+
+@pytest.mark.asyncio
+async def test_cold_miss_streams_body_and_fills_cache(tmp_path, respx_mock):
+    cache = FileCache(tmp_path, ttl_seconds=60)
+    service = NasaBroadcast(cache=cache)
+    layer = _gibs_layer()
+    url = service._build_gibs(layer, z=7, x=5, y=6, date_override=None)
+    respx_mock.get(url).mock(
+        return_value=httpx.Response(200, headers={"Content-Type": "image/png"}, stream=_ChunkedBody([b"ab", b"cd", b"ef"]))
+    )
+
+    first, second = await asyncio.gather(
+        service.stream_tile(layer, z=7, x=5, y=6),
+        service.stream_tile(layer, z=7, x=5, y=6),
+    )
+    assert first is second
+    assert b"".join([chunk async for chunk in first.iter_body()]) == b"abcdef"
+    assert b"".join([chunk async for chunk in second.iter_body()]) == b"abcdef"
+    await asyncio.sleep(0.05)
+
+    cached = cache.get(service._cache_key(layer, 7, 5, 6))
+    assert cached.body == b"abcdef"
+    assert cached.headers["ETag"].startswith('"sha256-')
+    assert await service.stream_tile(layer, z=7, x=5, y=6) is None
+    assert respx_mock.calls.call_count == 1
+    await service.close()
+
+
+@pytest.mark.asyncio
+async def test_interrupted_stream_leaves_no_cache_entry(tmp_path, respx_mock):
+    cache = FileCache(tmp_path, ttl_seconds=60)
+    service = NasaBroadcast(cache=cache)
+    layer = _gibs_layer()
+    url = service._build_gibs(layer, z=7, x=5, y=7, date_override=None)
+    respx_mock.get(url).mock(
+        return_value=httpx.Response(
+            200,
+            headers={"Content-Type": "image/png"},
+            stream=_ChunkedBody([b"partial"], error=httpx.ReadError("connection reset")),
+        )
+    )
+
+    download = await service.stream_tile(layer, z=7, x=5, y=7)
+    received = []
+    with pytest.raises(HTTPException):
+        async for chunk in download.iter_body():
+            received.append(chunk)
+
+    assert received == [b"partial"]
+    assert cache.get(service._cache_key(layer, 7, 5, 7), allow_stale=True) is None
+    assert not list(tmp_path.rglob("*.tmp"))
+    await service.close()
+
+
+@pytest.mark.asyncio
+async def test_cache_keys_and_ttls_follow_layer_temporal_resolution(tmp_path, respx_mock):
+    cache = FileCache(tmp_path, ttl_seconds=60)
+    service = NasaBroadcast(cache=cache)
+    trek = get_layer("trek:Moon:LRO_LOLA_ClrShade_Global_128ppd_v04")
+    monthly = replace(get_layer("gibs:MODIS_Terra_CorrectedReflectance_TrueColor"), temporal=TEMPORAL_MONTHLY)
+
+    assert service._cache_key(trek, 2, 1, 1, DateType(2024, 5, 1)) == service._cache_key(trek, 2, 1, 1)
+    assert service._cache_key(monthly, 2, 1, 1, DateType(2024, 5, 17)).endswith(":2024-05-01:2:1:1")
+
+    layer = _gibs_layer()
+    today = DateType.today()
+    respx_mock.get(url__regex=r"https://gibs\.earthdata\.nasa\.gov/.*").mock(
+        return_value=httpx.Response(200, content=b"tile", headers={"Cache-Control": "max-age=60"})
+    )
+    _, past_headers = await service.get_tile(layer, z=2, x=1, y=1, date_override=DateType(2024, 5, 1))
+    _, today_headers = await service.get_tile(layer, z=2, x=1, y=1, date_override=today)
+
+    assert past_headers["Cache-Control"].endswith("immutable")
+    assert today_headers["Cache-Control"] == "max-age=60"
+    past = cache.get(service._cache_key(layer, 2, 1, 1, DateType(2024, 5, 1)))
+    current = cache.get(service._cache_key(layer, 2, 1, 1, today))
+    assert past.expires_at - current.expires_at > 24 * 3600
+    await service.close()
+
+
+def test_rekey_moves_dated_trek_entries_to_static_key(tmp_path):
+    cache = FileCache(tmp_path, ttl_seconds=60)
+    service = NasaBroadcast(cache=cache)
+    layer_key = "trek:Mars:Mars_MGS_MOLA_ClrShade_merge_global_463m"
+    cache.set(f"{layer_key}:2024-05-01:3:2:1", b"old", {"Content-Type": "image/jpeg"})
+    cache.set(f"{layer_key}:2024-05-02:3:2:1", b"old", {"Content-Type": "image/jpeg"})
+    cache.set("gibs:MODIS_Terra_CorrectedReflectance_TrueColor:2024-05-01:3:2:1", b"daily", {})
+
+    assert cache.rekey(service.normalize_cache_key) == 1
+
+    assert cache.get(f"{layer_key}:static:3:2:1").body == b"old"
+    assert cache.get(f"{layer_key}:2024-05-01:3:2:1") is None
+    assert cache.get(f"{layer_key}:2024-05-02:3:2:1") is None
+    assert cache.get("gibs:MODIS_Terra_CorrectedReflectance_TrueColor:2024-05-01:3:2:1").body == b"daily"
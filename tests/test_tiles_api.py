@@ -0,0 +1,344 @@
+from __future__ import annotations
+
+import io
+import json
+import struct
+import sys
+import time
+from datetime import date as DateType
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from app.broadcast.nasa import NasaBroadcast
+from app.cache import FileCache, MemoryCache
+from app.cache_index import INDEX_FILENAME, CacheKeyIndex
+from app.core.config import settings
+from app.layers_catalog import get_layer
+from app.responses import ZERO_COPY_EXTENSION, CachedFileResponse
+from app.static_map import render_cache
+
+LAYER_KEY = "gibs:MODIS_Terra_CorrectedReflectance_TrueColor"
+TILE_URL = f"/v1/layers/{LAYER_KEY}/tiles/3/2/1?date=2024-05-01"
+
+
+@pytest.fixture
+def tile_client(tmp_path, monkeypatch):
+    import app.api.routes.cache_admin as cache_admin_routes
+    import app.api.routes.tiles as tiles_routes
+    import app.main as app_main
+
+    cache = FileCache(tmp_path, ttl_seconds=60, key_index=CacheKeyIndex(tmp_path / INDEX_FILENAME))
+    broadcast = NasaBroadcast(cache=cache)
+    monkeypatch.setattr(tiles_routes, "get_nasa_broadcast", lambda: broadcast)
+    monkeypatch.setattr(cache_admin_routes, "get_nasa_broadcast", lambda: broadcast)
+    headers = {"Origin": settings.allowed_origins[0]}
+    with TestClient(app_main.app) as client:
+        yield client, headers, broadcast, cache
+    cache.close()
+
+
+def _cache_tile(broadcast: NasaBroadcast, cache: FileCache, body: bytes) -> None:
+    layer = get_layer(LAYER_KEY)
+    cache.set(
+        broadcast._cache_key(layer, 3, 2, 1, DateType(2024, 5, 1)),
+        body,
+        {"Content-Type": "image/jpeg", "ETag": '"v1"', "Cache-Control": "public, max-age=60"},
+    )
+
+
+def test_cache_hit_is_served_from_file(tile_client):
+    client, headers, broadcast, cache = tile_client
+    body = bytes(range(256)) * 1024
+    _cache_tile(broadcast, cache, body)
+
+    response = client.get(TILE_URL, headers=headers)
+
+    assert response.status_code == 200
+    assert response.content == body
+    assert response.headers["content-type"] == "image/jpeg"
+    assert response.headers["content-length"] == str(len(body))
+    assert response.headers["etag"] == '"v1"'
+
+
+def test_memory_tier_hit_skips_the_disk_thread_pool(tile_client, monkeypatch):
+    client, headers, broadcast, cache = tile_client
+    cache.memory = MemoryCache(max_bytes=1024)
+    _cache_tile(broadcast, cache, b"hot-tile")
+
+    async def no_disk(*args, **kwargs):
+        raise AssertionError("un tile caliente no debe pasar por el pool de hilos")
+
+    monkeypatch.setattr(cache, "_run_io", no_disk)
+    response = client.get(TILE_URL, headers=headers)
+    assert response.status_code == 200
+    assert response.content == b"hot-tile"
+    assert response.headers["etag"] == '"v1"'
+
+    response = client.get(TILE_URL, headers={**headers, "If-None-Match": '"v1"'})
+    assert response.status_code == 304
+
+
+def test_matching_validator_returns_304(tile_client):
+    client, headers, broadcast, cache = tile_client
+    _cache_tile(broadcast, cache, b"tile")
+
+    response = client.get(TILE_URL, headers={**headers, "If-None-Match": '"v1"'})
+
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == '"v1"'
+
+
+def test_cache_admin_purges_a_single_date(tile_client):
+    client, headers, broadcast, cache = tile_client
+    _cache_tile(broadcast, cache, b"tile")
+    params = {"layerKey": LAYER_KEY, "date": "2024-05-01"}
+
+    forbidden = client.delete("/v1/admin/cache/entries", params=params, headers=headers)
+    assert forbidden.status_code == 403
+
+    listed = client.get("/v1/admin/cache/entries", params={**params, "secret": "qminds"}, headers=headers)
+    assert [item["key"] for item in listed.json()["items"]] == [f"{LAYER_KEY}:2024-05-01:3:2:1"]
+
+    purged = client.delete("/v1/admin/cache/entries", params={**params, "secret": "qminds"}, headers=headers)
+    assert purged.status_code == 200
+    assert purged.json()["entries"] == 1
+
+    stats = client.get("/v1/admin/cache/stats", params={"secret": "qminds"}, headers=headers).json()
+    assert LAYER_KEY not in stats["layers"]
+
+
+@pytest.mark.asyncio
+async def test_zero_copy_extension_receives_file_range(tmp_path):
+    cache = FileCache(tmp_path, ttl_seconds=60)
+    cache.set("layer:2024-01-01:0:0:0", b"payload", {"ETag": '"v1"'})
+    cached = cache.open("layer:2024-01-01:0:0:0")
+    assert cached is not None
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    response = CachedFileResponse(cached, media_type="image/png")
+    await response({"type": "http", "extensions": {ZERO_COPY_EXTENSION: {}}}, None, send)
+
+    zero_copy = messages[1]
+    assert zero_copy["type"] == ZERO_COPY_EXTENSION
+    assert zero_copy["count"] == len(b"payload")
+    assert cached.handle.closed
+
+
+def _decode_bundle(raw: bytes) -> list:
+    frames, offset = [], 0
+    while offset < len(raw):
+        (meta_len,) = struct.unpack_from(">I", raw, offset)
+        meta = json.loads(raw[offset + 4 : offset + 4 + meta_len])
+        offset += 4 + meta_len
+        (body_len,) = struct.unpack_from(">I", raw, offset)
+        frames.append((meta, raw[offset + 4 : offset + 4 + body_len]))
+        offset += 4 + body_len
+    return frames
+
+
+def test_batch_endpoint_streams_cached_and_fetched_tiles(tile_client, respx_mock):
+    client, headers, broadcast, cache = tile_client
+    _cache_tile(broadcast, cache, b"cached")
+    layer = get_layer(LAYER_KEY)
+    respx_mock.get(broadcast._build_gibs(layer, 3, 3, 1, DateType(2024, 5, 1))).mock(
+        return_value=httpx.Response(200, content=b"fetched", headers={"Content-Type": "image/jpeg"})
+    )
+    respx_mock.get(broadcast._build_gibs(layer, 3, 4, 1, DateType(2024, 5, 1))).mock(
+        return_value=httpx.Response(500)
+    )
+
+    response = client.post(
+        f"/v1/layers/{LAYER_KEY}/tiles",
+        json={"date": "2024-05-01", "tiles": [{"z": 3, "x": 2, "y": 1}, {"z": 3, "x": 3, "y": 1}, {"z": 3, "x": 4, "y": 1}]},
+        headers=headers,
+    )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-tile-bundle"
+    frames = {(meta["x"], meta["status"]): body for meta, body in _decode_bundle(response.content)}
+    assert frames == {(2, 200): b"cached", (3, 200): b"fetched", (4, 502): b""}
+
+
+def test_batch_endpoint_rejects_oversized_bbox(tile_client, monkeypatch):
+    client, headers, _, _ = tile_client
+    monkeypatch.setattr(settings, "tile_batch_max_tiles", 4)
+
+    response = client.post(
+        f"/v1/layers/{LAYER_KEY}/tiles",
+        json={"date": "2024-05-01", "zoom": 3, "bbox": {"minLon": -180, "minLat": -80, "maxLon": 180, "maxLat": 80}},
+        headers=headers,
+    )
+
+    assert response.status_code == 400
+    assert response.json()["detail"]["code"] == "too_many_tiles"
+
+
+def test_cache_admin_warmup_job_reports_progress(tile_client, respx_mock):
+    client, headers, broadcast, cache = tile_client
+    respx_mock.get(url__regex=r"https://gibs\.earthdata\.nasa\.gov/.*").mock(
+        return_value=httpx.Response(200, content=b"tile", headers={"Content-Type": "image/jpeg"})
+    )
+    payload = {
+        "layerKeys": [LAYER_KEY],
+        "dates": ["2024-05-01"],
+        "bbox": {"minLon": -180, "minLat": -80, "maxLon": 180, "maxLat": 80},
+        "maxZoom": 1,
+    }
+
+    started = client.post("/v1/admin/cache/warmup", params={"secret": "qminds"}, json=payload, headers=headers)
+    assert started.status_code == 202
+
+    job_url = f"/v1/admin/cache/jobs/{started.json()['id']}"
+    for _ in range(100):
+        job = client.get(job_url, params={"secret": "qminds"}, headers=headers).json()
+        if job["status"] != "running":
+            break
+        time.sleep(0.02)
+    assert job["status"] == "completed"
+    assert job["result"]["fetched"] == 5
+    assert client.get("/v1/admin/cache/jobs/missing", params={"secret": "qminds"}, headers=headers).status_code == 404
+
+
+def test_cold_miss_is_streamed_when_passthrough_enabled(tile_client, respx_mock, monkeypatch):
+    client, headers, broadcast, cache = tile_client
+    monkeypatch.setattr(settings, "tile_stream_passthrough", True)
+    layer = get_layer(LAYER_KEY)
+    respx_mock.get(broadcast._build_gibs(layer, 3, 2, 1, DateType(2024, 5, 1))).mock(
+        return_value=httpx.Response(200, content=b"streamed", headers={"Content-Type": "image/jpeg"})
+    )
+
+    response = client.get(TILE_URL, headers=headers)
+
+    assert response.status_code == 200
+    assert response.content == b"streamed"
+    assert response.headers["content-type"] == "image/jpeg"
+    assert broadcast.stats()["upstream"]["streamed"] == 1
+    assert cache.get(broadcast._cache_key(layer, 3, 2, 1, DateType(2024, 5, 1))).body == b"streamed"
+
+
+def test_static_map_stitches_crops_and_caches_the_render(tile_client, respx_mock):
+    Image = pytest.importorskip("PIL.Image")
+    client, headers, broadcast, cache = tile_client
+    render_cache.clear()
+    layer = get_layer(LAYER_KEY)
+    colors = {(0, 0): (255, 0, 0), (1, 0): (0, 255, 0), (0, 1): (0, 0, 255), (1, 1): (255, 255, 0)}
+    for (x, y), color in colors.items():
+        tile = io.BytesIO()
+        Image.new("RGB", (256, 256), color).save(tile, format="PNG")
+        respx_mock.get(broadcast._build_gibs(layer, 1, x, y, DateType(2024, 5, 1))).mock(
+            return_value=httpx.Response(200, content=tile.getvalue(), headers={"Content-Type": "image/png"})
+        )
+    params = {"bbox": "-90,-40,90,40", "zoom": 1, "date": "2024-05-01"}
+
+    response = client.get(f"/v1/layers/{LAYER_KEY}/static", params=params, headers=headers)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/png"
+    image = Image.open(io.BytesIO(response.content)).convert("RGB")
+    assert image.width == 256
+    assert image.getpixel((0, 0)) == colors[(0, 0)]
+    assert image.getpixel((image.width - 1, image.height - 1)) == colors[(1, 1)]
+    assert respx_mock.calls.call_count == 4
+
+    again = client.get(
+        f"/v1/layers/{LAYER_KEY}/static",
+        params=params,
+        headers={**headers, "If-None-Match": response.headers["etag"]},
+    )
+    assert again.status_code == 304
+    assert respx_mock.calls.call_count == 4
+
+
+def test_static_map_requires_pillow(tile_client, monkeypatch):
+    client, headers, _, _ = tile_client
+    render_cache.clear()
+    monkeypatch.setitem(sys.modules, "PIL", None)
+
+    params = {"bbox": "-90,-40,90,40", "zoom": 1, "date": "2024-05-01"}
+    response = client.get(f"/v1/layers/{LAYER_KEY}/static", params=params, headers=headers)
+
+    assert response.status_code == 503
+    assert response.json()["detail"]["code"] == "imaging_unavailable"
+
+
+@pytest.mark.parametrize("placeholder", [False, True])
+def test_static_map_leaves_missing_tiles_transparent(tile_client, respx_mock, placeholder):
+    Image = pytest.importorskip("PIL.Image")
+    client, headers, broadcast, _ = tile_client
+    render_cache.clear()
+    broadcast.serve_placeholder = placeholder
+    layer = get_layer(LAYER_KEY)
+    for x, y in ((0, 0), (1, 0), (0, 1)):
+        tile = io.BytesIO()
+        Image.new("RGB", (256, 256), (255, 0, 0)).save(tile, format="PNG")
+        respx_mock.get(broadcast._build_gibs(layer, 1, x, y, DateType(2024, 5, 1))).mock(
+            return_value=httpx.Response(200, content=tile.getvalue(), headers={"Content-Type": "image/png"})
+        )
+    respx_mock.get(broadcast._build_gibs(layer, 1, 1, 1, DateType(2024, 5, 1))).mock(return_value=httpx.Response(404))
+
+    params = {"bbox": "-90,-40,90,40", "zoom": 1, "date": "2024-05-01"}
+    response = client.get(f"/v1/layers/{LAYER_KEY}/static", params=params, headers=headers)
+
+    assert response.status_code == 200
+    image = Image.open(io.BytesIO(response.content)).convert("RGBA")
+    assert image.getpixel((0, 0)) == (255, 0, 0, 255)
+    assert image.getpixel((image.width - 1, image.height - 1))[3] == 0
+
+
+def test_series_streams_frames_in_date_order_and_skips_missing_dates(tile_client, respx_mock):
+    client, headers, broadcast, cache = tile_client
+    _cache_tile(broadcast, cache, b"cached")
+    layer = get_layer(LAYER_KEY)
+    for day, response in (
+        (2, httpx.Response(200, content=b"day-2", headers={"Content-Type": "image/jpeg"})),
+        (3, httpx.Response(404)),
+        (4, httpx.Response(200, content=b"day-4", headers={"Content-Type": "image/jpeg"})),
+    ):
+        respx_mock.get(broadcast._build_gibs(layer, 3, 2, 1, DateType(2024, 5, day))).mock(return_value=response)
+    series_url = f"/v1/layers/{LAYER_KEY}/tiles/3/2/1/series"
+    params = {"start": "2024-05-01", "end": "2024-05-04"}
+
+    response = client.get(series_url, params=params, headers=headers)
+
+    assert response.status_code == 200
+    assert response.headers["x-tile-count"] == "4"
+    frames = [(meta["date"], body) for meta, body in _decode_bundle(response.content)]
+    assert frames == [("2024-05-01", b"cached"), ("2024-05-02", b"day-2"), ("2024-05-04", b"day-4")]
+    assert respx_mock.calls.call_count == 3
+
+    # El 404 quedo como entrada negativa: la segunda serie no vuelve a pedirlo.
+    again = client.get(series_url, params=params, headers=headers)
+    assert [meta["date"] for meta, _ in _decode_bundle(again.content)] == ["2024-05-01", "2024-05-02", "2024-05-04"]
+    assert respx_mock.calls.call_count == 3
+    assert broadcast.stats()["upstream"]["negativeHits"] == 1
+
+    too_long = client.get(series_url, params={"start": "2000-01-01", "end": "2024-01-01"}, headers=headers)
+    assert too_long.status_code == 400
+    assert too_long.json()["detail"]["code"] == "too_many_frames"
+
+
+def test_streamed_empty_body_without_length_is_a_missing_tile(tile_client, respx_mock, monkeypatch):
+    client, headers, broadcast, cache = tile_client
+    monkeypatch.setattr(settings, "tile_stream_passthrough", True)
+    layer = get_layer(LAYER_KEY)
+
+    async def empty_chunks():
+        yield b""
+
+    # Cuerpo por bloques sin Content-Length: recien al final se sabe que vino vacio.
+    respx_mock.get(broadcast._build_gibs(layer, 3, 2, 1, DateType(2024, 5, 1))).mock(
+        return_value=httpx.Response(200, content=empty_chunks(), headers={"Content-Type": "image/jpeg"})
+    )
+
+    response = client.get(TILE_URL, headers=headers)
+
+    assert response.status_code == 502
+    assert response.json()["detail"]["code"] == "nasa_bad_response"
+    assert broadcast.stats()["upstream"]["streamed"] == 1
+    assert "X-Nasa-Status" in cache.get(broadcast._cache_key(layer, 3, 2, 1, DateType(2024, 5, 1))).headers
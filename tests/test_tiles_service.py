@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+from datetime import date as DateType
+
+import pytest
+
+from app.broadcast.nasa import NasaBroadcast
+from app.cache import FileCache
+from app.layers_catalog import get_layer
+from app.services.tiles import TileService, is_not_modified
+from app.tiling import BBox, tiles_in_bbox
+
+LAYER_KEY = "gibs:MODIS_Terra_CorrectedReflectance_TrueColor"
+
+
+@pytest.mark.asyncio
+async def test_matching_etag_answers_not_modified_without_reading_payload(tmp_path, monkeypatch):
+    cache = FileCache(tmp_path, ttl_seconds=60)
+    broadcast = NasaBroadcast(cache=cache)
+    layer = get_layer(LAYER_KEY)
+    cache.set(
+        broadcast._cache_key(layer, 2, 1, 1, DateType(2024, 5, 1)),
+        b"tile",
+        {"Content-Type": "image/jpeg", "ETag": '"abc"'},
+    )
+
+    def fail_load(*args, **kwargs):
+        raise AssertionError("payload should not be read")
+
+    monkeypatch.setattr(cache, "_load", fail_load)
+    result = await TileService(broadcast).fetch_tile(
+        LAYER_KEY, 2, 1, 1, DateType(2024, 5, 1), if_none_match='W/"other", "abc"'
+    )
+
+    assert result.not_modified
+    assert result.body is None
+    assert result.headers["ETag"] == '"abc"'
+    await broadcast.close()
+
+
+@pytest.mark.asyncio
+async def test_cached_entries_without_upstream_etag_get_content_etag(tmp_path):
+    cache = FileCache(tmp_path, ttl_seconds=60)
+    broadcast = NasaBroadcast(cache=cache)
+    layer = get_layer(LAYER_KEY)
+    cache.set(broadcast._cache_key(layer, 2, 1, 1, DateType(2024, 5, 1)), b"tile", {"Content-Type": "image/jpeg"})
+    service = TileService(broadcast)
+
+    first = await service.fetch_tile(LAYER_KEY, 2, 1, 1, DateType(2024, 5, 1))
+    assert first.body == b"tile"
+    assert first.headers["ETag"].startswith('"sha256-')
+
+    second = await service.fetch_tile(
+        LAYER_KEY, 2, 1, 1, DateType(2024, 5, 1), if_none_match=first.headers["ETag"]
+    )
+    assert second.not_modified
+    await broadcast.close()
+
+
+def test_if_modified_since_is_ignored_when_if_none_match_is_present():
+    headers = {"ETag": '"v2"', "Last-Modified": "Mon, 01 Jan 2024 00:00:00 GMT"}
+    assert is_not_modified(headers, None, "Tue, 02 Jan 2024 00:00:00 GMT")
+    assert not is_not_modified(headers, None, "Sun, 31 Dec 2023 00:00:00 GMT")
+    assert not is_not_modified(headers, '"v1"', "Tue, 02 Jan 2024 00:00:00 GMT")
+    assert is_not_modified(headers, "*", None)
+
+
+def test_tiles_in_bbox_for_mercator_and_geographic_grids():
+    bbox = BBox(min_lon=-10, min_lat=-10, max_lon=10, max_lat=10)
+    assert sorted(tiles_in_bbox("EPSG:3857", bbox, 1)) == [(1, 0, 0), (1, 0, 1), (1, 1, 0), (1, 1, 1)]
+    assert sorted(tiles_in_bbox("EPSG:4326", bbox, 0)) == [(0, 0, 0), (0, 1, 0)]
+    assert list(tiles_in_bbox("EPSG:3857", BBox(0, 0, 180, 85), 1)) == [(1, 1, 0)]